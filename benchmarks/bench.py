@@ -0,0 +1,245 @@
+"""
+
+bench.py
+
+end-to-end benchmarks of marktips against an in-process fake DVID server
+(see fakedvid.py), on synthetic bodies of increasing size; timings are
+compared against stored baselines, and the script exits with status 1 if
+any benchmark is slower than its baseline by more than the tolerance
+
+benchmarks, for each body size n (skeleton nodes):
+    findtips-n      tip detection, including RoI filtering (needs dvidtools)
+    placetodos-n    first placement of to do items on the body
+    reconcile-n     placement again, when the body already has all its to do items
+    history-n       history of the body's marktips runs
+    replay-b        a whole recorded run on body b (marktips --record), served
+                    from the archive with its recorded latencies, scaled
+
+usage, from the repository root with marktips installed:
+    python benchmarks/bench.py                          # compare to baselines
+    python benchmarks/bench.py --update                 # record new baselines
+    python benchmarks/bench.py --sizes 1000 10000000 --latency 0.005
+    python benchmarks/bench.py --sizes --replay body1.zip body2.zip --replay-latency 0
+
+baselines are stored per fake DVID latency in baselines.json, next to this
+script; the checked-in ones are from a development machine, and timings are
+machine-specific, so record your own (--update) before comparing on another
+machine
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import argparse
+import json
+import os
+import sys
+import time
+
+# local
+import fakedvid
+from marktips.marktips import TipDetector, hasDVIDtools, setadapter
+from marktips.replay import TrafficReplayer
+from marktips.marktipshistory import MarktipsHistoryFinder
+
+
+# ------------------------------ constants ------------------------------
+defaultsizes = [1000, 10000, 100000]
+defaultbaselines = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+defaulttolerance = 0.25
+
+uuid = "benchmark"
+todoinstance = "segmentation_todo"
+username = "benchmark"
+
+# fraction of tips that get some other kind of to do placed first, so
+#   placement has to work around them
+othertodofraction = 0.1
+
+
+# ------------------------------ code ------------------------------
+class Benchmarks:
+    def __init__(self, sizes, latency=0.0, repeat=3, replays=(), replaylatency=1.0):
+        """
+        input: list of body sizes (skeleton nodes); seconds of fake DVID
+            latency per request; number of times to run each benchmark;
+            list of recorded run archives to replay; factor for their latencies
+        """
+        self.sizes = sizes
+        self.replays = replays
+        self.replaylatency = replaylatency
+        self.repeat = repeat
+        self.fake = fakedvid.FakeDVID(latency)
+        self.serverport = None
+
+        # name: best time (s)
+        self.timings = {}
+        self.skipped = {}
+
+    def run(self):
+        """
+        output: dict of benchmark name: best time (s)
+        """
+        for index, size in enumerate(self.sizes):
+            self.fake.addbody(index + 1, size)
+        self.serverport = self.fake.start()
+        try:
+            for index, size in enumerate(self.sizes):
+                bodyid = str(index + 1)
+                self.benchfindtips(bodyid, size)
+                self.benchplacement(bodyid, size)
+                self.benchhistory(bodyid, size)
+        finally:
+            self.fake.stop()
+
+        # replays go last, since they take over the DVID session
+        for path in self.replays:
+            self.benchreplay(path)
+        return self.timings
+
+    def time(self, name, function, setup=None):
+        """
+        time function(), best of self.repeat runs; setup(), if given, is
+        run untimed before each one
+        """
+        best = None
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            t1 = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - t1
+            best = elapsed if best is None else min(best, elapsed)
+        self.timings[name] = best
+        print("{:<24} {:10.4f}s".format(name, best), file=sys.stderr)
+
+    def detector(self, bodyid, roi=None):
+        return TipDetector(self.serverport, uuid, bodyid, todoinstance, username, roi=roi)
+
+    def benchfindtips(self, bodyid, size):
+        name = "findtips-{}".format(size)
+        if not hasDVIDtools:
+            self.skipped[name] = "could not import dvid_tools library"
+            return
+        self.time(name, lambda: self.detector(bodyid, roi="left").findtips(False))
+
+    def benchplacement(self, bodyid, size):
+        tips = self.fake.tips(bodyid)
+        nother = int(len(tips) * othertodofraction)
+        othertodos = [{"Kind": "Note", "Pos": tip, "Prop": {"action": "merge"}, "Tags": []}
+            for tip in tips[:nother]]
+
+        def reset():
+            self.fake.clearbody(bodyid)
+            self.fake.addannotations(othertodos)
+
+        def place():
+            # as findtips() would have left it
+            detector = self.detector(bodyid)
+            detector.parameters["body ID"] = bodyid
+            detector.locations = [list(tip) for tip in tips]
+            detector.placetodos(True)
+        self.time("placetodos-{}".format(size), place, reset)
+
+        # the body now has all its to do items, so this placement only reconciles
+        self.time("reconcile-{}".format(size), place)
+
+    def benchhistory(self, bodyid, size):
+        finder = MarktipsHistoryFinder(self.serverport, uuid, bodyid, todoinstance)
+        self.time("history-{}".format(size), finder.gethistory)
+
+    def benchreplay(self, path):
+        replayer = TrafficReplayer(path, self.replaylatency)
+        setadapter(replayer)
+        args = replayer.meta["arguments"]
+
+        def run():
+            detector = TipDetector(args["serverport"], args["uuid"], args["bodyid"], args["todoinstance"],
+                args["username"], args["indexing"], args["roi"], args["excluded_roi"], args["run_instance"])
+            detector.run(args["find_only"], False, args["save_parameters"])
+        self.time("replay-{}".format(args["bodyid"]), run, replayer.rewind)
+        if replayer.nmissed:
+            print("{}: {} calls not in the recording".format(path, replayer.nmissed), file=sys.stderr)
+
+
+def compare(timings, baselines, tolerance):
+    """
+    input: dict of name: time for this run; same for the baselines; allowed
+        fractional slowdown
+    output: list of names of benchmarks that regressed
+    """
+    regressions = []
+    for name, elapsed in timings.items():
+        if name not in baselines:
+            print("{:<24} no baseline".format(name), file=sys.stderr)
+            continue
+        change = elapsed / baselines[name] - 1 if baselines[name] > 0 else 0.0
+        regressed = change > tolerance
+        if regressed:
+            regressions.append(name)
+        print("{:<24} {:10.4f}s vs {:10.4f}s  {:+7.1%}{}".format(name, elapsed, baselines[name],
+            change, "  REGRESSION" if regressed else ""), file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark marktips against a fake DVID server")
+    parser.add_argument("--sizes", type=int, nargs="*", default=defaultsizes,
+        help="body sizes in skeleton nodes (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.0,
+        help="seconds of latency the fake DVID adds to each request (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+        help="runs of each benchmark; the best time is kept (default: %(default)s)")
+    parser.add_argument("--replay", nargs="+", default=[],
+        help="also benchmark these recorded runs (from marktips --record)")
+    parser.add_argument("--replay-latency", type=float, default=1.0,
+        help="multiply the recorded latencies by this (0 for none; default: %(default)s)")
+    parser.add_argument("--baselines", default=defaultbaselines,
+        help="json file of baseline timings (default: %(default)s)")
+    parser.add_argument("--tolerance", type=float, default=defaulttolerance,
+        help="allowed fractional slowdown before failing (default: %(default)s)")
+    parser.add_argument("--update", action="store_true",
+        help="write this run's timings to the baselines file instead of comparing")
+    parser.add_argument("--output", help="also write this run's timings as json to this file")
+    args = parser.parse_args()
+
+    benchmarks = Benchmarks(args.sizes, args.latency, args.repeat, args.replay, args.replay_latency)
+    timings = benchmarks.run()
+    for name, reason in benchmarks.skipped.items():
+        print("{:<24} skipped: {}".format(name, reason), file=sys.stderr)
+
+    result = {
+        "timings": timings,
+        "skipped": benchmarks.skipped,
+        "latency": args.latency,
+        "replay latency": args.replay_latency,
+        "regressions": [],
+    }
+    # timings only compare at the same latency, so baselines are kept per latency
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    latencykey = str(args.latency)
+    if args.replay:
+        latencykey += " replay {}".format(args.replay_latency)
+    if args.update:
+        baselines.setdefault(latencykey, {}).update(timings)
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+    elif latencykey in baselines:
+        result["regressions"] = compare(timings, baselines[latencykey], args.tolerance)
+    else:
+        print("no baselines for latency {} in {}; run with --update to record them".format(latencykey,
+            args.baselines), file=sys.stderr)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    print(json.dumps(result))
+    sys.exit(1 if result["regressions"] else 0)
+
+
+# ------------------------------ script starts here ------------------------------
+if __name__ == "__main__":
+    main()
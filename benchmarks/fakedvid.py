@@ -0,0 +1,270 @@
+"""
+
+fakedvid.py
+
+an in-process stand-in for the parts of DVID that marktips uses, for
+benchmarks; bodies are synthetic, and each body lives in its own slab of
+x, so the label at a point is x // bodywidth
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import http.server
+import io
+import json
+import random
+import struct
+import tarfile
+import threading
+import time
+import urllib.parse
+
+
+# ------------------------------ constants ------------------------------
+bodywidth = 100000
+
+# the "left" RoI is the lower half of each body's slab
+rois = {
+    "left": lambda point: point[0] % bodywidth < bodywidth // 2,
+}
+
+
+# ------------------------------ code ------------------------------
+def makeswc(bodyid, nnodes, seed=None, mutationid=1):
+    """
+    input: body ID; number of nodes; random seed; mutation ID the skeleton
+        was made at (in its header, as the skeletonizer writes it)
+    output: SWC text of a random tree inside the body's slab
+    """
+    rng = random.Random(bodyid if seed is None else seed)
+    x0 = bodyid * bodywidth
+    lines = ['# {{"mutation id": {}}}'.format(mutationid)]
+    positions = [(x0 + bodywidth // 2, 50000, 50000)]
+    lines.append("1 0 {} {} {} 10 -1".format(*positions[0]))
+    for node in range(2, nnodes + 1):
+        # mostly extend recent nodes, so the tree has long branches and some tips
+        parent = rng.randint(max(1, node - 20), node - 1)
+        px, py, pz = positions[parent - 1]
+        position = (min(x0 + bodywidth - 1, max(x0, px + rng.randint(-40, 40))),
+            py + rng.randint(-40, 40), pz + rng.randint(-40, 40))
+        positions.append(position)
+        lines.append("{} 0 {} {} {} 5 {}".format(node, *position, parent))
+    return "\n".join(lines) + "\n"
+
+
+class FakeDVID:
+    def __init__(self, latency=0.0, segmentation="segmentation"):
+        """
+        input: seconds of latency added to every request; segmentation instance name
+        """
+        self.latency = latency
+        self.segmentation = segmentation
+        self.lock = threading.Lock()
+        self.skeletons = {}
+        # body ID: list of annotations, so to do retrieval by body stays cheap
+        self.annotations = {}
+        self.keyvalues = {}
+        # the segmentation's mutation log
+        self.mutations = []
+        self.requestcounts = {}
+        # endpoint: query of the last request to it
+        self.queries = {}
+        # "instance/endpoint/..." path: (status, bytes) to answer with instead
+        self.failures = {}
+        self.server = None
+
+    def addbody(self, bodyid, nnodes, mutationid=1):
+        self.skeletons[int(bodyid)] = makeswc(int(bodyid), nnodes, mutationid=mutationid).encode()
+
+    def addmutation(self, mutation):
+        """
+        input: mutation dict, as in DVID's mutation log
+        """
+        with self.lock:
+            self.mutations.append(dict(mutation, MutationID=len(self.mutations) + 2))
+            return self.mutations[-1]["MutationID"]
+
+    def label(self, point):
+        return int(point[0]) // bodywidth
+
+    def tips(self, bodyid):
+        """
+        output: list of [x, y, z] locations of the leaf nodes of the body's skeleton
+        """
+        positions = {}
+        parents = set()
+        for line in self.skeletons[int(bodyid)].decode().splitlines():
+            if line.startswith("#"):
+                continue
+            fields = line.split()
+            positions[fields[0]] = [int(float(v)) for v in fields[2:5]]
+            parents.add(fields[6])
+        return [position for node, position in positions.items() if node not in parents]
+
+    def addannotations(self, annlist):
+        with self.lock:
+            for annotation in annlist:
+                self.annotations.setdefault(self.label(annotation["Pos"]), []).append(annotation)
+
+    def clearbody(self, bodyid):
+        """
+        remove all annotations on the body
+        """
+        with self.lock:
+            self.annotations.pop(int(bodyid), None)
+
+    def sparsevol(self, bodyid, coarse):
+        """
+        output: legacy RLE sparse volume of the body's skeleton nodes, one
+            voxel (or one 64^3 block, if coarse) per node
+        """
+        points = set()
+        for line in self.skeletons[bodyid].decode().splitlines():
+            if line.startswith("#"):
+                continue
+            x, y, z = (int(float(v)) for v in line.split()[2:5])
+            points.add((x // 64, y // 64, z // 64) if coarse else (x, y, z))
+        data = [struct.pack("bbbbii", 0, 3, 0, 0, 0, len(points))]
+        data.extend(struct.pack("iiii", x, y, z, 1) for x, y, z in sorted(points))
+        return b"".join(data)
+
+    def start(self):
+        """
+        start serving on a free local port from a background thread
+
+        output: "http://127.0.0.1:port"
+        """
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                fake.handle(self, "GET")
+
+            def do_POST(self):
+                fake.handle(self, "POST")
+
+            def do_HEAD(self):
+                fake.handle(self, "HEAD")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def fail(self, path, status, data=b""):
+        """
+        input: path after the UUID, as "instance/endpoint/..."; HTTP status;
+            response body (eg, malformed JSON)
+        """
+        self.failures[path.strip("/")] = status, data
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler, method):
+        if self.latency:
+            time.sleep(self.latency)
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        url = urllib.parse.urlsplit(handler.path)
+        query = urllib.parse.parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        status, data, contenttype = 404, b"not found", "text/plain"
+        if len(parts) >= 5 and parts[:2] == ["api", "node"]:
+            instance, endpoint, rest = parts[3], parts[4], parts[5:]
+            with self.lock:
+                self.requestcounts[endpoint] = self.requestcounts.get(endpoint, 0) + 1
+                self.queries[endpoint] = query
+            if "/".join(parts[3:]) in self.failures:
+                result = self.failures["/".join(parts[3:])] + ("application/json",)
+            else:
+                result = self.route(method, instance, endpoint, rest, query, body)
+            if result is not None:
+                status, data, contenttype = result
+        handler.send_response(status)
+        handler.send_header("Content-Type", contenttype)
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        if method != "HEAD":
+            handler.wfile.write(data)
+
+    def route(self, method, instance, endpoint, rest, query, body):
+        """
+        output: (status, bytes, content type), or None for not found
+        """
+        jsontype = "application/json"
+        if instance == self.segmentation + "_skeletons" and endpoint == "key":
+            bodyid = int(rest[0].replace("_swc", ""))
+            if bodyid not in self.skeletons:
+                return 404, b"key not found", "text/plain"
+            return 200, self.skeletons[bodyid], "text/plain"
+        if instance == self.segmentation and endpoint == "info":
+            maxx = (max(self.skeletons) + 1) * bodywidth if self.skeletons else bodywidth
+            info = {"Extended": {"MinPoint": [0, 0, 0], "MaxPoint": [maxx, 100000, 100000],
+                "BlockSize": [64, 64, 64], "VoxelSize": [8, 8, 8], "MaxDownresLevel": 2}}
+            return 200, json.dumps(info).encode(), jsontype
+        if instance == self.segmentation and endpoint == "labels":
+            return 200, json.dumps([self.label(p) for p in json.loads(body)]).encode(), jsontype
+        if instance == self.segmentation and endpoint == "sizes":
+            sizes = [len(self.skeletons.get(int(b), b"")) for b in json.loads(body)]
+            return 200, json.dumps(sizes).encode(), jsontype
+        if instance == self.segmentation and endpoint in ["sparsevol", "sparsevol-coarse"]:
+            bodyid = int(rest[0])
+            if bodyid not in self.skeletons:
+                return 404, b"no such body", "text/plain"
+            return 200, self.sparsevol(bodyid, endpoint == "sparsevol-coarse"), "application/octet-stream"
+        if instance == self.segmentation and endpoint == "mutations":
+            start = int(query.get("start", ["0"])[0])
+            with self.lock:
+                found = [m for m in self.mutations if m["MutationID"] >= start]
+            return 200, json.dumps(found).encode(), jsontype
+        if instance == "bookmarks" and endpoint == "keyrange":
+            return 200, b"[]", jsontype
+        if instance in rois and endpoint == "info":
+            return 200, b"{}", jsontype
+        if instance in rois and endpoint == "ptquery":
+            return 200, json.dumps([rois[instance](p) for p in json.loads(body)]).encode(), jsontype
+        if endpoint == "key":
+            store = self.keyvalues.setdefault(instance, {})
+            if method == "POST":
+                store[rest[0]] = body
+                return 200, b"", "text/plain"
+            if rest[0] in store:
+                return 200, store[rest[0]], "application/octet-stream"
+            return 404, b"key not found", "text/plain"
+        if endpoint == "keyvalues":
+            if instance == self.segmentation + "_skeletons":
+                store = {"{}_swc".format(b): swc for b, swc in self.skeletons.items()}
+            else:
+                store = self.keyvalues.get(instance, {})
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode="w") as tar:
+                for key in json.loads(body):
+                    value = store.get(key, b"")
+                    info = tarfile.TarInfo(key)
+                    info.size = len(value)
+                    tar.addfile(info, io.BytesIO(value))
+            return 200, buffer.getvalue(), "application/x-tar"
+        if endpoint == "label" and method == "GET":
+            bodyid = int(rest[0])
+            with self.lock:
+                found = list(self.annotations.get(bodyid, []))
+            return 200, json.dumps(found).encode(), jsontype
+        if endpoint == "elements" and method == "POST":
+            self.addannotations(json.loads(body))
+            return 200, b"", "text/plain"
+        if endpoint == "elements" and method == "GET":
+            size = [int(v) for v in rest[0].split("_")]
+            offset = [int(v) for v in rest[1].split("_")]
+            with self.lock:
+                found = [a for annotations in self.annotations.values() for a in annotations
+                    if all(offset[i] <= a["Pos"][i] < offset[i] + size[i] for i in range(3))]
+            return 200, json.dumps(found).encode(), jsontype
+        return None
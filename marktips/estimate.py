@@ -0,0 +1,139 @@
+"""
+
+estimate.py
+
+estimates of what a batch will cost, from a run on a sample of its bodies
+
+the sample is run in find-only mode, so the time, DVID calls and bytes of
+finding tips are measured; placing the to do items is modeled from the
+number of tips found (one to do fetch and one post per body with tips),
+and its time isn't included in the run time
+
+when body sizes are known, the sample's totals are scaled by the ratio of
+all the bodies' voxels to the sample's, which follows the big bodies better
+than scaling by the number of bodies
+
+only the sampled bodies that succeeded are scaled up; those that failed
+are counted, but their partial runs would skew the averages
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import json
+import random
+
+# local
+from .marktips import todocomment
+
+
+# ------------------------------ code ------------------------------
+def todobytes(indexing="random", saveparameters=False):
+    """
+    input: indexing kind and flag for saving run parameters, as for the run
+    output: rough size in bytes of one to do item as posted, with the
+        properties TipDetector.maketodo() and addindexing() give it
+    """
+    prop = {"comment": todocomment, "user": "someuser", "checked": "0", "action": "tip detector"}
+    if saveparameters:
+        # assumes the run record was stored, so only the run ID is on each one
+        prop["run ID"] = "0123456789ab"
+    if indexing == "random":
+        prop["tip qc index"] = "10000"
+    return len(json.dumps({
+        "Kind": "Note",
+        "Prop": prop,
+        "Pos": [10000, 10000, 10000],
+        "Tags": ["action:tip_detector"],
+    }))
+
+
+def samplebodies(bodyids, fraction, seed=None):
+    """
+    input: list of body IDs; fraction to sample; optional random seed
+    output: list of sampled body IDs (at least one), in input order
+    """
+    n = min(len(bodyids), max(1, round(fraction * len(bodyids))))
+    chosen = set(random.Random(seed).sample(range(len(bodyids)), n))
+    return [bodyid for i, bodyid in enumerate(bodyids) if i in chosen]
+
+
+def measure(result, size=None):
+    """
+    input: one sampled body's result dict; its size in voxels, if known
+    output: dict of the body's measurements
+    """
+    endpoints = result["dvid"]["endpoints"]
+    skeleton = result.get("stages", {}).get("skeleton", {})
+    # the skeleton calls as counted by the request statistics, whoever made them
+    skeletoncalls = endpoints.get("skeleton", {"count": 0, "bytes sent": 0, "bytes received": 0})
+    return {
+        "time": result.get("ttotal", 0.0),
+        "requests": sum(endpoint["count"] for endpoint in endpoints.values()),
+        "bytes": sum(endpoint["bytes sent"] + endpoint["bytes received"] for endpoint in endpoints.values()),
+        "skeleton nodes": skeleton.get("points", 0),
+        "skeleton requests": skeletoncalls["count"],
+        "skeleton bytes": skeletoncalls["bytes sent"] + skeletoncalls["bytes received"],
+        "tips": result.get("nlocationsRoI", 0),
+        "size": size,
+        "status": result["status"],
+    }
+
+
+def extrapolate(samples, nbodies, workers, sizes=None, todosize=None):
+    """
+    input: list of measurement dicts, one per sampled body; number of bodies
+        in the batch; number of bodies run at once; optional dict of body ID:
+        size in voxels for all bodies in the batch; bytes per to do item
+        (default: as from todobytes())
+    output: estimate dict; None if no sampled body succeeded
+    """
+    if todosize is None:
+        todosize = todobytes()
+    nfailed = sum(1 for sample in samples if not sample["status"])
+    samples = [sample for sample in samples if sample["status"]]
+    if not samples:
+        return None
+    totals = {key: sum(sample[key] for sample in samples)
+        for key in ["time", "requests", "bytes", "skeleton nodes", "skeleton requests", "skeleton bytes", "tips"]}
+
+    samplesize = sum(sample["size"] or 0 for sample in samples)
+    if sizes is not None and samplesize > 0:
+        method = "voxels"
+        scale = sum(sizes.values()) / samplesize
+        # the biggest body sets a floor on the run time, however many workers
+        longest = max(sizes.values()) * totals["time"] / samplesize
+    else:
+        method = "bodies"
+        scale = nbodies / len(samples)
+        longest = max(sample["time"] for sample in samples)
+
+    # placing: a to do fetch and a post per body with tips, each tip a to do
+    bodieswithtips = scale * sum(1 for sample in samples if sample["tips"])
+    ntips = scale * totals["tips"]
+    bodytime = scale * totals["time"]
+    return {
+        "nbodies": nbodies,
+        "nsampled": len(samples) + nfailed,
+        "nfailed": nfailed,
+        "method": method,
+        "workers": workers,
+        "body time": bodytime,
+        "runtime": max(bodytime / workers, longest),
+        "longest body": longest,
+        "skeleton nodes": scale * totals["skeleton nodes"],
+        "skeleton requests": scale * totals["skeleton requests"],
+        "skeleton bytes": scale * totals["skeleton bytes"],
+        "tips": ntips,
+        "find": {
+            "requests": scale * totals["requests"],
+            "bytes": scale * totals["bytes"],
+        },
+        "place": {
+            "requests": 2 * bodieswithtips,
+            "bytes": ntips * todosize,
+        },
+        "requests": scale * totals["requests"] + 2 * bodieswithtips,
+        "bytes": scale * totals["bytes"] + ntips * todosize,
+    }
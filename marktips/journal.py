@@ -0,0 +1,100 @@
+"""
+
+journal.py
+
+an append-only journal of the bodies a batch has finished, so an interrupted
+batch can be resumed without running them again
+
+each finished body's result is appended as one json line, with the mode
+of the run (finding tips only, or placing to do items too), and flushed to
+disk before the batch moves on; a batch that dies partway through leaves at
+worst a partial last line, which is ignored when the journal is read
+
+on resume, a body is skipped only if it succeeded in a run whose mode
+covers the current one: a run that placed to do items covers both modes,
+but a find-only run doesn't cover a run that places them
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import json
+import os
+
+
+# ------------------------------ constants ------------------------------
+# run modes
+findonly = "find only"
+place = "place"
+
+# mode: modes of runs it can stand in for
+covers = {
+    findonly: [findonly],
+    place: [findonly, place],
+}
+
+
+# ------------------------------ code ------------------------------
+def runmode(find_only):
+    """
+    input: flag for a find-only run
+    output: run mode
+    """
+    return findonly if find_only else place
+
+
+class Journal:
+    def __init__(self, path, mode=place):
+        """
+        input: path to the journal; mode of this run
+        """
+        self.path = path
+        self.mode = mode
+        self.file = None
+
+    def read(self):
+        """
+        output: dict of body ID (as string): its result from the last successful
+            journaled run whose mode covers this run's, in the order first
+            finished; empty if there's no journal yet
+        """
+        results = {}
+        if not os.path.exists(self.path):
+            return results
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # cut off when the batch died
+                    continue
+                result = entry["result"]
+                if result["status"] and self.mode in covers.get(entry["mode"], []):
+                    results[str(result["body ID"])] = result
+        return results
+
+    def open(self):
+        """
+        open the journal for appending, creating it if needed
+        """
+        self.file = open(self.path, "a")
+        # start on a fresh line if the last one was cut off
+        if self.file.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")
+
+    def add(self, result):
+        """
+        record one finished body's result, on disk before returning
+        """
+        self.file.write(json.dumps({"mode": self.mode, "result": result}) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,205 @@
+"""
+
+limiter.py
+
+adaptive limits on DVID calls in flight, so batch runs take what DVID can
+give without slowing it down for everyone else
+
+reads and writes each have a limit on calls in flight, adjusted AIMD-style
+(like TCP congestion control): the limit grows by about one for each
+limit's worth of calls that come back quickly and without error, and is
+halved (at most once per latency target interval) when a call is slow or
+fails with a server error; there's also an optional hard cap on the rate
+of calls
+
+the state is kept in multiprocessing shared memory, so one set of limits
+can be shared by all the worker processes of a batch
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import argparse
+from contextlib import contextmanager
+import multiprocessing
+import time
+
+
+# ------------------------------ constants ------------------------------
+defaultlatencytarget = 2.0
+
+# status codes that mean DVID (or something in front of it) is struggling
+overloadstatuses = [429, 500, 502, 503, 504]
+
+# limits never go below this
+minimumlimit = 1.0
+
+
+# ------------------------------ code ------------------------------
+class AdaptiveLimit:
+    """
+    AIMD limit on calls in flight of one kind
+    """
+    def __init__(self, maximum, latencytarget=defaultlatencytarget):
+        """
+        input: most calls ever allowed in flight; calls slower than this
+            many seconds count as a sign of overload
+        """
+        if maximum < minimumlimit:
+            raise ValueError("most calls in flight must be at least {:g}, not {}".format(minimumlimit, maximum))
+        self.maximum = float(maximum)
+        self.latencytarget = latencytarget
+        self.condition = multiprocessing.Condition()
+
+        # start in the middle and let it find its level
+        self.limit = multiprocessing.RawValue("d", max(minimumlimit, self.maximum / 2))
+        self.inflight = multiprocessing.RawValue("i", 0)
+        self.lastdecrease = multiprocessing.RawValue("d", 0.0)
+        self.ndecreases = multiprocessing.RawValue("i", 0)
+
+    def acquire(self):
+        with self.condition:
+            while self.inflight.value >= int(self.limit.value):
+                # time out now and then in case a notify is missed by another process
+                self.condition.wait(1.0)
+            self.inflight.value += 1
+
+    def release(self, elapsed, overloaded):
+        """
+        input: how long the call took (s); whether the call failed in a way
+            that indicates overload
+        """
+        with self.condition:
+            self.inflight.value -= 1
+            now = time.time()
+            if overloaded or elapsed > self.latencytarget:
+                # one bad patch causes many slow calls at once; only react once per interval
+                if now - self.lastdecrease.value > self.latencytarget:
+                    self.limit.value = max(minimumlimit, self.limit.value / 2)
+                    self.lastdecrease.value = now
+                    self.ndecreases.value += 1
+            else:
+                self.limit.value = min(self.maximum, self.limit.value + 1 / self.limit.value)
+            self.condition.notify_all()
+
+    def summary(self):
+        return {
+            "limit": self.limit.value,
+            "maximum": self.maximum,
+            "in flight": self.inflight.value,
+            "decreases": self.ndecreases.value,
+        }
+
+
+class RateCap:
+    """
+    token bucket limiting calls per second, with bursts of up to a second's worth
+    """
+    def __init__(self, rate):
+        if rate <= 0:
+            raise ValueError("calls per second must be more than 0, not {}".format(rate))
+        self.rate = float(rate)
+        self.lock = multiprocessing.Lock()
+        self.tokens = multiprocessing.RawValue("d", self.rate)
+        self.last = multiprocessing.RawValue("d", time.time())
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens.value = min(self.rate, self.tokens.value + (now - self.last.value) * self.rate)
+                self.last.value = now
+                if self.tokens.value >= 1:
+                    self.tokens.value -= 1
+                    return
+                wait = (1 - self.tokens.value) / self.rate
+            time.sleep(wait)
+
+
+def parsemaximum(text):
+    """
+    input: most calls in flight, as given on the command line
+    output: the number
+    """
+    try:
+        maximum = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("most calls in flight must be a whole number, not {}".format(text))
+    if maximum < minimumlimit:
+        raise argparse.ArgumentTypeError("most calls in flight must be at least {:g}, not {}".format(minimumlimit, text))
+    return maximum
+
+
+def parserate(text):
+    """
+    input: most calls per second, as given on the command line
+    output: the number
+    """
+    try:
+        rate = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("calls per second must be a number, not {}".format(text))
+    if not rate > 0:
+        raise argparse.ArgumentTypeError("calls per second must be more than 0, not {}".format(text))
+    return rate
+
+
+class DVIDLimits:
+    """
+    the read and write limits and rate cap that DVID calls go through; each
+    part is optional, and with none set, calls go straight through
+    """
+    def __init__(self, maxreads=None, maxwrites=None, rate=None, latencytarget=defaultlatencytarget):
+        """
+        input: most reads in flight; most writes in flight; most calls per
+            second; calls slower than this many seconds count as overload
+        """
+        self.read = AdaptiveLimit(maxreads, latencytarget) if maxreads is not None else None
+        self.write = AdaptiveLimit(maxwrites, latencytarget) if maxwrites is not None else None
+        self.rate = RateCap(rate) if rate is not None else None
+
+    def share(self, other):
+        """
+        use the same limits as another DVIDLimits (eg, one passed to a worker process)
+        """
+        self.read = other.read
+        self.write = other.write
+        self.rate = other.rate
+
+    @contextmanager
+    def call(self, kind):
+        """
+        wait for room for a call, then make it in the enclosed block; the
+        block must set "status" in the yielded dict to the status code
+        (leave it None if the call raised)
+
+        input: "read" or "write"
+        """
+        limit = self.read if kind == "read" else self.write
+        if self.rate is not None:
+            self.rate.acquire()
+        if limit is None:
+            yield {"status": None}
+            return
+        outcome = {"status": None}
+        limit.acquire()
+        t1 = time.time()
+        try:
+            yield outcome
+        finally:
+            overloaded = outcome["status"] is None or outcome["status"] in overloadstatuses
+            limit.release(time.time() - t1, overloaded)
+
+    def summary(self):
+        result = {}
+        if self.read is not None:
+            result["read"] = self.read.summary()
+        if self.write is not None:
+            result["write"] = self.write.summary()
+        if self.rate is not None:
+            result["rate"] = self.rate.rate
+        return result
+
+
+# the limits used for our DVID calls; none unless configured
+dvidlimits = DVIDLimits()
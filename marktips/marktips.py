@@ -13,13 +13,21 @@ see project wiki for usage
 # ------------------------- imports -------------------------
 # std lib
 import argparse
+from array import array
+import base64
 from contextlib import contextmanager, redirect_stdout, redirect_stderr
+import functools
 import getpass
-from io import StringIO
+from io import BytesIO, StringIO
 import json
+import os
 import random
+import secrets
 import sys
+import tarfile
+import threading
 import time
+import tracemalloc
 
 
 # third party
@@ -31,8 +39,30 @@ try:
 except ImportError:
     hasDVIDtools = False
 
+# skeletons are parsed into the table dvidtools would make; dvidtools needs
+#   pandas, so it's here whenever dvidtools is
+try:
+    import pandas as pd
+    hasPandas = True
+except ImportError:
+    hasPandas = False
+
+try:
+    import ijson
+    hasijson = True
+except ImportError:
+    hasijson = False
+
 # local
 from . import __version__
+from .limiter import dvidlimits, DVIDLimits, defaultlatencytarget, parsemaximum, parserate
+from .memory import resetpeakrss, peakrss
+from .profiling import profiled, profileformats
+from .replay import TrafficRecorder, TrafficReplayer
+from .requeststats import requeststats, defaultslowcall
+from .runindex import RunIndex
+from .tipsoutput import TipWriter, tipformats, defaultchunksize
+from .trace import TraceWriter, bodyevents
 
 
 # ------------------------- constants -------------------------
@@ -42,12 +72,54 @@ todocomment = "placed by marktips.py v" + __version__
 
 todoinstancename = "segmentation_todo"
 
+# segmentation instance dvidtools works with unless told otherwise; skeletons
+#   are in its name + "_skeletons"
+defaultsegmentation = "segmentation"
+
+# each run's parameters are stored once in this keyvalue instance, keyed by run ID;
+#   the to do items only carry the run ID
+runinstancename = "marktips_runs"
+
+# when reading to do items, we keep only these properties; the rest is dropped
+keptproperties = ["action", "run parameters", "run ID"]
+
+# in low-memory mode, to do items are built and posted this many at a time
+lowmemorychunk = 10000
+
+# how tip locations can be given in the json result: as a list of [x, y, z],
+#   as base64 little-endian int32 triples, or both
+locationencodings = ["list", "base64", "both"]
+
 # format = '2019-09-11 10:38:32'
 timeformat = "%Y-%m-%d %H:%M:%S"
 
+# columns of a skeleton table, as dvidtools reads SWC
+swccolumns = ["node_id", "label", "x", "y", "z", "radius", "parent_id"]
+
 
 # ------------------------- code -------------------------
 
+# all our DVID calls go through one session, so connections are pooled
+#   and reused, including across threads
+session = requests.Session()
+
+# RoI point queries go through this, if set
+roibatcher = None
+
+# segmentation instance whose skeletons are used; see setsegmentation()
+segmentationinstance = defaultsegmentation
+
+# dvidtools makes its own DVID calls, each thread with its own session; once
+#   wrapdvidtools() has run, those sessions get this transport adapter (if set)
+#   and pass their responses to the hook of the detector running in their thread
+dvidtoolsadapter = None
+
+# per thread: the detector running tip detection in it (.detector), and the
+#   skeleton it fetched, as (body ID, skeleton), for dvidtools to use instead
+#   of fetching it again (.skeleton); threads don't see each other's, so
+#   detectors can run side by side
+dvidtoolscontext = threading.local()
+
 @contextmanager
 def noredirect():
     # dummy context manager
@@ -61,18 +133,252 @@ def postdvid(call, username, data):
     input: the URL to call; username; the data to be posted
     """
     call = addappuser(call, username)
-    return requests.post(call, data=json.dumps(data))
+    data = json.dumps(data)
+    with dvidlimits.call("write") as outcome:
+        t1 = time.time()
+        requeststats.begin()
+        try:
+            r = session.post(call, data=data)
+        finally:
+            requeststats.end()
+        outcome["status"] = r.status_code
+    requeststats.record("POST", call, r.status_code, time.time() - t1, len(data), len(r.content))
+    return r
 
 
-def getdvid(call, username):
+def getdvid(call, username, data=None, stream=False):
     """
     does a GET call to DVID
 
-    input: URL to call; username
+    input: URL to call; username; optional data to send in the body;
+        flag to stream the response instead of reading it all at once
     output: requests response object
     """
     call = addappuser(call, username)
-    return requests.get(call)
+    if data is not None:
+        data = json.dumps(data)
+    # a streamed call's slot is given back once the headers are in
+    with dvidlimits.call("read") as outcome:
+        t1 = time.time()
+        requeststats.begin()
+        try:
+            r = session.get(call, data=data, stream=stream)
+        finally:
+            requeststats.end()
+        outcome["status"] = r.status_code
+    # a streamed response hasn't been read yet, so only the time to the headers
+    #   is recorded, and the size is as declared
+    if stream:
+        nreceived = int(r.headers.get("Content-Length", 0))
+    else:
+        nreceived = len(r.content)
+    requeststats.record("GET", call, r.status_code, time.time() - t1, len(data or ""), nreceived)
+    return r
+
+
+def setpoolsize(size):
+    """
+    sets the number of pooled connections kept per host; should be at
+    least the number of threads making DVID calls at once
+    """
+    adapter = requests.adapters.HTTPAdapter(pool_connections=size, pool_maxsize=size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
+def setroibatcher(batcher):
+    """
+    sends RoI point queries through the given batcher (see roibatch.py), to
+    be combined with other bodies' queries; None to send them directly
+    """
+    global roibatcher
+    roibatcher = batcher
+
+
+def setadapter(adapter):
+    """
+    sends all DVID calls, ours and dvidtools', through the given transport
+    adapter (eg, to record or replay them)
+    """
+    global dvidtoolsadapter
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    dvidtoolsadapter = adapter
+    wrapdvidtools()
+
+
+def wrapdvidtools():
+    """
+    wraps dvidtools' session factory, so every session it makes its own DVID
+    calls with gets our adapter and response hook, and its skeleton fetch, so
+    tip detection uses a skeleton we've already fetched; done once; raises
+    MarktipsError if dvidtools doesn't have the functions we wrap
+    """
+    if not hasDVIDtools:
+        return
+
+    # newer versions keep these in dvidtools.fetch, where their tip detection
+    #   looks them up; older ones at the top level
+    module = getattr(dt, "fetch", dt)
+    if not hasattr(module, "dvid_session"):
+        raise MarktipsError("unsupported dvidtools version: no dvid_session() to wrap")
+    fetches = [(name, single) for name, single in [("get_skeletons", False), ("get_skeleton", True)]
+        if hasattr(module, name)]
+    if not fetches:
+        raise MarktipsError("unsupported dvidtools version: no get_skeletons() or get_skeleton() to wrap")
+
+    if not getattr(module.dvid_session, "marktipswrapped", False):
+        module.dvid_session = wrapsessionfactory(module.dvid_session)
+    for name, single in fetches:
+        if not getattr(getattr(module, name), "marktipswrapped", False):
+            setattr(module, name, wrapskeletonfetch(getattr(module, name), single))
+
+
+def wrapsessionfactory(factory):
+    """
+    input: dvidtools' function returning its session for the current thread
+    output: the same, with the session set up to go through our adapter and hook
+    """
+    @functools.wraps(factory)
+    def dvidsession(*args, **kwargs):
+        s = factory(*args, **kwargs)
+        if dvidtoolsadapter is not None and s.get_adapter("http://") is not dvidtoolsadapter:
+            s.mount("http://", dvidtoolsadapter)
+            s.mount("https://", dvidtoolsadapter)
+        if dvidtoolshook not in s.hooks["response"]:
+            s.hooks["response"].append(dvidtoolshook)
+        return s
+    dvidsession.marktipswrapped = True
+    return dvidsession
+
+
+def wrapskeletonfetch(fetch, single):
+    """
+    input: dvidtools' skeleton fetch function; flag for one that returns one
+        skeleton rather than a list
+    output: the same, but the body whose skeleton this thread's detector
+        supplied gets that one (once) instead of a fetch
+    """
+    @functools.wraps(fetch)
+    def getskeletons(x, *args, **kwargs):
+        skeleton = None
+        supplied = getattr(dvidtoolscontext, "skeleton", None)
+        if (supplied is not None and not isinstance(x, (list, tuple, set)) and
+                not hasattr(x, "__array__") and str(x) == supplied[0]):
+            skeleton = supplied[1]
+            dvidtoolscontext.skeleton = None
+        if skeleton is None:
+            return fetch(x, *args, **kwargs)
+        return skeleton if single else [skeleton]
+    getskeletons.marktipswrapped = True
+    return getskeletons
+
+
+def dvidtoolshook(r, *args, **kwargs):
+    """
+    requests response hook on dvidtools' sessions; hands the response to the
+    detector running in this thread, if any (calls from threads dvidtools
+    starts itself aren't attributed, and count as detection time)
+    """
+    detector = getattr(dvidtoolscontext, "detector", None)
+    if detector is not None:
+        detector.dvidtoolshook(r)
+
+
+def setsegmentation(segmentation):
+    """
+    sets the segmentation instance that we and dvidtools work with, and so
+    the one skeletons are read from; raises MarktipsError if this dvidtools
+    can't be told
+    """
+    global segmentationinstance
+    config = getattr(dt, "config", None) if hasDVIDtools else None
+    if config is not None:
+        config.segmentation = segmentation
+    elif hasDVIDtools and segmentation != defaultsegmentation:
+        raise MarktipsError("this dvidtools version only works with the " + defaultsegmentation + " instance")
+    segmentationinstance = segmentation
+
+
+def skeletoninstance():
+    """
+    output: keyvalue instance that dvidtools reads skeletons from, and so
+        the one we fetch and prefetch them from
+    """
+    config = getattr(dt, "config", None) if hasDVIDtools else None
+    return getattr(config, "segmentation", segmentationinstance) + "_skeletons"
+
+
+def parseswc(swc):
+    """
+    input: SWC bytes
+    output: pandas DataFrame of the skeleton's nodes, one per row, with
+        columns as dvidtools reads them
+    """
+    return pd.read_csv(BytesIO(swc), sep=r"\s+", header=None, comment="#", names=swccolumns)
+
+
+def getkeyvalues(serverport, uuid, instance, keys, username):
+    """
+    retrieves many keys from a keyvalue instance in one call
+
+    input: server; UUID; keyvalue instance name; list of keys; username
+    output: dict {key: value as bytes}; keys not found are omitted
+    """
+    if not keys:
+        return {}
+    call = serverport + "/api/node/" + uuid + "/" + instance + "/keyvalues?jsontar=true"
+    r = getdvid(call, username, data=list(keys))
+    if r.status_code != requests.codes.ok:
+        return {}
+    values = {}
+    with tarfile.open(fileobj=BytesIO(r.content)) as tar:
+        for member in tar:
+            f = tar.extractfile(member)
+            if f is None:
+                continue
+            data = f.read()
+            # missing keys come back as empty files
+            if data:
+                values[member.name] = data
+    return values
+
+
+def slimtodo(todo):
+    """
+    input: to do item json
+    output: to do item json reduced to its position and the properties we use
+    """
+    prop = todo.get("Prop") or {}
+    slimprop = {key: prop[key] for key in keptproperties if key in prop}
+    # older versions only marked their to do items in the comment
+    if "marktips.py" in prop.get("comment", ""):
+        slimprop["action"] = "tip detector"
+    return {"Pos": todo["Pos"], "Prop": slimprop}
+
+
+def parsetodos(r):
+    """
+    parses to do items from a response, keeping only what we use; if
+    ijson is available, the response is parsed incrementally, so memory
+    scales with what we keep rather than with the full response
+
+    input: requests response object (ideally from a streamed request)
+    output: list of slimmed to do items
+    """
+    if hasijson:
+        r.raw.decode_content = True
+        return [slimtodo(todo) for todo in ijson.items(r.raw, "item")]
+    else:
+        # DVID returns null rather than [] if there are no annotations
+        return [slimtodo(todo) for todo in r.json() or []]
+
+
+def makerunid():
+    """
+    output: short, unique ID for a run of marktips
+    """
+    return secrets.token_hex(6)
 
 
 def addappuser(call, username):
@@ -101,6 +407,122 @@ def getdefaultoutput():
     }
 
 
+def encodelocations(locations):
+    """
+    input: list of [x, y, z] locations
+    output: json-able dict with the locations as base64 of little-endian
+        int32 x, y, z triples, plus the dtype and shape needed to decode it
+        (eg, np.frombuffer(base64.b64decode(data), dtype).reshape(shape))
+    """
+    values = array("i", [int(v) for location in locations for v in location])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return {
+        "encoding": "base64",
+        "dtype": "<i4",
+        "shape": [len(locations), 3],
+        "data": base64.b64encode(values.tobytes()).decode("ascii"),
+    }
+
+
+def decodelocations(encoded):
+    """
+    input: dict from encodelocations()
+    output: list of [x, y, z] locations
+    """
+    values = array("i")
+    values.frombytes(base64.b64decode(encoded["data"]))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return [values[i:i + 3].tolist() for i in range(0, len(values), 3)]
+
+
+def requestbytes(r, nreceived=None):
+    """
+    input: requests response object; number of bytes received, if the
+        response was streamed (otherwise it's taken from the content)
+    output: total bytes sent and received
+    """
+    body = r.request.body or b""
+    if nreceived is None:
+        nreceived = len(r.content)
+    return len(body) + nreceived
+
+
+class StageTimer:
+    """
+    accumulates wall time, bytes transferred and point counts for the named
+    stages of a run, and keeps each timed interval as a span for tracing;
+    if tracemalloc is tracing, also keeps the peak traced memory of each stage
+    """
+    def __init__(self):
+        self.stages = {}
+        self.spans = []
+
+        # stage name: peak traced memory (bytes); and the peak over the run
+        self.memory = {}
+        self.peakmemory = 0
+
+    def get(self, name):
+        """
+        output: the dict {"time", "bytes", "points"} for the stage, created if needed
+        """
+        return self.stages.setdefault(name, {"time": 0.0, "bytes": 0, "points": 0})
+
+    @contextmanager
+    def stage(self, name):
+        """
+        times the enclosed block as part of the stage; yields the stage's
+        dict so the block can add bytes and points to it
+        """
+        entry = self.get(name)
+        t1 = time.time()
+        try:
+            with self.trackmemory(name):
+                yield entry
+        finally:
+            duration = time.time() - t1
+            entry["time"] += duration
+            self.addspan(name, t1, duration)
+
+    @contextmanager
+    def trackmemory(self, name):
+        """
+        records the peak traced memory during the enclosed block under the
+        stage name, if tracemalloc is tracing
+        """
+        if not tracemalloc.is_tracing():
+            yield
+            return
+        # fold the peak so far into the run's peak before starting the stage's own
+        self.peakmemory = max(self.peakmemory, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            peak = tracemalloc.get_traced_memory()[1]
+            self.peakmemory = max(self.peakmemory, peak)
+            self.memory[name] = max(self.memory.get(name, 0), peak)
+
+    def getpeakmemory(self):
+        """
+        output: peak traced memory over the run so far (bytes), or None if not tracing
+        """
+        if not tracemalloc.is_tracing():
+            return None
+        return max(self.peakmemory, tracemalloc.get_traced_memory()[1])
+
+    def addspan(self, name, start, duration):
+        """
+        record a span without adding to the stage totals
+        """
+        self.spans.append({"name": name, "start": start, "duration": duration})
+
+
+class MarktipsError(Exception):
+    pass
+
+
 def errorquit(message):
     result = getdefaultoutput()
     result["status"] =  False
@@ -111,7 +533,8 @@ def errorquit(message):
 
 class TipDetector:
     def __init__(self, serverport, uuid, bodyid, todoinstance, username=None,
-        indexing="none", roi=None, excluded_roi=None):
+        indexing="none", roi=None, excluded_roi=None, runinstance=runinstancename, lowmemory=False,
+        tipwriter=None, locationencoding="list", skeleton=None):
         self.serverport = serverport
         self.uuid = uuid
         self.bodyid = bodyid
@@ -119,26 +542,56 @@ class TipDetector:
         self.indexing = indexing
         self.roi = roi
         self.excluded_roi = excluded_roi
+        self.runinstance = runinstance
+        self.lowmemory = lowmemory
+        self.tipwriter = tipwriter
+        self.locationencoding = locationencoding
+        # the body's skeleton (SWC bytes), if it's been fetched already
+        self.prefetchedskeleton = skeleton
+        self.skeletonprefetched = False
         if username is None:
             self.username = getpass.getuser()
         else:
             self.username = username
 
         # hold description of what was run
+        self.runid = makerunid()
         self.parameters = {
             # username = who is running this; todo-username = to whom the to do was assigned
             "username": getpass.getuser(),
             "todo-username": self.username,
             "time": time.strftime(timeformat),
+            "run ID": self.runid,
         }
 
+        # true if the run parameters have been stored in the run instance,
+        #   in which case the to do items only need the run ID
+        self.runrecorded = False
+
         self.locations = []
+
+        # all tips, before RoI filtering, and their RoI flags; only kept
+        #   (for the tips output) if there's a tip writer
+        self.alllocations = []
+        self.inroi = None
+        self.inexcludedroi = None
+
         self.nlocations = 0
         self.nlocationsroi = 0
         self.ntodosplaced = 0
         self.tplace = 0.0
         self.tfind = 0.0
 
+        # true once dvidtools' tip detection has used the skeleton we fetched
+        self.skeletonused = False
+        self.timer = StageTimer()
+        self.tstart = time.time()
+
+        # memory peaks are reported per body, so start counting here
+        resetpeakrss()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
         self.validateinput()
 
     def validateinput(self):
@@ -150,22 +603,52 @@ class TipDetector:
 
         # check RoIs exist
         if self.roi is not None and not self.RoIexists(self.roi):
-            errorquit("RoI {} does not exist".format(self.roi))
+            raise MarktipsError("RoI {} does not exist".format(self.roi))
         if self.excluded_roi is not None and not self.RoIexists(self.excluded_roi):
-            errorquit("RoI {} does not exist".format(self.excluded_roi))
+            raise MarktipsError("RoI {} does not exist".format(self.excluded_roi))
 
-    def findandplace(self, find_only, show_progress, save_parameters):
+    def findandplace(self, find_only, show_progress, save_parameters, run_index=None, trace=None):
         """
         find tips and place to do items; report results by printing json; quit
 
         input:  flag for finding tips but not placing to do;
                 flag for showing progress bar on command line (in stderr)
                 flag for storing run parameters on each to do
+                optional path to a run index database to record the run in
+                optional path to write a Chrome trace of the run to
+        """
+        try:
+            try:
+                self.run(find_only, show_progress, save_parameters, run_index)
+            finally:
+                # the tips output should be complete before the results are reported
+                if self.tipwriter is not None:
+                    self.tipwriter.close()
+        except MarktipsError as e:
+            if trace is not None:
+                self.writetrace(trace, False)
+            errorquit(str(e))
+        if trace is not None:
+            self.writetrace(trace, True)
+        self.reportquit()
+
+    def run(self, find_only, show_progress, save_parameters, run_index=None):
+        """
+        find tips and place to do items; raises MarktipsError on failure
+
+        input: as for findandplace()
         """
         self.findtips(show_progress)
+        if self.tipwriter is not None:
+            with self.timer.stage("tips output") as entry:
+                entry["points"] += len(self.alllocations)
+                self.tipwriter.add(self.bodyid, self.alllocations, self.inroi, self.inexcludedroi)
         if not find_only:
             self.placetodos(save_parameters)
-        self.reportquit()
+            # the index lists the runs a history from DVID would: those that
+            #   placed to do items carrying their parameters
+            if run_index is not None and save_parameters and self.ntodosplaced > 0:
+                self.recordrun(run_index)
 
     def findtips(self, showprogress):
         """
@@ -174,7 +657,13 @@ class TipDetector:
 
         t1 = time.time()
 
-        dt.set_param(self.serverport, self.uuid, self.username)
+        with self.timer.stage("setup"):
+            dt.set_param(self.serverport, self.uuid, self.username)
+            wrapdvidtools()
+
+        # the skeleton is fetched here, so its time and size are known, and
+        #   handed to dvidtools in place of its own fetch
+        skeleton = self.fetchskeleton()
 
         # dt.detect_tips() sends output to stdout and stderr, which I want to control when
         #   I run from within NeuTu; however, the progress bar (which goes to stderr) is
@@ -184,65 +673,171 @@ class TipDetector:
             stderrRedirect = noredirect()
         else:
             stderrRedirect = redirect_stderr(StringIO())
-        with stderrRedirect:
-            with redirect_stdout(StringIO()):
-                noskeleton = False
-                try:
-                    self.parameters["body ID"] = self.bodyid
-                    tips = dt.detect_tips(self.bodyid)
-                except ValueError as e:
-                    if "appears to not have a skeleton" in e.__str__():
-                        noskeleton = True
-                    else:
-                        raise e
+
+        # dvidtools' own DVID calls (snapping, checked assignments; the skeleton,
+        #   if it didn't take ours) are split out of the detection time by the hook
+        dvidtoolscontext.detector = self
+        dvidtoolscontext.skeleton = (self.bodyid, skeleton)
+        tskeleton = self.timer.get("skeleton")["time"]
+        tdetect = time.time()
+        try:
+            with stderrRedirect, self.timer.trackmemory("detection"):
+                with redirect_stdout(StringIO()):
+                    noskeleton = False
+                    try:
+                        self.parameters["body ID"] = self.bodyid
+                        tips = dt.detect_tips(self.bodyid)
+                    except ValueError as e:
+                        if "appears to not have a skeleton" in e.__str__():
+                            noskeleton = True
+                        else:
+                            raise e
+        finally:
+            self.skeletonused = dvidtoolscontext.skeleton is None
+            dvidtoolscontext.detector = None
+            dvidtoolscontext.skeleton = None
+        tdetect = time.time() - tdetect
+        self.timer.addspan("detection", time.time() - tdetect, tdetect)
         if noskeleton:
-            errorquit("body " + self.bodyid + " does not appear to have a skeleton!")
+            raise MarktipsError("body " + self.bodyid + " does not appear to have a skeleton!")
+
+        # whatever detection time wasn't spent in DVID calls is computation
+        entry = self.timer.get("detection")
+        entry["time"] = max(0.0, tdetect - (self.timer.get("skeleton")["time"] - tskeleton) -
+            self.timer.get("detection DVID")["time"])
+        entry["points"] = len(tips)
 
-        self.locations = tips.loc[:, ["x", "y", "z"]].values.tolist()
-        self.nlocations = len(self.locations)
+        with self.timer.stage("tip list") as entry:
+            self.locations = tips.loc[:, ["x", "y", "z"]].values.tolist()
+            self.nlocations = len(self.locations)
+            entry["points"] = self.nlocations
+        if self.tipwriter is not None:
+            self.alllocations = self.locations
 
         # filter by RoI if applicable
         # must be inside this roi, if given:
         if self.roi is not None:
             self.parameters["RoI"] = self.roi
-            insidelist = self.insideRoI(self.locations, self.roi)
-            self.locations = [item for item, inside in zip(self.locations, insidelist) if inside]
+            with self.timer.stage("RoI") as entry:
+                entry["points"] += len(self.locations)
+                insidelist = self.insideRoI(self.locations, self.roi, entry)
+                if self.tipwriter is not None:
+                    self.inroi = insidelist
+                self.locations = [item for item, inside in zip(self.locations, insidelist) if inside]
 
         # must not be in this roi, if given:
         if self.excluded_roi is not None:
             self.parameters["excluded RoI"] = self.excluded_roi
-            insidelist = self.insideRoI(self.locations, self.excluded_roi)
-            self.locations = [item for item, inside in zip(self.locations, insidelist) if not inside]
+            with self.timer.stage("excluded RoI") as entry:
+                if self.tipwriter is None:
+                    entry["points"] += len(self.locations)
+                    insidelist = self.insideRoI(self.locations, self.excluded_roi, entry)
+                    self.locations = [item for item, inside in zip(self.locations, insidelist) if not inside]
+                else:
+                    # the tips output gets the flag for every tip, not just those
+                    #   left after the RoI
+                    entry["points"] += len(self.alllocations)
+                    self.inexcludedroi = self.insideRoI(self.alllocations, self.excluded_roi, entry)
+                    inroi = self.inroi if self.inroi is not None else [True] * len(self.alllocations)
+                    self.locations = [item for item, inside, excluded in
+                        zip(self.alllocations, inroi, self.inexcludedroi) if inside and not excluded]
 
         self.nlocationsroi = len(self.locations)
 
         t2 = time.time()
         self.tfind = t2 - t1
 
+    def fetchskeleton(self):
+        """
+        retrieves the body's skeleton, or takes the one given to the detector;
+        raises MarktipsError if it has none
+
+        output: pandas DataFrame of the skeleton's nodes, as from parseswc()
+        """
+        call = self.serverport + "/api/node/" + self.uuid + "/" + skeletoninstance() + "/key/" + \
+            self.bodyid + "_swc"
+        with self.timer.stage("skeleton") as entry:
+            if self.prefetchedskeleton is not None:
+                # fetched by the batch, along with other bodies' skeletons
+                content = self.prefetchedskeleton
+                self.prefetchedskeleton = None
+                self.skeletonprefetched = True
+            else:
+                r = getdvid(call, self.username)
+                entry["bytes"] += requestbytes(r)
+                if r.status_code not in [requests.codes.ok, requests.codes.not_found]:
+                    message = "skeleton retrieval failed!\n"
+                    message += f"url: {call}\n"
+                    message += f"status code: {r.status_code}\n"
+                    message += f"returned text: {r.text}\n"
+                    raise MarktipsError(message)
+                content = r.content if r.status_code == requests.codes.ok else b""
+            try:
+                skeleton = parseswc(content)
+            except pd.errors.EmptyDataError:
+                skeleton = None
+            if skeleton is None or skeleton.empty:
+                raise MarktipsError("body " + self.bodyid + " does not appear to have a skeleton!")
+            entry["points"] += len(skeleton)
+        return skeleton
+
+    def dvidtoolshook(self, r, *args, **kwargs):
+        """
+        requests response hook for DVID calls made by dvidtools; attributes
+        their time and bytes to the skeleton or detection DVID stage
+        """
+        # the hook runs before the content is read, so read it here to include
+        #   the download in the timing
+        t1 = time.time()
+        content = r.content
+        elapsed = r.elapsed.total_seconds() + time.time() - t1
+        if "_skeletons/key/" in r.url:
+            name = "skeleton"
+            entry = self.timer.get(name)
+            # one node per line in the SWC, less the header comments
+            entry["points"] += content.count(b"\n") - content.count(b"\n#") - content.startswith(b"#")
+        else:
+            name = "detection DVID"
+            entry = self.timer.get(name)
+        self.timer.addspan(name, time.time() - elapsed, elapsed)
+        entry["time"] += elapsed
+        entry["bytes"] += requestbytes(r)
+        requeststats.record(r.request.method, r.url, r.status_code, elapsed,
+            len(r.request.body or b""), len(content))
+
     def gettodos(self):
         """
         retrieve to do items on the body of interest
         """
         todocall = self.serverport + "/api/node/" + self.uuid + "/" + self.todoinstance + "/label/" + self.bodyid
-        r = getdvid(todocall, self.username)
-        if r.status_code != requests.codes.ok:
-            # bail out; later I'd prefer to have the error percolate up and be
-            #   handled by the calling routine, but for now, just quit:
-            message = "existing to do retrieval failed!\n"
-            message += f"url: {todocall}\n"
-            message += f"status code: {r.status_code}\n"
-            message += f"returned text: {r.text}\n"
-            errorquit(message)
-        else:
-            return r.json()
+        with self.timer.stage("todo fetch") as entry:
+            r = getdvid(todocall, self.username, stream=True)
+            if r.status_code != requests.codes.ok:
+                message = "existing to do retrieval failed!\n"
+                message += f"url: {todocall}\n"
+                message += f"status code: {r.status_code}\n"
+                message += f"returned text: {r.text}\n"
+                raise MarktipsError(message)
+            else:
+                todos = parsetodos(r)
+                entry["bytes"] += requestbytes(r, r.raw.tell())
+                entry["points"] += len(todos)
+                return todos
 
-    def insideRoI(self, pointlist, roi):
+    def insideRoI(self, pointlist, roi, entry=None):
         """
-        input: list of [x, y, z] points
+        input: list of [x, y, z] points; optional stage dict to add bytes to
         output: list of [True, False, ...] indicating if each point is in self.roi
         """
+        if roibatcher is not None:
+            inside, nbytes = roibatcher.query(self.serverport, self.uuid, roi, pointlist, self.username)
+            if entry is not None:
+                entry["bytes"] += nbytes
+            return inside
         call = self.serverport + "/api/node/" + self.uuid + "/" + roi + "/ptquery"
         r = postdvid(call, self.username, data=pointlist)
+        if entry is not None:
+            entry["bytes"] += requestbytes(r)
         return r.json()
 
     def RoIexists(self, roi):
@@ -271,13 +866,27 @@ class TipDetector:
         # two passes through candidate locations; first, check for existing to do at
         #   the locations, and adjust locations as needed; then strip out Nones (meaning
         #   already a tip detection to do at that location):
-        self.locations = [self.findvalidtodolocation(tuple(loc), existingtodos) for loc in self.locations]
-        self.locations = [loc for loc in self.locations if loc is not None]
+        with self.timer.stage("todo locations") as entry:
+            entry["points"] += len(self.locations)
+            self.locations = [self.findvalidtodolocation(tuple(loc), existingtodos) for loc in self.locations]
+            self.locations = [loc for loc in self.locations if loc is not None]
 
         self.parameters["indexing"] = self.indexing
-        annlist = [self.maketodo(loc, save_parameters) for loc in self.locations]
-        annlist = self.addindexing(self.indexing, annlist)
-        self.postannotations(annlist)
+        if save_parameters:
+            with self.timer.stage("run record"):
+                self.runrecorded = self.postrunrecord()
+
+        # in low-memory mode, don't hold all the to do json at once
+        chunksize = lowmemorychunk if self.lowmemory else max(1, len(self.locations))
+        # random indices run over all the to do items, not per chunk
+        indices = list(range(len(self.locations)))
+        random.shuffle(indices)
+        with self.timer.stage("todo post") as entry:
+            for start in range(0, len(self.locations), chunksize):
+                annlist = [self.maketodo(loc, save_parameters) for loc in self.locations[start:start + chunksize]]
+                annlist = self.addindexing(self.indexing, annlist, indices[start:start + chunksize])
+                entry["points"] += len(annlist)
+                self.postannotations(annlist, entry)
 
         t2 = time.time()
         self.tplace = t2 - t1
@@ -324,7 +933,7 @@ class TipDetector:
                         return None
                 # if you get here, couldn't find a suitable location; that really
                 #   shouldn't happen, so let's make it an actual error:
-                errorquit("Could not place to do at location {}; all neighboring points occupied!".format(location))
+                raise MarktipsError("Could not place to do at location {}; all neighboring points occupied!".format(location))
         else:
             # nothing there, it's OK
             return location
@@ -351,17 +960,61 @@ class TipDetector:
         ann["Prop"]["checked"] = "0"
         ann["Prop"]["action"] = "tip detector"
         if save_parameters:
-            # have to stringify the json or DVID will cry
-            ann["Prop"]["run parameters"] = json.dumps(self.parameters)
+            if self.runrecorded:
+                ann["Prop"]["run ID"] = self.runid
+            else:
+                # have to stringify the json or DVID will cry
+                ann["Prop"]["run parameters"] = json.dumps(self.parameters)
         ann["Tags"] = ["action:tip_detector"]
         return ann
 
-    def addindexing(self, kind, todolist):
+    def postrunrecord(self):
+        """
+        stores the run parameters once, keyed by run ID, in the run instance
+
+        output: True if the record was stored; if not (eg, the instance
+            doesn't exist), the caller should fall back to storing the
+            full parameters on each to do
+        """
+        if self.runinstance is None:
+            return False
+        call = self.serverport + "/api/node/" + self.uuid + "/" + self.runinstance + "/key/" + self.runid
+        r = postdvid(call, self.username, data=self.parameters)
+        return r.status_code == requests.codes.ok
+
+    def recordrun(self, path):
+        """
+        records this run in a run index database
+
+        input: path to the database
+        """
+        index = RunIndex(path)
+        try:
+            index.addrun(self.serverport, self.uuid, self.todoinstance, self.parameters, self.ntodosplaced)
+        finally:
+            index.close()
+
+    def writetrace(self, path, status):
+        """
+        writes a Chrome trace of this run
+
+        input: path; whether the run succeeded
+        """
+        writer = TraceWriter(path)
+        try:
+            writer.add(bodyevents(self.bodyid, self.tstart, time.time() - self.tstart, self.timer.spans,
+                os.getpid(), threading.get_ident(), status=status))
+        finally:
+            writer.close()
+
+    def addindexing(self, kind, todolist, indices=None):
         """
         add a index as a property on each to do item so they can be
         ordered in NeuTu by some criterion
 
-        input: kind = "none", "random"; list of to do items
+        input: kind = "none", "random"; list of to do items; for "random",
+            optionally the shuffled indices to use (when the to do items
+            are indexed in chunks)
         output: list of to do items (same order) with indices added
         """
 
@@ -369,8 +1022,11 @@ class TipDetector:
         if kind == "none":
             return todolist
         elif kind == "random":
-            tipindices = list(range(len(todolist)))
-            random.shuffle(tipindices)
+            if indices is None:
+                tipindices = list(range(len(todolist)))
+                random.shuffle(tipindices)
+            else:
+                tipindices = indices
             for index, todo in zip(tipindices, todolist):
                 todo["Prop"]["tip qc index"] = str(index)
             return todolist
@@ -378,28 +1034,46 @@ class TipDetector:
             # should never happen
             raise ValueError("unknown indexing kind = {}".format(self.indexing))
 
-    def postannotations(self, annlist):
+    def postannotations(self, annlist, entry=None):
         """
         posts the list of annotations to dvid
 
-        input: list of json annotations
+        input: list of json annotations; optional stage dict to add bytes to
         """
 
         todocall = self.serverport + "/api/node/" + self.uuid + "/segmentation_todo/elements"
         r = postdvid(todocall, self.username, data=annlist)
+        if entry is not None:
+            entry["bytes"] += requestbytes(r)
         if r.status_code != requests.codes.ok:
-            # bail out; later I'd prefer to have the error percolate up and be
-            #   handled by the calling routine, but for now, just quit:
             message = "to do placement failed!\n"
             message += f"url: {todocall}\n"
             message += f"status code: {r.status_code}\n"
             message += f"returned text: {r.text}\n"
-            errorquit(message)
+            raise MarktipsError(message)
         else:
             # successful
-            self.ntodosplaced = len(annlist)
+            self.ntodosplaced += len(annlist)
 
     def reportquit(self):
+        print(json.dumps(self.getresult()))
+        sys.exit(0)
+
+    def getmemory(self):
+        """
+        output: dict of peak memory use for the run (bytes); traced memory
+            is only present if tracemalloc is tracing
+        """
+        memory = {"peak RSS": peakrss()}
+        if tracemalloc.is_tracing():
+            memory["peak traced"] = self.timer.getpeakmemory()
+            memory["stages"] = self.timer.memory
+        return memory
+
+    def getresult(self):
+        """
+        output: json-able dict describing the results of a successful run
+        """
         message = f"{len(self.locations)} tips found in {self.tfind}s; {self.ntodosplaced} to do items placed in {self.tplace}s"
         result = getdefaultoutput()
         result["parameters"].update(self.parameters)
@@ -408,12 +1082,79 @@ class TipDetector:
         result["tfind"] = self.tfind
         result["tplace"] = self.tplace
         result["ttotal"] = self.tfind + self.tplace
+        result["stages"] = self.timer.stages
+        result["dvid"] = requeststats.summary()
+        result["memory"] = self.getmemory()
         result["nlocations"] = self.nlocations
         result["nlocationsRoI"] = self.nlocationsroi
         result["nplaced"] = self.ntodosplaced
-        result["locations"] = self.locations
-        print(json.dumps(result))
-        sys.exit(0)
+        if self.tipwriter is None:
+            if self.locationencoding in ["list", "both"]:
+                result["locations"] = self.locations
+            if self.locationencoding in ["base64", "both"]:
+                result["locations encoded"] = encodelocations(self.locations)
+        else:
+            # the tips are in the tips output, which is the point of it
+            result["tips output"] = self.tipwriter.directory
+        return result
+
+
+def makelimits(options):
+    """
+    input: dict of parsed arguments, from a parser set up by addrunarguments()
+    output: DVIDLimits as configured
+    """
+    return DVIDLimits(options["max_reads"], options["max_writes"], options["max_rate"], options["latency_target"])
+
+
+def addrunarguments(parser):
+    """
+    adds the optional arguments that control a run to an argument parser;
+    shared by the single body and batch scripts
+    """
+    parser.add_argument("--find-only", action="store_true", help="find tips only; do not place to do items")
+    parser.add_argument("--save-parameters", action="store_true", help="store run parameters in each to do placed")
+    parser.add_argument("--run-instance", default=runinstancename,
+        help="DVID keyvalue instance where run parameters are stored (default: %(default)s); " +
+        "if unavailable, the full parameters are stored on each to do")
+    parser.add_argument("--run-index", default=os.environ.get("MARKTIPS_RUN_INDEX"),
+        help="path to a SQLite run index to record the run in (default: $MARKTIPS_RUN_INDEX, if set)")
+
+    parser.add_argument("--roi", help="specify an optional DVID RoI; to do items will only be placed in this RoI")
+    parser.add_argument("--excluded-roi", help="specify an optional DVID RoI; to do items will not be placed in this RoI")
+    parser.add_argument("--indexing", choices=["none", "random"], default="random",
+        help="add indices to to do items")
+    parser.add_argument("--username", help="specify a username to assign the to do items to")
+    parser.add_argument("--max-reads", type=parsemaximum,
+        help="adaptively limit DVID reads in flight, up to this many; the limit backs off " +
+        "when calls get slow or fail with server errors")
+    parser.add_argument("--max-writes", type=parsemaximum,
+        help="adaptively limit DVID writes in flight, up to this many")
+    parser.add_argument("--max-rate", type=parserate, help="hard cap on DVID calls per second")
+    parser.add_argument("--latency-target", type=float, default=defaultlatencytarget,
+        help="with --max-reads or --max-writes, DVID calls slower than this many seconds " +
+        "make the limit back off (default: %(default)s)")
+    parser.add_argument("--slow-call", type=float, default=defaultslowcall,
+        help="list DVID calls slower than this many seconds in the output (default: %(default)s)")
+    parser.add_argument("--low-memory", action="store_true",
+        help="build and post to do items in chunks, to keep memory use down on very large bodies")
+    parser.add_argument("--trace-memory", action="store_true",
+        help="trace Python allocations and report the peak per body and stage (slows the run)")
+    parser.add_argument("--location-encoding", choices=locationencodings, default="list",
+        help="give the tip locations in the result as a list of [x, y, z], as base64 " +
+        "little-endian int32 triples (\"locations encoded\"), or both (default: %(default)s)")
+    parser.add_argument("--tips-output",
+        help="also write every tip found (body ID, x, y, z, RoI flags) to this directory, in chunked " +
+        "columnar files, instead of listing the locations in the json result")
+    parser.add_argument("--tips-format", choices=tipformats, default="parquet",
+        help="file format for --tips-output (default: %(default)s)")
+    parser.add_argument("--tips-chunk", type=int, default=defaultchunksize,
+        help="tips per file for --tips-output (default: %(default)s)")
+    parser.add_argument("--trace",
+        help="write a Chrome trace (one span per body, with a child span per stage) to this path")
+    parser.add_argument("--profile", help="profile the run and write the profile to this path")
+    parser.add_argument("--profile-format", choices=profileformats, default="pstats",
+        help="cProfile stats, or sampled stacks in collapsed (flame graph) format (default: %(default)s)")
 
 
 def main():
@@ -429,23 +1170,58 @@ def main():
     parser.add_argument("todoinstance", help="DVID instance name where to do items are stored")
 
     parser.add_argument("--version", action="version", version=__version__)
-    parser.add_argument("--find-only", action="store_true", help="find tips only; do not place to do items")
+    addrunarguments(parser)
     parser.add_argument("--show-progress", action="store_true", help="show a progress bar while running")
-    parser.add_argument("--save-parameters", action="store_true", help="store run parameters in each to do placed")
-
-    parser.add_argument("--roi", help="specify an optional DVID RoI; to do items will only be placed in this RoI")
-    parser.add_argument("--excluded-roi", help="specify an optional DVID RoI; to do items will not be placed in this RoI")
-    parser.add_argument("--indexing", choices=["none", "random"], default="random",
-        help="add indices to to do items")
-    parser.add_argument("--username", help="specify a username to assign the to do items to")
+    replaygroup = parser.add_mutually_exclusive_group()
+    replaygroup.add_argument("--record",
+        help="record all DVID calls and responses of the run to this archive, for later replay")
+    replaygroup.add_argument("--replay",
+        help="serve all DVID calls from this recorded archive instead of the server")
+    parser.add_argument("--replay-latency", type=float, default=1.0,
+        help="with --replay, multiply the recorded latencies by this (0 for none; default: %(default)s)")
 
     args = parser.parse_args()
     if not args.serverport.startswith("http://"):
         args.serverport = "http://" + args.serverport
-
-    detector = TipDetector(args.serverport, args.uuid, args.bodyid, args.todoinstance, args.username,
-        args.indexing, args.roi, args.excluded_roi)
-    detector.findandplace(args.find_only, args.show_progress, args.save_parameters)
+    requeststats.slowcall = args.slow_call
+    dvidlimits.share(makelimits(vars(args)))
+
+    if args.trace_memory:
+        tracemalloc.start()
+
+    adapter = None
+    if args.record is not None:
+        adapter = TrafficRecorder(args.record)
+        adapter.meta = {"version": __version__, "arguments": vars(args)}
+    elif args.replay is not None:
+        adapter = TrafficReplayer(args.replay, args.replay_latency)
+    if adapter is not None:
+        try:
+            setadapter(adapter)
+        except MarktipsError as e:
+            errorquit(str(e))
+
+    tipwriter = None
+    if args.tips_output is not None:
+        try:
+            tipwriter = TipWriter(args.tips_output, args.tips_format, args.tips_chunk)
+        except ValueError as e:
+            errorquit(str(e))
+
+    with profiled(args.profile, args.profile_format):
+        try:
+            try:
+                detector = TipDetector(args.serverport, args.uuid, args.bodyid, args.todoinstance, args.username,
+                    args.indexing, args.roi, args.excluded_roi, args.run_instance, args.low_memory, tipwriter,
+                    args.location_encoding)
+            except MarktipsError as e:
+                errorquit(str(e))
+            detector.findandplace(args.find_only, args.show_progress, args.save_parameters, args.run_index,
+                args.trace)
+        finally:
+            # the run ends with sys.exit(); the recording is written on the way out
+            if adapter is not None:
+                adapter.close()
 
 
 # ------------------------- script starts here -------------------------
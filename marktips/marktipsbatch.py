@@ -0,0 +1,730 @@
+"""
+
+marktipsbatch.py
+
+this script runs the marktips tip detection and to do placement on many
+bodies, in parallel worker processes, writing one json result per body
+(one per line) and a summary at the end
+
+see project wiki for usage
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import ExitStack
+import getpass
+import glob
+import hashlib
+import itertools
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# local
+from . import __version__
+from .estimate import samplebodies, measure, extrapolate, todobytes
+from .journal import Journal, runmode
+from .limiter import dvidlimits
+from .marktips import TipDetector, MarktipsError, addrunarguments, setpoolsize, setroibatcher, \
+    setsegmentation, skeletoninstance, errorquit, getdefaultoutput, hasDVIDtools, makelimits, makerunid
+from .marktipshistory import readbodyids
+from .memory import memorybudget
+from .metrics import Metrics, defaultinterval
+from .prefetch import SkeletonPrefetcher, defaulttargetbytes
+from .profiling import profiled, mergeprofiles
+from .requeststats import requeststats, RequestStats
+from .roibatch import startbatcher, defaultmaxpoints, defaultwait
+from .scheduling import schedule, schedulingpolicies, getbodysizes, parsesizeclass, classify
+from .tipsoutput import TipWriter
+from .trace import TraceWriter, bodyevents
+
+
+# ------------------------------ constants ------------------------------
+appname = "marktipsbatch.py"
+
+# number of this worker process (0, 1, ...), set when a worker starts
+workernumber = None
+
+# this worker's writer for the tips output, if any
+tipwriter = None
+
+
+# ------------------------------ code ------------------------------
+def initworker(inflight, workercount, slowcall, limits, tracememory=False, tipsoutput=None, roibatcher=None,
+        segmentation=None):
+    """
+    set up a worker process
+
+    input: shared multiprocessing.Value counting DVID calls in flight; shared
+        multiprocessing.Value counting workers started; slow call threshold;
+        DVIDLimits shared by all workers; flag to trace Python allocations;
+        optional (directory, format, chunk size) for the tips output; optional
+        proxy for a PointQueryBatcher to send RoI point queries through;
+        optional segmentation instance to work with
+    """
+    global workernumber, tipwriter
+    with workercount.get_lock():
+        workernumber = workercount.value
+        workercount.value += 1
+
+    # fresh connections, rather than any inherited from the parent
+    setpoolsize(1)
+    requeststats.sharedinflight = inflight
+    requeststats.slowcall = slowcall
+    dvidlimits.share(limits)
+    if tracememory:
+        tracemalloc.start()
+    if tipsoutput is not None:
+        # each worker writes its own chunks; the last one is written when the worker exits
+        tipwriter = TipWriter(*tipsoutput)
+        multiprocessing.util.Finalize(tipwriter, tipwriter.close, exitpriority=10)
+    setroibatcher(roibatcher)
+    if segmentation is not None:
+        setsegmentation(segmentation)
+
+
+def runbody(options, bodyid, skeleton=None):
+    """
+    run marktips on one body; runs in a worker process
+
+    input: dict of run options (parsed arguments); body ID; optional prefetched
+        skeleton (SWC bytes)
+    output: result dict, as printed by marktips for one body, or a failure result;
+        a body that went over the memory budget is marked "deferred"; given a
+        skeleton, "skeleton prefetched" says whether tip detection used it
+    """
+    requeststats.reset()
+    tstart = time.time()
+    detector = None
+    profilepath = None
+    if options["profile"] is not None:
+        profilepath = "{}.{}.{}".format(options["profile_parts"], os.getpid(), bodyid)
+    budget = None
+    if options["memory_budget"] is not None:
+        budget = int(options["memory_budget"] * 2**20)
+    with profiled(profilepath, options["profile_format"]):
+        try:
+            with memorybudget(budget):
+                detector = TipDetector(options["serverport"], options["uuid"], bodyid, options["todoinstance"],
+                    options["username"], options["indexing"], options["roi"], options["excluded_roi"],
+                    options["run_instance"], options["low_memory"], tipwriter, options["location_encoding"],
+                    skeleton)
+                detector.run(options["find_only"], False, options["save_parameters"], options["run_index"])
+            result = detector.getresult()
+        except MarktipsError as e:
+            result = failureresult(str(e))
+        except Exception as e:
+            # some C extensions (eg, pandas' parser) report running out of memory
+            #   as their own errors
+            if isinstance(e, MemoryError) or "out of memory" in str(e):
+                # the parent runs it again later, on its own, in low-memory mode
+                detector = None
+                message = "body ran out of memory"
+                if options["memory_budget"] is not None:
+                    message += " (budget {} MB)".format(options["memory_budget"])
+                result = failureresult(message)
+                result["deferred"] = True
+            else:
+                # one bad body shouldn't take down the batch
+                result = failureresult(repr(e))
+    result["body ID"] = bodyid
+    result["dvid"] = requeststats.summary()
+    if skeleton is not None:
+        result["skeleton prefetched"] = (detector is not None and detector.skeletonprefetched and
+            detector.skeletonused)
+    if options["trace"] is not None:
+        # the parent writes these to the trace file and drops them from the result
+        result["trace"] = {
+            "start": tstart,
+            "duration": time.time() - tstart,
+            "spans": detector.timer.spans if detector is not None else [],
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "worker": workernumber,
+        }
+    return result
+
+
+def failureresult(message):
+    """
+    output: result dict for a body that failed
+    """
+    result = getdefaultoutput()
+    result["status"] = False
+    result["message"] = message
+    return result
+
+
+class WorkerPool:
+    """
+    worker processes for one class of bodies, with their own run options
+    """
+    def __init__(self, name, workers, options, bodyids):
+        self.name = name
+        self.workers = workers
+        self.options = options
+        self.bodies = iter(bodyids)
+        self.nbodies = len(bodyids)
+        self.npending = 0
+        self.executor = None
+
+
+class BatchRunner:
+    def __init__(self, options, bodyids, workers, output="-", metrics=None, journal=None, resumed=None,
+            sizeclasses=None, sizes=None):
+        """
+        input: dict of run options (parsed arguments); iterable of body IDs; number of
+            worker processes; path for the per-body json lines ("-" for stdout);
+            optional Metrics to keep up to date; optional Journal to record finished
+            bodies in; optional list of results of bodies finished by an earlier run,
+            to include in the output and totals; optional list of size class dicts,
+            each run in its own pool (instead of one pool of the given workers), with
+            a dict of body sizes to sort the bodies into them
+        """
+        self.options = options
+        self.bodyids = bodyids
+        self.workers = workers
+        self.sizeclasses = sizeclasses
+        self.sizes = sizes
+        self.pools = []
+        self.classsummary = []
+        self.prefetcher = None
+        self.roisummary = None
+        self.output = output
+        # runs that go on indefinitely append to their output
+        self.outputmode = "w"
+        self.metrics = metrics
+        self.journal = journal
+        self.resumed = resumed or []
+        self.tracewriter = None
+        self.bodies = None
+
+        # one set of DVID limits for all the workers
+        self.limits = makelimits(options)
+
+        self.inprogress = 0
+        self.totals = BatchTotals()
+
+        # bodies that ran out of memory, to be run again at the end; once
+        #   that's under way, they aren't deferred again
+        self.deferred = []
+        self.retrying = False
+
+    def run(self):
+        """
+        run all bodies and write the results
+
+        output: summary result dict
+        """
+        t1 = time.time()
+        inflight = multiprocessing.Value("i", 0)
+        workercount = multiprocessing.Value("i", 0)
+        if self.metrics is not None:
+            self.metrics.setgaugefunction("bodies_in_progress", lambda: self.inprogress)
+            self.metrics.setgaugefunction("dvid_requests_in_flight", lambda: inflight.value)
+            if self.limits.read is not None:
+                self.metrics.setgaugefunction("dvid_read_limit", lambda: self.limits.read.limit.value)
+            if self.limits.write is not None:
+                self.metrics.setgaugefunction("dvid_write_limit", lambda: self.limits.write.limit.value)
+
+        outfile = sys.stdout if self.output == "-" else open(self.output, self.outputmode)
+        if self.options["trace"] is not None:
+            self.tracewriter = TraceWriter(self.options["trace"])
+        if self.journal is not None:
+            self.journal.open()
+        manager = None
+        roibatcher = None
+        if self.options.get("coalesce_roi_queries"):
+            manager, roibatcher = startbatcher(self.limits, self.options["roi_batch_points"],
+                self.options["roi_batch_wait"])
+        try:
+            for result in self.resumed:
+                outfile.write(json.dumps(result) + "\n")
+                self.totals.add(result)
+            outfile.flush()
+
+            tipsoutput = None
+            if self.options["tips_output"] is not None:
+                tipsoutput = self.options["tips_output"], self.options["tips_format"], self.options["tips_chunk"]
+            # the workers' tip detection and the prefetcher read the same skeletons
+            segmentation = self.options.get("segmentation")
+            if segmentation is not None:
+                setsegmentation(segmentation)
+            if self.options.get("prefetch_skeletons"):
+                username = self.options["username"] or getpass.getuser()
+                self.prefetcher = SkeletonPrefetcher(self.options["serverport"], self.options["uuid"],
+                    skeletoninstance(), username, int(self.options["prefetch_bytes"] * 2**20), self.metrics)
+            initargs = (inflight, workercount, requeststats.slowcall, self.limits, self.options["trace_memory"],
+                tipsoutput, roibatcher, segmentation)
+            self.pools = self.makepools()
+            if self.prefetcher is not None:
+                for pool in self.pools:
+                    pool.bodies = self.prefetcher.wrap(pool.bodies)
+            with ExitStack() as stack:
+                # processes are only started once a pool has bodies to run
+                for pool in self.pools:
+                    pool.executor = stack.enter_context(ProcessPoolExecutor(max_workers=pool.workers,
+                        initializer=initworker, initargs=initargs))
+
+                # keep a bounded number of bodies queued in each pool, so we can
+                #   keep track of what's in progress; results from all pools go
+                #   to the one output, as they finish
+                pending = {}
+                while True:
+                    for pool in self.pools:
+                        for bodyid in self.nextbodies(pool, 2 * pool.workers - pool.npending):
+                            skeleton = self.prefetcher.take(bodyid) if self.prefetcher is not None else None
+                            pending[pool.executor.submit(runbody, pool.options, bodyid, skeleton)] = pool
+                            pool.npending += 1
+                            self.inprogress += 1
+                    if not pending:
+                        if self.morecoming():
+                            continue
+                        break
+                    done, _ = wait(pending, timeout=self.waittimeout(), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending.pop(future).npending -= 1
+                        self.inprogress -= 1
+                        self.addresult(future.result(), outfile)
+
+            # bodies that ran out of memory get a worker to themselves, without
+            #   the budget, in low-memory mode
+            if self.deferred:
+                self.retrying = True
+                options = dict(self.options, memory_budget=None, low_memory=True)
+                with ProcessPoolExecutor(max_workers=1, initializer=initworker,
+                        initargs=initargs) as executor:
+                    for bodyid in self.deferred:
+                        self.inprogress += 1
+                        result = executor.submit(runbody, options, bodyid).result()
+                        self.inprogress -= 1
+                        self.addresult(result, outfile)
+        finally:
+            if outfile is not sys.stdout:
+                outfile.close()
+            if self.tracewriter is not None:
+                self.tracewriter.close()
+            if self.journal is not None:
+                self.journal.close()
+            if manager is not None:
+                self.roisummary = roibatcher.summary()
+                manager.shutdown()
+
+        return self.getsummary(time.time() - t1)
+
+    def makepools(self):
+        """
+        output: list of WorkerPools to run the bodies in
+        """
+        if self.sizeclasses is None:
+            return [WorkerPool(None, self.workers, self.options, self.bodyids)]
+        pools = []
+        self.classsummary = []
+        for sizeclass, bodyids in classify(self.bodyids, self.sizes, self.sizeclasses):
+            self.classsummary.append(dict(sizeclass, nbodies=len(bodyids)))
+            options = self.options
+            if sizeclass["memory budget"] is not None:
+                options = dict(options, memory_budget=sizeclass["memory budget"])
+            pools.append(WorkerPool(sizeclass["name"], sizeclass["workers"], options, bodyids))
+        return pools
+
+    def nextbodies(self, pool, n):
+        """
+        output: list of up to n more bodies to run in the pool
+        """
+        return list(itertools.islice(pool.bodies, n))
+
+    def morecoming(self):
+        """
+        called when there are no bodies to run and none running
+
+        output: True if more bodies may become available (after waiting for them)
+        """
+        return False
+
+    def waittimeout(self):
+        """
+        output: most seconds to wait for a body to finish before looking for
+            more bodies to run (None: until one finishes)
+        """
+        return None
+
+    def addresult(self, result, outfile):
+        """
+        record one body's result: write it out and add it to the totals
+        """
+        if "skeleton prefetched" in result:
+            self.prefetcher.used(result.pop("skeleton prefetched"))
+        if result.get("deferred") and not self.retrying:
+            self.deferred.append(result["body ID"])
+            return
+        result.pop("deferred", None)
+
+        if "trace" in result:
+            self.addtrace(result.pop("trace"), result)
+
+        outfile.write(json.dumps(result) + "\n")
+        outfile.flush()
+        if self.journal is not None:
+            self.journal.add(result)
+        self.totals.add(result)
+
+        if self.metrics is not None:
+            self.metrics.addresult(result)
+            self.metrics.adddvid(result["dvid"])
+
+    def addtrace(self, trace, result):
+        """
+        write one body's spans to the trace file
+        """
+        self.tracewriter.nameprocess(trace["pid"], "worker {}".format(trace["worker"]))
+        self.tracewriter.add(bodyevents(result["body ID"], trace["start"], trace["duration"], trace["spans"],
+            trace["pid"], trace["tid"], trace["worker"], result["status"]))
+
+    def getsummary(self, elapsed):
+        """
+        input: wall time for the batch
+        output: summary result dict
+        """
+        result = self.totals.getsummary(elapsed)
+        result["deferred"] = self.deferred
+        if self.journal is not None:
+            result["journal"] = self.journal.path
+            result["nresumed"] = len(self.resumed)
+        if self.sizeclasses is not None:
+            result["size classes"] = self.classsummary
+        if self.options.get("schedule") is not None:
+            result["schedule"] = self.options["schedule"]
+        if self.options.get("shard") is not None:
+            result["shard"] = "{}/{}".format(*self.options["shard"])
+        if self.options["tips_output"] is not None:
+            result["tips output"] = self.options["tips_output"]
+        if self.prefetcher is not None:
+            result["skeleton prefetch"] = self.prefetcher.summary()
+        if self.roisummary is not None:
+            result["RoI queries"] = self.roisummary
+        result["dvid limits"] = self.limits.summary()
+        return result
+
+
+class EstimateRunner(BatchRunner):
+    """
+    a batch run on a sample of the bodies, to estimate what running them all
+    will cost; the sample should be run in find-only mode
+    """
+    def __init__(self, options, bodyids, workers, output="-", metrics=None, nbodies=None, sizes=None,
+            estimateworkers=None, sizeclasses=None):
+        """
+        input: as for BatchRunner, with the sampled body IDs; number of bodies in the
+            whole batch; optional dict of body sizes for the whole batch; number of
+            bodies the whole batch would run at once (default: workers)
+        """
+        # each body fetches its own skeleton, so those calls are measured
+        options = dict(options, prefetch_skeletons=False)
+        super().__init__(options, bodyids, workers, output, metrics, sizeclasses=sizeclasses, sizes=sizes)
+        self.nbodies = nbodies if nbodies is not None else len(bodyids)
+        self.estimateworkers = estimateworkers or workers
+        self.samples = []
+
+    def addresult(self, result, outfile):
+        if not (result.get("deferred") and not self.retrying):
+            size = self.sizes.get(result["body ID"]) if self.sizes is not None else None
+            self.samples.append(measure(result, size))
+        super().addresult(result, outfile)
+
+    def getsummary(self, elapsed):
+        result = super().getsummary(elapsed)
+        if not self.samples:
+            return result
+        estimate = extrapolate(self.samples, self.nbodies, self.estimateworkers, self.sizes,
+            todobytes(self.options["indexing"], self.options["save_parameters"]))
+        if estimate is None:
+            result["message"] = "no estimate, as no sampled body succeeded; from " + result["message"]
+            return result
+        result["estimate"] = estimate
+        result["message"] = (f"estimate for {estimate['nbodies']} bodies on {estimate['workers']} workers: " +
+            f"{estimate['runtime'] / 3600:.2f} h, {estimate['requests']:.0f} DVID calls, " +
+            f"{estimate['bytes'] / 2**30:.2f} GiB; from " + result["message"])
+        return result
+
+
+class BatchTotals:
+    """
+    totals over per-body results, for a batch summary
+    """
+    def __init__(self):
+        self.nsucceeded = 0
+        self.failed = []
+        self.ntips = 0
+        self.nplaced = 0
+        self.stages = {}
+        self.dvidstats = RequestStats()
+        self.peakrss = 0
+
+    def add(self, result):
+        """
+        input: one body's result dict
+        """
+        if result["status"]:
+            self.nsucceeded += 1
+            self.ntips += result["nlocations"]
+            self.nplaced += result["nplaced"]
+            self.peakrss = max(self.peakrss, result.get("memory", {}).get("peak RSS") or 0)
+            for stage, entry in result["stages"].items():
+                total = self.stages.setdefault(stage, {"time": 0.0, "bytes": 0, "points": 0})
+                for key in total:
+                    total[key] += entry[key]
+        else:
+            self.failed.append(result["body ID"])
+        self.dvidstats.merge(result["dvid"])
+
+    def getsummary(self, elapsed):
+        """
+        input: wall time for the batch
+        output: summary result dict
+        """
+        # count what was run, rather than what was asked for (which may not be known, eg, with a queue)
+        nbodies = self.nsucceeded + len(self.failed)
+        result = getdefaultoutput()
+        result["status"] = not self.failed
+        result["message"] = (f"{nbodies} bodies run in {elapsed}s; {len(self.failed)} failed; " +
+            f"{self.ntips} tips found; {self.nplaced} to do items placed")
+        result["nbodies"] = nbodies
+        result["nsucceeded"] = self.nsucceeded
+        result["failed"] = self.failed
+        result["peak RSS"] = self.peakrss
+        result["nlocations"] = self.ntips
+        result["nplaced"] = self.nplaced
+        result["ttotal"] = elapsed
+        result["stages"] = self.stages
+        result["dvid"] = self.dvidstats.summary()
+        return result
+
+
+def parseshard(text):
+    """
+    input: shard as "i/N", with 0 <= i < N
+    output: (i, N)
+    """
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must be i/N, eg, 3/16")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("shard i/N must have 0 <= i < N")
+    return index, count
+
+
+def shardof(bodyid, count):
+    """
+    input: body ID; number of shards
+    output: the body's shard, from a hash that's the same on every run and machine
+    """
+    digest = hashlib.sha1(str(bodyid).encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def addbatcharguments(parser):
+    """
+    adds the optional arguments for running many bodies in worker processes;
+    shared by the batch and queue scripts
+    """
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--memory-budget", type=float,
+        help="memory budget per body in MB; bodies that go over are put off until the end, " +
+        "then run one at a time in low-memory mode")
+    parser.add_argument("--output", default="-",
+        help="path for the per-body results, one json object per line (default: stdout)")
+    parser.add_argument("--coalesce-roi-queries", action="store_true", default=False,
+        help="combine the RoI point queries of bodies running at the same time into one call per RoI")
+    parser.add_argument("--roi-batch-points", type=int, default=defaultmaxpoints,
+        help="with --coalesce-roi-queries, most points per call (default: %(default)s)")
+    parser.add_argument("--roi-batch-wait", type=float, default=defaultwait,
+        help="with --coalesce-roi-queries, seconds a query waits for others to combine with " +
+        "(default: %(default)s)")
+    parser.add_argument("--metrics-port", type=int,
+        help="serve live metrics in Prometheus text format on this port")
+    parser.add_argument("--metrics-file",
+        help="periodically write live metrics in Prometheus text format to this file")
+    parser.add_argument("--metrics-interval", type=float, default=defaultinterval,
+        help="seconds between rewrites of --metrics-file (default: %(default)s)")
+
+
+def setupbatch(args):
+    """
+    common setup for a batch, after the arguments are parsed
+
+    input: parsed arguments, from a parser set up by addrunarguments() and addbatcharguments()
+    output: (Metrics or None, function to stop the metrics textfile or None)
+    """
+    if not args.serverport.startswith("http://"):
+        args.serverport = "http://" + args.serverport
+    requeststats.slowcall = args.slow_call
+
+    # profile parts are named for this run, so parts left by an earlier one
+    #   aren't merged in
+    args.profile_parts = None
+    if args.profile is not None:
+        args.profile_parts = "{}.part.{}".format(args.profile, makerunid())
+
+    metrics = None
+    stopmetricsfile = None
+    if args.metrics_port is not None or args.metrics_file is not None:
+        metrics = Metrics()
+        if args.metrics_port is not None:
+            metrics.serve(args.metrics_port)
+        if args.metrics_file is not None:
+            stopmetricsfile = metrics.starttextfile(args.metrics_file, args.metrics_interval)
+
+    if getattr(args, "segmentation", None) is not None:
+        # fail here rather than in every worker if dvidtools can't use it
+        try:
+            setsegmentation(args.segmentation)
+        except MarktipsError as e:
+            errorquit(str(e))
+
+    if args.tips_output is not None:
+        # fail here rather than in every worker if it can't be written
+        try:
+            TipWriter(args.tips_output, args.tips_format, args.tips_chunk)
+        except ValueError as e:
+            errorquit(str(e))
+    return metrics, stopmetricsfile
+
+
+def runbatch(runner, args, stopmetricsfile):
+    """
+    run a batch, print the summary, and quit
+
+    input: BatchRunner; parsed arguments; function to stop the metrics textfile or None
+    """
+    try:
+        # the workers write their own profiles, which are merged with this one
+        with profiled(args.profile and args.profile_parts + ".main", args.profile_format):
+            result = runner.run()
+    finally:
+        if stopmetricsfile is not None:
+            stopmetricsfile()
+    if args.profile is not None:
+        mergeprofiles(glob.glob(glob.escape(args.profile_parts) + ".*"), args.profile, args.profile_format)
+    print(json.dumps(result))
+    sys.exit(0 if result["status"] else 1)
+
+
+def main():
+    if not hasDVIDtools:
+        errorquit("could not import dvid_tools library")
+
+    parser = argparse.ArgumentParser(description="find and mark tips on many neurons")
+
+    # required positional arguments
+    parser.add_argument("serverport", help="server and port of DVID server")
+    parser.add_argument("uuid", help="UUID of the DVID node")
+    parser.add_argument("bodyfile", help="file of body IDs, one per line ('-' for stdin)")
+    parser.add_argument("todoinstance", help="DVID instance name where to do items are stored")
+
+    parser.add_argument("--version", action="version", version=__version__)
+    addrunarguments(parser)
+    addbatcharguments(parser)
+    parser.add_argument("--shard", type=parseshard,
+        help="run only shard i of N (0 <= i < N) of the bodies, eg, for cluster array jobs; bodies are " +
+        "assigned to shards by a hash of the body ID, so every run assigns them the same way; " +
+        "combine the shards' outputs with marktipsmerge")
+    parser.add_argument("--schedule", choices=sorted(schedulingpolicies), default="input",
+        help="order to run the bodies in: as given, largest first (by voxel count, from " +
+        "--segmentation), or random (default: %(default)s)")
+    parser.add_argument("--segmentation", default="segmentation",
+        help="DVID segmentation instance to get body sizes from, and whose skeletons (in this + " +
+        "\"_skeletons\") tips are found on (default: %(default)s)")
+    parser.add_argument("--prefetch-skeletons", action="store_true", default=False,
+        help="fetch the skeletons of groups of bodies in one call to the skeleton instance (--segmentation " +
+        "+ \"_skeletons\"), rather than one call per body; helps most with many small bodies")
+    parser.add_argument("--prefetch-bytes", type=float, default=defaulttargetbytes / 2**20,
+        help="with --prefetch-skeletons, aim for this many MB of skeletons per call (default: %(default)s)")
+    parser.add_argument("--size-class", type=parsesizeclass, action="append",
+        help="run bodies up to a size in their own pool of workers, with an optional memory budget " +
+        "per body (MB), as name:max size:workers[:memory budget], eg, small:1e8:32:2000; give once " +
+        "per class, with max size - for no maximum; bodies go in the smallest class they fit, " +
+        "the largest class taking any that fit none; replaces --workers")
+    parser.add_argument("--estimate", type=float, metavar="FRACTION",
+        help="estimate the run time, DVID calls and bytes of the batch by running this fraction " +
+        "of the bodies (eg, 0.01), finding tips only; no to do items are placed")
+    parser.add_argument("--estimate-seed", type=int, help="random seed for choosing the --estimate sample")
+    parser.add_argument("--estimate-workers", type=int,
+        help="number of bodies the full batch would run at once, for --estimate (default: the workers " +
+        "given, or the total over the size classes)")
+    parser.add_argument("--journal",
+        help="append each finished body's result to this file (json lines), for --resume")
+    parser.add_argument("--resume", action="store_true", default=False,
+        help="skip bodies that succeeded in an earlier run with the same --journal (a find-only run " +
+        "doesn't count for a run that places to do items); their results are included in the output " +
+        "and summary, and failed or unfinished bodies are run again")
+
+    args = parser.parse_args()
+    if args.resume and args.journal is None:
+        errorquit("--resume requires --journal")
+    if args.estimate is not None:
+        if not 0 < args.estimate <= 1:
+            errorquit("--estimate must be a fraction between 0 and 1")
+        if args.journal is not None:
+            # a sample run doesn't place to do items, so it mustn't count as done
+            errorquit("--estimate can't be used with --journal")
+        args.find_only = True
+    metrics, stopmetricsfile = setupbatch(args)
+    bodyids = readbodyids(args.bodyfile)
+    if args.shard is not None:
+        index, count = args.shard
+        bodyids = [bodyid for bodyid in bodyids if shardof(bodyid, count) == index]
+
+    journal = None
+    resumed = []
+    if args.journal is not None:
+        journal = Journal(args.journal, runmode(args.find_only))
+        if args.resume:
+            try:
+                finished = journal.read()
+            except (OSError, KeyError) as e:
+                errorquit("could not read journal {}: {}".format(args.journal, e))
+            resumed = [finished[bodyid] for bodyid in bodyids if bodyid in finished]
+            bodyids = [bodyid for bodyid in bodyids if bodyid not in finished]
+
+    username = args.username if args.username is not None else getpass.getuser()
+    try:
+        bodyids, sizes = schedule(args.schedule, bodyids, args.serverport, args.uuid, args.segmentation, username)
+        if args.size_class is not None and sizes is None:
+            sizes = getbodysizes(args.serverport, args.uuid, args.segmentation, bodyids, username)
+    except MarktipsError as e:
+        errorquit(str(e))
+
+    if args.estimate is not None:
+        if sizes is None:
+            # better estimates with them, but they aren't essential
+            try:
+                sizes = getbodysizes(args.serverport, args.uuid, args.segmentation, bodyids, username)
+            except (MarktipsError, ValueError):
+                sizes = None
+        estimateworkers = args.estimate_workers
+        if estimateworkers is None:
+            estimateworkers = sum(c["workers"] for c in args.size_class) if args.size_class else args.workers
+        sample = samplebodies(bodyids, args.estimate, args.estimate_seed)
+        runner = EstimateRunner(vars(args), sample, args.workers, args.output, metrics, len(bodyids), sizes,
+            estimateworkers, args.size_class)
+    else:
+        runner = BatchRunner(vars(args), bodyids, args.workers, args.output, metrics, journal, resumed,
+            args.size_class, sizes)
+    runbatch(runner, args, stopmetricsfile)
+
+
+# ------------------------------ script starts here ------------------------------
+if __name__ == "__main__":
+    main()
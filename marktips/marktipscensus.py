@@ -0,0 +1,275 @@
+"""
+
+marktipscensus.py
+
+this script reports marktips coverage over a whole dataset by scanning the
+to do instance block by block, rather than body by body; blocks are read
+concurrently and the tip detector to do items found are tallied per run and
+per body as the blocks come in
+
+see project wiki for usage
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import argparse
+import collections
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import getpass
+import itertools
+import json
+import sys
+
+# third party
+import requests
+
+# local
+from . import __version__
+from .marktips import getdvid, getkeyvalues, parsetodos, setpoolsize, errorquit, getdefaultoutput, \
+    runinstancename
+
+
+# ------------------------------ constants ------------------------------
+appname = "marktipscensus.py"
+
+defaultblocksize = 1024
+
+# key for tip to do items that can't be attributed to a run or body
+unknown = "unknown"
+
+
+# ------------------------------ code ------------------------------
+class CensusError(Exception):
+    pass
+
+
+class TipCensus:
+    def __init__(self, serverport, uuid, todoinstance, bounds, blocksize=defaultblocksize,
+        segmentation=None, runinstance=runinstancename, workers=8):
+        """
+        input: server; UUID; to do instance; ((x0, y0, z0), (x1, y1, z1)) bounds
+            to scan (inclusive); block edge length; optional segmentation instance
+            for attributing to do items without run information to bodies;
+            run instance; number of blocks to read concurrently
+        """
+        self.serverport = serverport
+        self.uuid = uuid
+        self.todoinstance = todoinstance
+        self.bounds = bounds
+        self.blocksize = blocksize
+        self.segmentation = segmentation
+        self.runinstance = runinstance
+        self.workers = workers
+        self.username = getpass.getuser()
+
+        # running tallies; run key = run ID, or "time|body ID" for runs
+        #   whose parameters are stored on each to do
+        self.runcounts = collections.Counter()
+        self.runparams = {}
+        self.unattributed = collections.Counter()
+        self.nblocks = 0
+        self.ntodos = 0
+
+    def blocks(self):
+        """
+        output: iterator over (offset, size) of the blocks covering the bounds
+        """
+        (x0, y0, z0), (x1, y1, z1) = self.bounds
+        b = self.blocksize
+        for z, y, x in itertools.product(range(z0, z1 + 1, b), range(y0, y1 + 1, b), range(x0, x1 + 1, b)):
+            offset = (x, y, z)
+            size = (min(b, x1 + 1 - x), min(b, y1 + 1 - y), min(b, z1 + 1 - z))
+            yield offset, size
+
+    def run(self):
+        """
+        scan all blocks and tally tip to do items
+
+        output: census result dict
+        """
+        setpoolsize(self.workers)
+
+        # keep a bounded number of blocks in flight, so memory doesn't grow
+        #   with the size of the dataset
+        blocks = self.blocks()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {executor.submit(self.scanblock, *block)
+                for block in itertools.islice(blocks, 2 * self.workers)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.addblock(*future.result())
+                for block in itertools.islice(blocks, len(done)):
+                    pending.add(executor.submit(self.scanblock, *block))
+        return self.makeresult()
+
+    def scanblock(self, offset, size):
+        """
+        read and tally the tip to do items in one block
+
+        input: (x, y, z) offset; (x, y, z) size
+        output: Counter {run key: count}; dict {run key: param dict} for runs
+            with parameters stored on the to do; Counter {body ID: count}
+            for to do items without run information
+        """
+        call = self.serverport + "/api/node/" + self.uuid + "/" + self.todoinstance + "/elements/"
+        call += "_".join(str(v) for v in size) + "/" + "_".join(str(v) for v in offset)
+        r = getdvid(call, self.username, stream=True)
+        if r.status_code != requests.codes.ok:
+            message = "to do retrieval failed!\n"
+            message += f"url: {call}\n"
+            message += f"status code: {r.status_code}\n"
+            message += f"returned text: {r.text}\n"
+            raise CensusError(message)
+
+        runcounts = collections.Counter()
+        runparams = {}
+        unattributed = []
+        for todo in parsetodos(r):
+            props = todo["Prop"]
+            if props.get("action", "") != "tip detector":
+                continue
+            if "run ID" in props:
+                runcounts[props["run ID"]] += 1
+            elif "run parameters" in props:
+                params = json.loads(props["run parameters"])
+                key = "{}|{}".format(params["time"], params["body ID"])
+                runcounts[key] += 1
+                runparams.setdefault(key, params)
+            else:
+                unattributed.append(todo["Pos"])
+
+        bodycounts = collections.Counter()
+        if unattributed:
+            for bodyid in self.getlabels(unattributed):
+                bodycounts[str(bodyid) if bodyid else unknown] += 1
+        return runcounts, runparams, bodycounts
+
+    def getlabels(self, pointlist):
+        """
+        input: list of [x, y, z] points
+        output: list of body IDs at those points; unknown if no segmentation was given
+        """
+        if self.segmentation is None:
+            return [None] * len(pointlist)
+        call = self.serverport + "/api/node/" + self.uuid + "/" + self.segmentation + "/labels"
+        r = getdvid(call, self.username, data=pointlist)
+        if r.status_code != requests.codes.ok:
+            return [None] * len(pointlist)
+        return r.json()
+
+    def addblock(self, runcounts, runparams, bodycounts):
+        """
+        merge one block's tallies into the running totals
+        """
+        self.nblocks += 1
+        self.ntodos += sum(runcounts.values()) + sum(bodycounts.values())
+        self.runcounts.update(runcounts)
+        for key, params in runparams.items():
+            self.runparams.setdefault(key, params)
+        self.unattributed.update(bodycounts)
+
+    def makeresult(self):
+        """
+        output: census result dict, with one entry per run and a count per body
+        """
+        runids = [key for key in self.runcounts if key not in self.runparams]
+        values = getkeyvalues(self.serverport, self.uuid, self.runinstance, runids, self.username)
+        for runid, value in values.items():
+            self.runparams[runid] = json.loads(value)
+
+        runs = []
+        bodycounts = collections.Counter(self.unattributed)
+        for key, count in self.runcounts.items():
+            # runs whose record couldn't be found are reported by run ID only
+            params = self.runparams.get(key, {"run ID": key})
+            temp = {}
+            temp["time"] = params.get("time", "")
+            temp["body ID"] = params.get("body ID", unknown)
+            temp["RoI"] = params.get("RoI", "")
+            temp["excluded RoI"] = params.get("excluded RoI", "")
+            temp["run ID"] = params.get("run ID", "")
+            temp["count"] = count
+            runs.append(temp)
+            bodycounts[str(temp["body ID"])] += count
+        runs.sort(key=lambda item: (item["time"], str(item["body ID"])))
+
+        result = getdefaultoutput()
+        result["status"] = True
+        result["message"] = f"{self.ntodos} tip to do items in {len(runs)} runs on {len(bodycounts)} bodies"
+        result["nblocks"] = self.nblocks
+        result["ntodos"] = self.ntodos
+        result["runs"] = runs
+        result["bodies"] = dict(bodycounts)
+        return result
+
+
+def getbounds(serverport, uuid, segmentation):
+    """
+    input: server; UUID; segmentation instance
+    output: ((x0, y0, z0), (x1, y1, z1)) extents of the segmentation
+    """
+    call = serverport + "/api/node/" + uuid + "/" + segmentation + "/info"
+    r = getdvid(call, getpass.getuser())
+    if r.status_code != requests.codes.ok:
+        errorquit(f"could not retrieve info for {segmentation}")
+    extended = r.json()["Extended"]
+    return tuple(extended["MinPoint"]), tuple(extended["MaxPoint"])
+
+
+def parsebounds(text):
+    """
+    input: "x0,y0,z0,x1,y1,z1"
+    output: ((x0, y0, z0), (x1, y1, z1))
+    """
+    values = [int(v) for v in text.split(",")]
+    if len(values) != 6:
+        raise argparse.ArgumentTypeError("bounds must be six comma-separated integers")
+    return tuple(values[:3]), tuple(values[3:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="report marktips coverage over a whole dataset")
+
+    # positional
+    parser.add_argument("serverport", help="server and port of DVID server")
+    parser.add_argument("uuid", help="UUID of the DVID node")
+    parser.add_argument("todoinstance", help="DVID instance name where to do items are stored")
+
+    parser.add_argument("--version", action="version", version=__version__)
+    parser.add_argument("--bounds", type=parsebounds,
+        help="region to scan as x0,y0,z0,x1,y1,z1 (inclusive); default: extents of --segmentation")
+    parser.add_argument("--segmentation",
+        help="DVID segmentation instance; used for the default bounds, and to attribute " +
+        "to do items without run information to bodies")
+    parser.add_argument("--block-size", type=int, default=defaultblocksize,
+        help="edge length of the blocks read from DVID (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=8,
+        help="number of blocks to read concurrently (default: %(default)s)")
+    parser.add_argument("--run-instance", default=runinstancename,
+        help="DVID keyvalue instance where run parameters are stored (default: %(default)s)")
+
+    args = parser.parse_args()
+    if not args.serverport.startswith("http://"):
+        args.serverport = "http://" + args.serverport
+
+    if args.bounds is None:
+        if args.segmentation is None:
+            errorquit("either --bounds or --segmentation must be given")
+        args.bounds = getbounds(args.serverport, args.uuid, args.segmentation)
+
+    census = TipCensus(args.serverport, args.uuid, args.todoinstance, args.bounds, args.block_size,
+        args.segmentation, args.run_instance, args.workers)
+    try:
+        result = census.run()
+    except CensusError as e:
+        errorquit(str(e))
+    print(json.dumps(result))
+    sys.exit(0)
+
+
+# ------------------------------ script starts here ------------------------------
+if __name__ == "__main__":
+    main()
@@ -14,34 +14,85 @@ see project wiki for usage
 # std lib
 import argparse
 import collections
+from concurrent.futures import ThreadPoolExecutor
+import csv
 import getpass
 import json
+import sqlite3
 import sys
+import tarfile
 
 # third party
 import requests
 
+try:
+    import pandas as pd
+    hasPandas = True
+except ImportError:
+    hasPandas = False
+
+try:
+    import ijson
+    hasijson = True
+except ImportError:
+    hasijson = False
+
 # local
 from . import __version__
 
 # someday factor these out into a library file, but
 #   for now, grab from the other script:
-from .marktips import getdvid, errorquit, getdefaultoutput
+from .marktips import getdvid, getkeyvalues, parsetodos, setpoolsize, errorquit, getdefaultoutput, \
+    runinstancename
+from .profiling import profiled, profileformats
+from .runindex import RunIndex
 
 
 # ------------------------------ constants ------------------------------
 appname = "marktipshistory.py"
 
+# columns of the table output for many bodies
+historycolumns = ["body ID", "time", "RoI", "excluded RoI", "run ID", "count", "error"]
+
 
 # ------------------------------ code ------------------------------
+class HistoryError(Exception):
+    pass
+
+
+# what can go wrong finding one body's history: DVID errors, failed
+#   connections, and responses that don't parse
+bodyerrors = (HistoryError, requests.RequestException, ValueError, tarfile.TarError)
+if hasijson:
+    bodyerrors += (ijson.JSONError,)
+
+
 class MarktipsHistoryFinder:
-    def __init__(self, serverport, uuid, bodyid, todoinstance):
+    def __init__(self, serverport, uuid, bodyid, todoinstance, runinstance=runinstancename):
         self.serverport = serverport
         self.uuid = uuid
         self.bodyid = bodyid
         self.todoinstance = todoinstance
+        self.runinstance = runinstance
+
+    def findhistory(self, index=None):
+        """
+        find history for the body; report results by printing json; quit
 
-    def findhistory(self):
+        input: optional RunIndex to answer from instead of DVID
+        """
+        if index is not None:
+            self.reportquit(index.gethistory(self.bodyid, self.serverport, self.uuid, self.todoinstance))
+        try:
+            history = self.gethistory()
+        except bodyerrors as e:
+            errorquit(str(e))
+        self.reportquit(history)
+
+    def gethistory(self):
+        """
+        output: list of dicts, one per previous run of marktips on the body
+        """
 
         todolist = self.gettodos()
 
@@ -51,60 +102,188 @@ class MarktipsHistoryFinder:
         #   though, key on time and body ID pair; we'll store the full run params
         #   from one such run, but we will assume that they all match if the time and
         #   body ID do, without checking
+        # newer to do items carry only a run ID, and the parameters are stored once
+        #   per run in a keyvalue instance; older ones carry the full parameters
+        todolist = [todo for todo in todolist if todo["Prop"].get("action", "") == "tip detector"]
+        runrecords = self.getrunrecords({todo["Prop"]["run ID"] for todo in todolist
+            if "run ID" in todo["Prop"]})
+
         params = {}
         counts = collections.Counter()
         for todo in todolist:
             props = todo["Prop"]
-            if props["action"] != "tip detector" or "run parameters" not in props:
-                # this will miss runs with marktips 0.2 or earlier
+            if "run ID" in props and props["run ID"] in runrecords:
+                todoparams = runrecords[props["run ID"]]
+            elif "run parameters" in props:
+                todoparams = json.loads(props["run parameters"])
+            else:
+                # this will miss runs with marktips 0.2 or earlier, and runs
+                #   whose record can't be found
                 continue
-            todoparams = json.loads(props["run parameters"])
             key = todoparams["time"], todoparams["body ID"]
             if key not in params:
                 params[key] = todoparams
             counts[key] += 1
-        self.reportquit(params, counts)
 
-    def reportquit(self, paramdict, paramcounts):
+        history = []
+        for key, runparams in params.items():
+            # we only pass on a subset of all parameters
+            temp = {}
+            temp["time"] = runparams["time"]
+            temp["body ID"] = runparams["body ID"]
+            temp["RoI"] = runparams.get("RoI", "")
+            temp["excluded RoI"] = runparams.get("excluded RoI", "")
+            temp["run ID"] = runparams.get("run ID", "")
+            temp["count"] = counts[key]
+            history.append(temp)
+        return history
+
+    def reportquit(self, history):
         """
-        input: dict {(time, body ID): param dict}, {(time, body ID): count}
+        input: list of history dicts
         output: none (prints json output to screen)
         """
         message = "marktipshistory ran successfully"
         result = getdefaultoutput()
         result["status"] = True
         result["message"] = message
-        result["history"] = []
-
-        for key, params in paramdict.items():
-            # we only pass on a subset of all parameters
-            temp = {}
-            temp["time"] = params["time"]
-            temp["body ID"] = params["body ID"]
-            temp["RoI"] = params.get("RoI", "")
-            temp["excluded RoI"] = params.get("excluded RoI", "")
-            temp["count"] = paramcounts[key]
-            result["history"].append(temp)
-
+        result["history"] = history
         print(json.dumps(result))
         sys.exit(0)
 
+    def getrunrecords(self, runids):
+        """
+        retrieve run records for many runs at once
+
+        input: collection of run IDs
+        output: dict {run ID: param dict}; runs not found are omitted
+        """
+        if self.runinstance is None:
+            return {}
+        values = getkeyvalues(self.serverport, self.uuid, self.runinstance, sorted(runids), getpass.getuser())
+        return {runid: json.loads(value) for runid, value in values.items()}
+
     def gettodos(self):
         """
         retrieve to do items on the body of interest
         """
         todocall = self.serverport + "/api/node/" + self.uuid + "/" + self.todoinstance + "/label/" + self.bodyid
-        r = getdvid(todocall, getpass.getuser())
+        r = getdvid(todocall, getpass.getuser(), stream=True)
         if r.status_code != requests.codes.ok:
-            # bail out; later I'd prefer to have the error percolate up and be
-            #   handled by the calling routine, but for now, just quit:
             message = "existing to do retrieval failed!\n"
             message += f"url: {todocall}\n"
             message += f"status code: {r.status_code}\n"
             message += f"returned text: {r.text}\n"
-            errorquit(message)
+            raise HistoryError(message)
         else:
-            return r.json()
+            return parsetodos(r)
+
+
+def readbodyids(path):
+    """
+    input: path to a file of body IDs, one per line; "-" for stdin
+    output: list of body IDs (as strings), in order, without duplicates
+    """
+    if path == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(path) as f:
+            lines = f.readlines()
+    bodyids = [line.strip() for line in lines]
+    return list(dict.fromkeys(bodyid for bodyid in bodyids if bodyid and not bodyid.startswith("#")))
+
+
+def findhistories(serverport, uuid, bodyids, todoinstance, runinstance=runinstancename, workers=8):
+    """
+    find history for many bodies; the to do items for the bodies are
+    retrieved concurrently over the shared connection pool
+
+    input: server; UUID; list of body IDs; to do instance; run instance;
+        number of concurrent requests
+    output: list of row dicts with keys historycolumns; one row per run,
+        and one row with count 0 for bodies with no runs or errors
+    """
+    setpoolsize(workers)
+
+    def bodyrows(bodyid):
+        finder = MarktipsHistoryFinder(serverport, uuid, bodyid, todoinstance, runinstance)
+        try:
+            history = finder.gethistory()
+        except bodyerrors as e:
+            message = str(e).splitlines()[0] if str(e) else type(e).__name__
+            return [makerow(bodyid, error=message)]
+        return makerows(bodyid, history)
+
+    rows = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map() keeps the input order of the bodies
+        for result in executor.map(bodyrows, bodyids):
+            rows.extend(result)
+    return rows
+
+
+def indexhistories(index, bodyids, serverport, uuid, todoinstance):
+    """
+    find history for many bodies from a run index
+
+    input: RunIndex; list of body IDs; server, UUID and to do instance the
+        runs were made on
+    output: list of row dicts, as from findhistories()
+    """
+    rows = []
+    for bodyid in bodyids:
+        rows.extend(makerows(bodyid, index.gethistory(bodyid, serverport, uuid, todoinstance)))
+    return rows
+
+
+def makerows(bodyid, history):
+    """
+    input: body ID; list of history dicts for the body
+    output: list of row dicts for the history table, oldest run first
+    """
+    if not history:
+        return [makerow(bodyid)]
+    return [makerow(bodyid, item) for item in sorted(history, key=lambda item: item["time"])]
+
+
+def makerow(bodyid, item=None, error=""):
+    """
+    input: body ID; history dict for one run (or None); error message
+    output: row dict for the history table
+    """
+    row = {column: "" for column in historycolumns}
+    row["body ID"] = bodyid
+    row["count"] = 0
+    row["error"] = error
+    if item is not None:
+        row.update({column: item[column] for column in historycolumns if column in item})
+    return row
+
+
+def writetable(rows, path):
+    """
+    write history rows as a table; format is determined by the file
+    extension: .parquet for Parquet (requires pandas), otherwise CSV
+
+    input: list of row dicts; output path, or "-" for stdout
+    """
+    if path.endswith(".parquet"):
+        if not hasPandas:
+            errorquit("writing Parquet requires the pandas library")
+        df = pd.DataFrame(rows, columns=historycolumns)
+        df["count"] = df["count"].astype("int64")
+        df.to_parquet(path, index=False)
+    elif path == "-":
+        writecsv(rows, sys.stdout)
+    else:
+        with open(path, "w", newline="") as f:
+            writecsv(rows, f)
+
+
+def writecsv(rows, f):
+    writer = csv.DictWriter(f, fieldnames=historycolumns)
+    writer.writeheader()
+    writer.writerows(rows)
 
 
 def main():
@@ -113,17 +292,49 @@ def main():
     # positional
     parser.add_argument("serverport", help="server and port of DVID server")
     parser.add_argument("uuid", help="UUID of the DVID node")
-    parser.add_argument("bodyid", help="body ID of the body to find tips on")
+    parser.add_argument("bodyid", help="body ID of the body to find tips on; " +
+        "with --body-file, a file of body IDs, one per line ('-' for stdin)")
     parser.add_argument("todoinstance", help="DVID instance name where to do items are stored")
 
     parser.add_argument("--version", action="version", version=__version__)
+    parser.add_argument("--run-instance", default=runinstancename,
+        help="DVID keyvalue instance where run parameters are stored (default: %(default)s)")
+    parser.add_argument("--body-file", action="store_true",
+        help="read many body IDs from the file given as bodyid and output a table instead of json")
+    parser.add_argument("--output", default="-",
+        help="with --body-file, path for the output table; .parquet for Parquet, otherwise CSV (default: stdout)")
+    parser.add_argument("--workers", type=int, default=8,
+        help="with --body-file, number of bodies to retrieve concurrently (default: %(default)s)")
+    parser.add_argument("--run-index",
+        help="answer from this SQLite run index instead of DVID; runs not recorded there will not be reported")
+    parser.add_argument("--profile", help="profile the run and write the profile to this path")
+    parser.add_argument("--profile-format", choices=profileformats, default="pstats",
+        help="cProfile stats, or sampled stacks in collapsed (flame graph) format (default: %(default)s)")
 
     args = parser.parse_args()
     if not args.serverport.startswith("http://"):
         args.serverport = "http://" + args.serverport
 
-    finder = MarktipsHistoryFinder(args.serverport, args.uuid, args.bodyid, args.todoinstance)
-    finder.findhistory()
+    index = None
+    if args.run_index is not None:
+        try:
+            index = RunIndex(args.run_index, readonly=True)
+        except (OSError, sqlite3.Error) as e:
+            errorquit("could not open run index {}: {}".format(args.run_index, e))
+
+    with profiled(args.profile, args.profile_format):
+        if args.body_file:
+            bodyids = readbodyids(args.bodyid)
+            if index is not None:
+                rows = indexhistories(index, bodyids, args.serverport, args.uuid, args.todoinstance)
+            else:
+                rows = findhistories(args.serverport, args.uuid, bodyids, args.todoinstance,
+                    args.run_instance, args.workers)
+            writetable(rows, args.output)
+        else:
+            finder = MarktipsHistoryFinder(args.serverport, args.uuid, args.bodyid, args.todoinstance,
+                args.run_instance)
+            finder.findhistory(index)
 
 
 # ------------------------------ script starts here ------------------------------
@@ -0,0 +1,91 @@
+"""
+
+marktipsindex.py
+
+this script backfills a marktips run index from the to do items in DVID, so
+runs made before the index existed (or without it) can be queried from it
+
+see project wiki for usage
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import argparse
+import json
+import sys
+
+# local
+from . import __version__
+from .marktips import getdefaultoutput, runinstancename
+from .marktipshistory import findhistories, readbodyids
+from .runindex import RunIndex
+
+
+# ------------------------------ constants ------------------------------
+appname = "marktipsindex.py"
+
+
+# ------------------------------ code ------------------------------
+def rebuildindex(index, serverport, uuid, bodyids, todoinstance, runinstance=runinstancename, workers=8):
+    """
+    retrieve the history of each body from DVID and record every run found
+    in the index; runs already in the index are replaced, others are kept
+
+    input: RunIndex; server; UUID; list of body IDs; to do instance; run instance;
+        number of concurrent requests
+    output: (number of runs recorded, list of body IDs that failed)
+    """
+    nruns = 0
+    failed = []
+    for row in findhistories(serverport, uuid, bodyids, todoinstance, runinstance, workers):
+        if row["error"]:
+            failed.append(row["body ID"])
+        elif row["time"]:
+            params = {key: row[key] for key in ["time", "body ID", "RoI", "excluded RoI", "run ID"]}
+            index.addrun(serverport, uuid, todoinstance, params, row["count"])
+            nruns += 1
+    return nruns, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="backfill a marktips run index from DVID")
+
+    # positional
+    parser.add_argument("index", help="path to the SQLite run index; created if needed")
+    parser.add_argument("serverport", help="server and port of DVID server")
+    parser.add_argument("uuid", help="UUID of the DVID node")
+    parser.add_argument("bodyfile", help="file of body IDs, one per line ('-' for stdin)")
+    parser.add_argument("todoinstance", help="DVID instance name where to do items are stored")
+
+    parser.add_argument("--version", action="version", version=__version__)
+    parser.add_argument("--run-instance", default=runinstancename,
+        help="DVID keyvalue instance where run parameters are stored (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=8,
+        help="number of bodies to retrieve concurrently (default: %(default)s)")
+
+    args = parser.parse_args()
+    if not args.serverport.startswith("http://"):
+        args.serverport = "http://" + args.serverport
+
+    bodyids = readbodyids(args.bodyfile)
+    index = RunIndex(args.index)
+    try:
+        nruns, failed = rebuildindex(index, args.serverport, args.uuid, bodyids, args.todoinstance,
+            args.run_instance, args.workers)
+    finally:
+        index.close()
+
+    result = getdefaultoutput()
+    result["status"] = not failed
+    result["message"] = f"{nruns} runs on {len(bodyids)} bodies recorded; {len(failed)} bodies failed"
+    result["nruns"] = nruns
+    result["failed"] = failed
+    print(json.dumps(result))
+    sys.exit(0 if result["status"] else 1)
+
+
+# ------------------------------ script starts here ------------------------------
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+
+marktipsmerge.py
+
+this script combines the outputs of several marktipsbatch runs (eg, the
+shards of a cluster array job run with --shard) into one summary, with
+totals and timings over all of them; optionally it also writes the combined
+per-body results, followed by the summary, and gathers the shards' tips
+outputs into one directory
+
+inputs are the per-body json lines files (--output of marktipsbatch); the
+batch summaries (what marktipsbatch prints) may be included in the same
+files or given as their own files, and are used for the wall times and to
+find shards that didn't finish (give --expected-shards, or a shard that
+didn't leave a summary at all can't be noticed); if a body appears more
+than once (eg, a shard was rerun), the last result wins
+
+see project wiki for usage
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import argparse
+import json
+import os
+import shutil
+import sys
+
+# local
+from . import __version__
+from .marktips import errorquit
+from .marktipsbatch import BatchTotals, shardof
+from .tipsoutput import tipfiles, countrows
+
+
+# ------------------------------ constants ------------------------------
+appname = "marktipsmerge.py"
+
+
+# ------------------------------ code ------------------------------
+class ResultMerger:
+    def __init__(self, keeplocations=False):
+        """
+        input: flag to keep each body's tip locations (needed only to write
+            the combined results)
+        """
+        self.keeplocations = keeplocations
+
+        # body ID: result, in the order first seen
+        self.results = {}
+        self.nduplicates = 0
+        self.batches = []
+
+    def addfile(self, path):
+        """
+        read one file of results and batch summaries
+        """
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                result = json.loads(line)
+                if "nbodies" in result:
+                    self.batches.append({
+                        "path": path,
+                        "shard": result.get("shard"),
+                        "nbodies": result["nbodies"],
+                        "ttotal": result["ttotal"],
+                    })
+                else:
+                    self.addresult(result)
+
+    def addresult(self, result):
+        bodyid = result["body ID"]
+        if bodyid in self.results:
+            self.nduplicates += 1
+        if not self.keeplocations:
+            result.pop("locations", None)
+            result.pop("locations encoded", None)
+        self.results[bodyid] = result
+
+    def getsummary(self, expectedshards=None):
+        """
+        input: optional number of shards the bodies were split into
+        output: summary result dict, as from marktipsbatch, over all results
+        """
+        totals = BatchTotals()
+        bodytime = 0.0
+        for result in self.results.values():
+            totals.add(result)
+            bodytime += result.get("ttotal", 0.0)
+
+        # the batches ran side by side, so the wall time is that of the longest
+        #   one; without their summaries, the best we have is the time in bodies
+        if self.batches:
+            elapsed = max(batch["ttotal"] for batch in self.batches)
+        else:
+            elapsed = bodytime
+        summary = totals.getsummary(elapsed)
+        summary["body time"] = bodytime
+        summary["nduplicates"] = self.nduplicates
+        summary["batches"] = self.batches
+        summary["warnings"] = []
+        if not self.batches:
+            warning = "no batch summaries found, so the wall time is the time in bodies"
+            if expectedshards is None:
+                warning += ", and shards that didn't finish can't be found"
+            summary["warnings"].append(warning)
+
+        shards = {batch["shard"] for batch in self.batches if batch["shard"] is not None}
+        if shards:
+            summary["shards"] = sorted(shards)
+        counts = {int(shard.split("/")[1]) for shard in shards}
+        if expectedshards is not None:
+            counts.add(expectedshards)
+        if len(counts) > 1:
+            summary["warnings"].append("shards are of different splits: " + ", ".join(sorted(shards)))
+        elif counts:
+            # all shards of an N-way split should be there; one without a
+            #   summary probably didn't finish, even if it left some results
+            count = counts.pop()
+            withresults = {shardof(bodyid, count) for bodyid in self.results}
+            summary["missing shards"] = ["{}/{}".format(i, count) for i in range(count)
+                if "{}/{}".format(i, count) not in shards]
+            summary["unfinished shards"] = [shard for shard in summary["missing shards"]
+                if int(shard.split("/")[0]) in withresults]
+        return summary
+
+    def write(self, path, summary=None):
+        """
+        write the combined per-body results as json lines, and optionally
+        the summary after them, as marktipsbatch does
+        """
+        outfile = sys.stdout if path == "-" else open(path, "w")
+        try:
+            for result in self.results.values():
+                outfile.write(json.dumps(result) + "\n")
+            if summary is not None:
+                outfile.write(json.dumps(summary) + "\n")
+        finally:
+            if outfile is not sys.stdout:
+                outfile.close()
+
+
+def mergetips(directories, destination=None):
+    """
+    count the tips in several tips output directories, optionally moving
+    all the chunk files into one directory (the file names don't collide)
+
+    input: list of tips output directories; optional directory to gather them in
+    output: dict with the number of files and tips
+    """
+    nfiles = 0
+    ntips = 0
+    if destination is not None:
+        os.makedirs(destination, exist_ok=True)
+    for directory in directories:
+        for path in tipfiles(directory):
+            nfiles += 1
+            ntips += countrows(path)
+            if destination is not None and os.path.dirname(os.path.abspath(path)) != os.path.abspath(destination):
+                shutil.move(path, os.path.join(destination, os.path.basename(path)))
+    return {"files": nfiles, "tips": ntips}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="combine the outputs of several marktipsbatch runs")
+
+    # positional
+    parser.add_argument("results", nargs="+",
+        help="per-body results files (json lines), which may also hold the batch summaries")
+
+    parser.add_argument("--version", action="version", version=__version__)
+    parser.add_argument("--output",
+        help="also write the combined per-body results (json lines), then the summary, to this path")
+    parser.add_argument("--expected-shards", type=int,
+        help="the bodies were split into this many shards; report any without a summary")
+    parser.add_argument("--tips", nargs="+", default=[],
+        help="tips output directories of the batches, to count (and gather with --tips-into)")
+    parser.add_argument("--tips-into", help="move the tips files from the --tips directories into this one")
+
+    args = parser.parse_args()
+    if args.expected_shards is not None and args.expected_shards < 1:
+        errorquit("--expected-shards must be at least 1")
+
+    merger = ResultMerger(keeplocations=args.output is not None)
+    for path in args.results:
+        try:
+            merger.addfile(path)
+        except (OSError, ValueError, KeyError) as e:
+            errorquit("could not read results from {}: {}".format(path, e))
+
+    summary = merger.getsummary(args.expected_shards)
+    if args.tips:
+        try:
+            summary["tips output"] = mergetips(args.tips, args.tips_into)
+        except (OSError, ValueError) as e:
+            errorquit("could not merge tips outputs: {}".format(e))
+        if args.tips_into is not None:
+            summary["tips output"]["directory"] = args.tips_into
+    # a shard without a summary probably didn't finish
+    if summary.get("missing shards"):
+        summary["status"] = False
+        summary["message"] += "; no summary for shards " + ", ".join(summary["missing shards"])
+    for warning in summary["warnings"]:
+        print("warning: " + warning, file=sys.stderr)
+    if args.output is not None:
+        try:
+            # on stdout, the summary is printed after the results anyway
+            merger.write(args.output, summary if args.output != "-" else None)
+        except OSError as e:
+            errorquit("could not write merged results to {}: {}".format(args.output, e))
+    print(json.dumps(summary))
+    sys.exit(0 if summary["status"] else 1)
+
+
+# ------------------------------ script starts here ------------------------------
+if __name__ == "__main__":
+    main()
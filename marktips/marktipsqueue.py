@@ -0,0 +1,231 @@
+"""
+
+marktipsqueue.py
+
+this script runs marktips on many bodies from a shared work queue (a SQLite
+file), so a sweep can be spread over several machines: add the bodies to
+the queue once, then start "marktipsqueue work" on each machine; each
+worker claims bodies, runs them in its own worker processes, and records
+the results in the queue; bodies held by a worker that dies are handed out
+again once their leases expire
+
+see project wiki for usage
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import argparse
+import json
+import os
+import secrets
+import socket
+import sys
+import threading
+import time
+
+# local
+from . import __version__
+from .marktips import addrunarguments, errorquit, getdefaultoutput, hasDVIDtools
+from .marktipsbatch import BatchRunner, addbatcharguments, setupbatch, runbatch
+from .marktipshistory import readbodyids
+from .workqueue import WorkQueue, defaultlease, defaultmaxattempts, done, failed
+
+
+# ------------------------------ constants ------------------------------
+appname = "marktipsqueue.py"
+
+# seconds between checks for work while other workers hold all the remaining bodies
+defaultpoll = 30.0
+
+
+# ------------------------------ code ------------------------------
+class QueueRunner(BatchRunner):
+    """
+    a batch whose bodies are claimed from a work queue, and whose results
+    are recorded there as well as written out
+    """
+    def __init__(self, queue, options, workers, output="-", metrics=None, lease=defaultlease,
+            poll=defaultpoll, worker=None):
+        """
+        input: WorkQueue; as for BatchRunner, less the body IDs; lease length (s);
+            seconds between checks for work when there's none; worker name
+            (default: host, process ID and a random suffix)
+        """
+        super().__init__(options, [], workers, output, metrics)
+        self.queue = queue
+        self.lease = lease
+        self.poll = poll
+        if worker is None:
+            worker = "{}-{}-{}".format(socket.gethostname(), os.getpid(), secrets.token_hex(2))
+        self.worker = worker
+        self.nlost = 0
+
+    def run(self):
+        stopped = threading.Event()
+
+        def renew():
+            while not stopped.wait(self.lease / 3):
+                self.queue.renew(self.worker, self.lease)
+
+        thread = threading.Thread(target=renew, name="marktips-lease", daemon=True)
+        thread.start()
+        try:
+            result = super().run()
+        finally:
+            stopped.set()
+            thread.join()
+        result["worker"] = self.worker
+        result["nlost"] = self.nlost
+        result["queue"] = self.queue.counts()
+        return result
+
+    def nextbodies(self, pool, n):
+        bodyids = []
+        while len(bodyids) < n:
+            bodyid = self.queue.claim(self.worker, self.lease)
+            if bodyid is None:
+                break
+            bodyids.append(bodyid)
+        return bodyids
+
+    def morecoming(self):
+        # nothing to claim and nothing running here; if other workers hold
+        #   leases, wait in case they expire; our own leases are bodies put
+        #   off to run again at the end, which no one else can claim
+        if self.queue.leasedelsewhere(self.worker) == 0:
+            return False
+        time.sleep(self.poll)
+        return True
+
+    def addresult(self, result, outfile):
+        # bodies put off for running again later keep their leases until then
+        if not (result.get("deferred") and not self.retrying):
+            queueresult = {key: value for key, value in result.items() if key not in ["trace", "deferred"]}
+            if not self.queue.finish(result["body ID"], self.worker, queueresult):
+                # the lease expired and the body went to another worker
+                self.nlost += 1
+        super().addresult(result, outfile)
+
+
+def addqueue(args):
+    bodyids = readbodyids(args.bodyfile)
+    queue = WorkQueue(args.queue)
+    try:
+        nadded = queue.addbodies(bodyids)
+        counts = queue.counts()
+    finally:
+        queue.close()
+    result = getdefaultoutput()
+    result["status"] = True
+    result["message"] = f"{nadded} of {len(bodyids)} bodies added to the queue"
+    result["nadded"] = nadded
+    result["queue"] = counts
+    print(json.dumps(result))
+
+
+def statusqueue(args):
+    queue = WorkQueue(args.queue)
+    try:
+        counts = queue.counts()
+    finally:
+        queue.close()
+    result = getdefaultoutput()
+    result["status"] = True
+    result["message"] = ", ".join(f"{count} {state}" for state, count in counts.items())
+    result["queue"] = counts
+    print(json.dumps(result))
+
+
+def resultsqueue(args):
+    queue = WorkQueue(args.queue)
+    outfile = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        for result in queue.results(args.state):
+            outfile.write(json.dumps(result) + "\n")
+    finally:
+        queue.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+def resetqueue(args):
+    queue = WorkQueue(args.queue)
+    try:
+        nreset = queue.reset(args.state)
+        counts = queue.counts()
+    finally:
+        queue.close()
+    result = getdefaultoutput()
+    result["status"] = True
+    result["message"] = f"{nreset} bodies put back in the queue"
+    result["nreset"] = nreset
+    result["queue"] = counts
+    print(json.dumps(result))
+
+
+def workqueue(args):
+    if not hasDVIDtools:
+        errorquit("could not import dvid_tools library")
+    metrics, stopmetricsfile = setupbatch(args)
+    queue = WorkQueue(args.queue, args.max_attempts)
+    try:
+        runner = QueueRunner(queue, vars(args), args.workers, args.output, metrics, args.lease, args.poll,
+            args.worker_name)
+        runbatch(runner, args, stopmetricsfile)
+    finally:
+        queue.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="find and mark tips on many neurons from a shared work queue")
+    parser.add_argument("--version", action="version", version=__version__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    addparser = subparsers.add_parser("add", help="add bodies to the queue, creating it if needed")
+    addparser.add_argument("queue", help="path to the SQLite queue file")
+    addparser.add_argument("bodyfile", help="file of body IDs, one per line ('-' for stdin)")
+    addparser.set_defaults(function=addqueue)
+
+    workparser = subparsers.add_parser("work", help="run bodies from the queue until it's empty")
+    workparser.add_argument("queue", help="path to the SQLite queue file")
+    workparser.add_argument("serverport", help="server and port of DVID server")
+    workparser.add_argument("uuid", help="UUID of the DVID node")
+    workparser.add_argument("todoinstance", help="DVID instance name where to do items are stored")
+    addrunarguments(workparser)
+    addbatcharguments(workparser)
+    workparser.add_argument("--lease", type=float, default=defaultlease,
+        help="seconds a claimed body is held without renewal before it's handed out again " +
+        "(default: %(default)s); leases are renewed every third of this while the worker runs")
+    workparser.add_argument("--poll", type=float, default=defaultpoll,
+        help="seconds between checks for work while other workers hold the remaining bodies " +
+        "(default: %(default)s)")
+    workparser.add_argument("--max-attempts", type=int, default=defaultmaxattempts,
+        help="mark a body failed once its lease has expired this many times (default: %(default)s)")
+    workparser.add_argument("--worker-name", help="name for this worker in the queue (default: host and process)")
+    workparser.set_defaults(function=workqueue)
+
+    statusparser = subparsers.add_parser("status", help="count bodies in each state")
+    statusparser.add_argument("queue", help="path to the SQLite queue file")
+    statusparser.set_defaults(function=statusqueue)
+
+    resultsparser = subparsers.add_parser("results", help="write the results of finished bodies, as json lines")
+    resultsparser.add_argument("queue", help="path to the SQLite queue file")
+    resultsparser.add_argument("--state", choices=[done, failed], help="only bodies in this state")
+    resultsparser.add_argument("--output", default="-", help="output path (default: stdout)")
+    resultsparser.set_defaults(function=resultsqueue)
+
+    resetparser = subparsers.add_parser("reset", help="put finished bodies back in the queue")
+    resetparser.add_argument("queue", help="path to the SQLite queue file")
+    resetparser.add_argument("--state", nargs="+", choices=[done, failed], default=[failed],
+        help="states to reset (default: failed)")
+    resetparser.set_defaults(function=resetqueue)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+# ------------------------------ script starts here ------------------------------
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+"""
+
+marktipswatch.py
+
+this script keeps tips up to date as bodies are edited: it polls the
+segmentation's mutation log (or a local feed of mutations, one json object
+per line, in the same form), and runs marktips on each body that a merge,
+split or cleave changed, once the edits to it have settled and its
+skeleton has been regenerated
+
+a body is run once it has gone --quiet seconds without a new edit (or
+--max-delay seconds after its first edit, if edits keep coming); then, its
+skeleton must be from the body's last mutation or later (by the "mutation
+id" in the skeleton's header; a skeleton without one is taken as is);
+bodies whose skeletons aren't regenerated within --skeleton-timeout are
+given up on, and listed in the summary
+
+runs until stopped (SIGTERM or ctrl-C), or with --until-idle, until a poll
+finds no new edits and there's nothing left to do; per-body results are
+appended to the output
+
+see project wiki for usage
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import argparse
+import collections
+import getpass
+import json
+import os
+import signal
+import threading
+import time
+
+# third party
+import requests
+
+# local
+from . import __version__
+from .marktips import MarktipsError, addrunarguments, errorquit, getdvid, hasDVIDtools
+from .marktipsbatch import BatchRunner, addbatcharguments, setupbatch, runbatch
+from .prefetch import defaulttargetbytes, maxgroup
+
+
+# ------------------------------ constants ------------------------------
+appname = "marktipswatch.py"
+
+defaultpoll = 30.0
+defaultquiet = 60.0
+defaultmaxdelay = 600.0
+defaultskeletontimeout = 300.0
+
+# fields of a mutation that name bodies whose shape it changed; labels that
+#   a mutation removes (eg, the bodies merged into the target) aren't here
+bodyfields = ["Target", "NewLabel", "CleavedLabel", "Body"]
+
+# query option of the mutation log call: return only mutations with this ID
+#   or later
+mutationstartoption = "start"
+
+
+# ------------------------------ code ------------------------------
+def affectedbodies(mutation):
+    """
+    input: mutation dict, from the labelmap mutation log
+    output: list of body IDs (as strings) the mutation changed
+    """
+    bodyids = []
+    fields = bodyfields
+    if mutation.get("Action") == "cleave":
+        # the original keeps its label and loses part of itself
+        fields = fields + ["OrigLabel"]
+    for field in fields:
+        value = mutation.get(field)
+        if value:
+            bodyids.append(str(value))
+    return list(dict.fromkeys(bodyids))
+
+
+def skeletonmutationid(swc):
+    """
+    input: SWC bytes
+    output: mutation ID from the skeleton's header comment, or None
+    """
+    for line in swc.splitlines():
+        if not line.startswith(b"#"):
+            break
+        try:
+            header = json.loads(line[1:])
+        except ValueError:
+            continue
+        if isinstance(header, dict) and "mutation id" in header:
+            return header["mutation id"]
+    return None
+
+
+class MutationLog:
+    """
+    new mutations from a labelmap instance's mutation log
+    """
+    def __init__(self, serverport, uuid, segmentation, username, since=None):
+        """
+        input: server; UUID; segmentation instance; username; mutation ID to
+            start after (default: the latest at the first poll)
+        """
+        self.call = serverport + "/api/node/" + uuid + "/" + segmentation + "/mutations"
+        self.username = username
+        self.lastid = since
+
+    def poll(self):
+        """
+        output: list of mutation dicts since the last poll, or None if this
+            poll only found where to start
+        """
+        # once we know where we are, only what's new is asked for, so polls
+        #   stay cheap however long the log grows
+        call = self.call
+        if self.lastid is not None:
+            call += "?{}={}".format(mutationstartoption, self.lastid + 1)
+        r = getdvid(call, self.username)
+        if r.status_code != requests.codes.ok:
+            raise MarktipsError("couldn't read mutation log: {}".format(r.text))
+        mutations = sorted(r.json() or [], key=lambda mutation: mutation.get("MutationID", 0))
+        # (the first poll gets the whole log, to find the latest ID)
+        if self.lastid is None:
+            self.lastid = max((mutation.get("MutationID", 0) for mutation in mutations), default=0)
+            return None
+        mutations = [mutation for mutation in mutations if mutation.get("MutationID", 0) > self.lastid]
+        if mutations:
+            self.lastid = mutations[-1].get("MutationID", self.lastid)
+        return mutations
+
+
+class MutationFeed:
+    """
+    new mutations appended to a local file, one json object per line
+    """
+    def __init__(self, path, since=None):
+        """
+        input: path to the feed; mutation ID to start after (default: start
+            at the end of the file as it is at the first poll)
+        """
+        self.path = path
+        self.since = since
+        self.offset = None
+
+    def poll(self):
+        """
+        output: list of mutation dicts since the last poll, or None if this
+            poll only found where to start
+        """
+        if not os.path.exists(self.path):
+            # nothing written yet, so the start of the file, whenever it appears
+            if self.offset is None:
+                self.offset = 0
+                return None
+            return []
+        with open(self.path, "rb") as f:
+            if self.offset is None and self.since is None:
+                self.offset = f.seek(0, os.SEEK_END)
+                return None
+            f.seek(self.offset or 0)
+            data = f.read()
+        # a line still being written is left for next time
+        complete = data[:data.rfind(b"\n") + 1]
+        self.offset = (self.offset or 0) + len(complete)
+        mutations = [json.loads(line) for line in complete.splitlines() if line.strip()]
+        if self.since is not None:
+            mutations = [mutation for mutation in mutations if mutation.get("MutationID", self.since + 1) > self.since]
+        return mutations
+
+
+class Debouncer:
+    """
+    holds edited bodies until their edits settle
+    """
+    def __init__(self, quiet=defaultquiet, maxdelay=defaultmaxdelay):
+        self.quiet = quiet
+        self.maxdelay = maxdelay
+
+        # body ID: [time of first edit, time of last edit, last mutation ID]
+        self.bodies = {}
+
+    def add(self, bodyid, mutationid, now):
+        entry = self.bodies.setdefault(bodyid, [now, now, None])
+        entry[1] = now
+        if mutationid is not None:
+            entry[2] = max(entry[2] or 0, mutationid)
+
+    def ready(self, now):
+        """
+        output: list of (body ID, last mutation ID) of bodies whose edits
+            have settled; they're no longer held
+        """
+        ready = [(bodyid, entry[2]) for bodyid, entry in self.bodies.items()
+            if now - entry[1] >= self.quiet or now - entry[0] >= self.maxdelay]
+        for bodyid, _ in ready:
+            del self.bodies[bodyid]
+        return ready
+
+
+class WatchRunner(BatchRunner):
+    """
+    a batch whose bodies come from edits, as they happen
+    """
+    def __init__(self, source, options, workers, output="-", metrics=None, poll=defaultpoll,
+            quiet=defaultquiet, maxdelay=defaultmaxdelay, skeletontimeout=defaultskeletontimeout,
+            untilidle=False):
+        """
+        input: MutationLog or MutationFeed; as for BatchRunner, less the body IDs;
+            seconds between polls; seconds without edits before a body is run;
+            most seconds from a body's first edit until it's run; seconds to wait
+            for a regenerated skeleton; flag to stop once there's nothing to do
+        """
+        # the skeletons are fetched here, to check they're up to date, and
+        #   handed to the workers
+        options = dict(options, prefetch_skeletons=True, prefetch_bytes=defaulttargetbytes / 2**20)
+        super().__init__(options, [], workers, output, metrics)
+        self.outputmode = "a"
+        self.source = source
+        self.poll = poll
+        self.debouncer = Debouncer(quiet, maxdelay)
+        self.skeletontimeout = skeletontimeout
+        self.untilidle = untilidle
+
+        # body ID: (last mutation ID, time it started waiting for its skeleton)
+        self.skeletonwait = {}
+        self.torun = collections.deque()
+        self.running = set()
+
+        self.lastpoll = 0.0
+        # true once a poll has found no new edits, with nothing waiting or running
+        self.idle = False
+        self.stopped = threading.Event()
+        self.nmutations = 0
+        self.timedout = []
+        self.pollerrors = []
+
+    def run(self):
+        for signum in [signal.SIGINT, signal.SIGTERM]:
+            signal.signal(signum, lambda signum, frame: self.stopped.set())
+        result = super().run()
+        result["nmutations"] = self.nmutations
+        result["skeleton timeouts"] = self.timedout
+        result["poll errors"] = self.pollerrors[-10:]
+        result["npollerrors"] = len(self.pollerrors)
+        result["unfinished"] = sorted(set(self.debouncer.bodies) | set(self.skeletonwait) | set(self.torun))
+        return result
+
+    def check(self, now):
+        """
+        poll for edits, if it's time, and find the bodies that are ready to run
+        """
+        if now - self.lastpoll < self.poll:
+            return
+        self.lastpoll = now
+        try:
+            mutations = self.source.poll()
+        except (MarktipsError, requests.RequestException, OSError, ValueError) as e:
+            # keep watching; the edits will still be there next time
+            self.pollerrors.append(str(e))
+            mutations = None
+        # a poll that failed or only found where to start hasn't looked for edits
+        polled = mutations is not None
+        mutations = mutations or []
+        self.nmutations += len(mutations)
+        for mutation in mutations:
+            for bodyid in affectedbodies(mutation):
+                self.debouncer.add(bodyid, mutation.get("MutationID"), now)
+        for bodyid, mutationid in self.debouncer.ready(now):
+            since = self.skeletonwait.get(bodyid, (None, now))[1]
+            self.skeletonwait[bodyid] = (mutationid, since)
+        self.checkskeletons(now)
+        self.idle = polled and not (mutations or self.debouncer.bodies or self.skeletonwait or self.torun or
+            self.running)
+
+    def checkskeletons(self, now):
+        """
+        move bodies whose skeletons are up to date on to be run
+        """
+        # one that's running now is checked again once it's done
+        bodyids = [bodyid for bodyid in self.skeletonwait if bodyid not in self.running]
+        for start in range(0, len(bodyids), maxgroup):
+            self.prefetcher.fetch(bodyids[start:start + maxgroup])
+        for bodyid in bodyids:
+            mutationid, since = self.skeletonwait[bodyid]
+            skeleton = self.prefetcher.skeletons.get(bodyid)
+            if skeleton is not None:
+                skeletonid = skeletonmutationid(skeleton)
+                if mutationid is None or skeletonid is None or skeletonid >= mutationid:
+                    del self.skeletonwait[bodyid]
+                    if bodyid not in self.torun:
+                        self.torun.append(bodyid)
+                    continue
+                del self.prefetcher.skeletons[bodyid]
+            if now - since >= self.skeletontimeout:
+                del self.skeletonwait[bodyid]
+                self.timedout.append(bodyid)
+
+    def nextbodies(self, pool, n):
+        if self.stopped.is_set():
+            return []
+        self.check(time.time())
+        bodyids = []
+        for _ in range(len(self.torun)):
+            if len(bodyids) >= n:
+                break
+            bodyid = self.torun.popleft()
+            if bodyid in self.running:
+                self.torun.append(bodyid)
+                continue
+            self.running.add(bodyid)
+            bodyids.append(bodyid)
+        return bodyids
+
+    def morecoming(self):
+        if self.stopped.is_set() or (self.untilidle and self.idle):
+            return False
+        self.stopped.wait(max(0.0, self.lastpoll + self.poll - time.time()))
+        return True
+
+    def waittimeout(self):
+        return self.poll
+
+    def addresult(self, result, outfile):
+        self.running.discard(result["body ID"])
+        super().addresult(result, outfile)
+
+
+def main():
+    if not hasDVIDtools:
+        errorquit("could not import dvid_tools library")
+
+    parser = argparse.ArgumentParser(description="find and mark tips on neurons as they're edited")
+
+    # required positional arguments
+    parser.add_argument("serverport", help="server and port of DVID server")
+    parser.add_argument("uuid", help="UUID of the DVID node")
+    parser.add_argument("todoinstance", help="DVID instance name where to do items are stored")
+
+    parser.add_argument("--version", action="version", version=__version__)
+    addrunarguments(parser)
+    addbatcharguments(parser)
+    parser.add_argument("--segmentation", default="segmentation",
+        help="DVID segmentation instance whose mutation log is watched; its skeletons are in this " +
+        "+ \"_skeletons\" (default: %(default)s)")
+    parser.add_argument("--feed",
+        help="read mutations from this file (one json object per line, as in the mutation log) " +
+        "instead of DVID")
+    parser.add_argument("--since", type=int,
+        help="start after this mutation ID (default: only edits made after starting)")
+    parser.add_argument("--poll", type=float, default=defaultpoll,
+        help="seconds between polls for edits (default: %(default)s)")
+    parser.add_argument("--quiet", type=float, default=defaultquiet,
+        help="run a body once it's gone this many seconds without edits (default: %(default)s)")
+    parser.add_argument("--max-delay", type=float, default=defaultmaxdelay,
+        help="run a body at most this many seconds after its first edit, even if edits continue " +
+        "(default: %(default)s)")
+    parser.add_argument("--skeleton-timeout", type=float, default=defaultskeletontimeout,
+        help="give up on a body if its skeleton isn't regenerated within this many seconds " +
+        "(default: %(default)s)")
+    parser.add_argument("--until-idle", action="store_true", default=False,
+        help="stop once there are no edits waiting and nothing left to run")
+
+    args = parser.parse_args()
+    metrics, stopmetricsfile = setupbatch(args)
+    username = args.username if args.username is not None else getpass.getuser()
+    if args.feed is not None:
+        source = MutationFeed(args.feed, args.since)
+    else:
+        source = MutationLog(args.serverport, args.uuid, args.segmentation, username, args.since)
+    runner = WatchRunner(source, vars(args), args.workers, args.output, metrics, args.poll, args.quiet,
+        args.max_delay, args.skeleton_timeout, args.until_idle)
+    runbatch(runner, args, stopmetricsfile)
+
+
+# ------------------------------ script starts here ------------------------------
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+
+memory.py
+
+peak memory measurement and per-body memory budgets; peak resident set
+size comes from /proc on Linux (where it can be reset between bodies), and
+falls back to getrusage() (peak over the life of the process) elsewhere
+
+the budget is enforced as a limit on address space growth, so a body that
+goes over it raises MemoryError in Python instead of the worker being killed
+by the OS; note that address space (virtual memory) runs ahead of resident
+memory, so the budget should be set with some room
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+from contextlib import contextmanager
+import sys
+
+try:
+    import resource
+    hasResource = True
+except ImportError:
+    # not on Windows
+    hasResource = False
+
+
+# ------------------------------ code ------------------------------
+def readstatus(field):
+    """
+    input: name of a field in /proc/self/status in kB, eg "VmHWM"
+    output: its value in bytes, or None if unavailable
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def resetpeakrss():
+    """
+    reset the process's peak resident set size, so the next peakrss() covers
+    only what comes after; Linux only
+
+    output: True if the peak was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peakrss():
+    """
+    output: peak resident set size in bytes, since the last resetpeakrss()
+        if that's supported, otherwise over the life of the process; None
+        if unavailable
+    """
+    peak = readstatus("VmHWM")
+    if peak is None and hasResource:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on Linux, bytes on macOS
+        if sys.platform != "darwin":
+            peak *= 1024
+    return peak
+
+
+@contextmanager
+def memorybudget(budget):
+    """
+    limit the growth of the process's address space during the enclosed
+    block; allocations past the limit raise MemoryError; if budget is None
+    (or limits aren't supported), this does nothing
+
+    input: budget in bytes, or None
+    """
+    current = readstatus("VmSize")
+    if budget is None or not hasResource or current is None:
+        yield
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = current + budget
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
@@ -0,0 +1,212 @@
+"""
+
+metrics.py
+
+live counters and gauges for long-running marktips modes (batch, watch),
+exposed in Prometheus text format, either on a local HTTP port or as a
+periodically rewritten textfile (for node_exporter's textfile collector)
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import collections
+import http.server
+import os
+import threading
+
+# local
+from .requeststats import latencybuckets
+
+
+# ------------------------------ constants ------------------------------
+prefix = "marktips_"
+
+# name: (type, help)
+descriptions = {
+    "bodies_total": ("counter", "bodies finished, by status"),
+    "bodies_in_progress": ("gauge", "bodies handed to workers and not yet finished"),
+    "tips_found_total": ("counter", "tips found, before RoI filtering"),
+    "todos_placed_total": ("counter", "to do items placed"),
+    "dvid_requests_total": ("counter", "DVID requests, by endpoint and status code"),
+    "dvid_errors_total": ("counter", "DVID requests that failed (status code 400 or more), by endpoint"),
+    "dvid_request_seconds": ("histogram", "DVID request latency, by endpoint"),
+    "dvid_requests_in_flight": ("gauge", "DVID requests currently in flight, over all workers"),
+    "dvid_read_limit": ("gauge", "current adaptive limit on DVID reads in flight, over all workers"),
+    "dvid_write_limit": ("gauge", "current adaptive limit on DVID writes in flight, over all workers"),
+    "cache_requests_total": ("counter", "cache lookups, by cache and result (hit or miss)"),
+    "stage_seconds": ("summary", "time spent in each stage of a run, by stage"),
+}
+
+defaultinterval = 15.0
+
+
+# ------------------------------ code ------------------------------
+def labelstring(labels):
+    """
+    input: dict of labels
+    output: Prometheus label string, eg '{stage="skeleton"}', or "" if no labels
+    """
+    if not labels:
+        return ""
+    items = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        items.append('{}="{}"'.format(key, value))
+    return "{" + ",".join(items) + "}"
+
+
+class Metrics:
+    """
+    thread-safe registry of counters and gauges
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        # name: {label tuple: value}
+        self.values = collections.defaultdict(dict)
+
+        # optional callables returning the current value of a gauge
+        self.gaugefunctions = {}
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[name][key] = self.values[name].get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[name][key] = value
+
+    def setgaugefunction(self, name, function):
+        """
+        the gauge's value will be read from function() whenever metrics are rendered
+        """
+        self.gaugefunctions[name] = function
+
+    def cache(self, cachename, hit):
+        """
+        record one cache lookup
+        """
+        self.inc("cache_requests_total", cache=cachename, result="hit" if hit else "miss")
+
+    def addresult(self, result):
+        """
+        update the metrics from one body's result dict (as from TipDetector.getresult(),
+        or a failure result with "status" False)
+        """
+        self.inc("bodies_total", status="ok" if result["status"] else "error")
+        if not result["status"]:
+            return
+        self.inc("tips_found_total", result.get("nlocations", 0))
+        self.inc("todos_placed_total", result.get("nplaced", 0))
+        for stage, entry in result.get("stages", {}).items():
+            self.inc("stage_seconds_sum", entry["time"], stage=stage)
+            self.inc("stage_seconds_count", 1, stage=stage)
+
+    def adddvid(self, summary):
+        """
+        update the metrics from a RequestStats summary
+        """
+        for endpoint, stats in summary["endpoints"].items():
+            for status, count in stats["statuses"].items():
+                self.inc("dvid_requests_total", count, endpoint=endpoint, status=status)
+                if int(status) >= 400:
+                    self.inc("dvid_errors_total", count, endpoint=endpoint)
+            # histogram buckets are cumulative in Prometheus
+            total = 0
+            for bound, count in zip(latencybuckets + ["+Inf"], stats["histogram"]):
+                total += count
+                self.inc("dvid_request_seconds_bucket", total, endpoint=endpoint, le=bound)
+            self.inc("dvid_request_seconds_sum", stats["time"], endpoint=endpoint)
+            self.inc("dvid_request_seconds_count", stats["count"], endpoint=endpoint)
+
+    def render(self):
+        """
+        output: all metrics in Prometheus text exposition format
+        """
+        for name, function in self.gaugefunctions.items():
+            self.set(name, function())
+
+        lines = []
+        with self.lock:
+            for name, (kind, helptext) in descriptions.items():
+                # histograms and summaries are stored as their _bucket, _sum and _count series
+                names = [name] + [name + suffix for suffix in ["_bucket", "_sum", "_count"]]
+                series = [(n, self.values[n]) for n in names if self.values.get(n)]
+                if not series:
+                    continue
+                lines.append("# HELP {}{} {}".format(prefix, name, helptext))
+                lines.append("# TYPE {}{} {}".format(prefix, name, kind))
+                for n, values in series:
+                    for key, value in sorted(values.items(), key=lambda item: sortkey(item[0])):
+                        lines.append("{}{}{} {}".format(prefix, n, labelstring(dict(key)), value))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port):
+        """
+        serve the metrics over HTTP at /metrics on the given port, from a
+        background thread
+        """
+        metrics = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                # keep stderr clean
+                pass
+
+        server = http.server.ThreadingHTTPServer(("", port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="marktips-metrics", daemon=True).start()
+        return server
+
+    def writetextfile(self, path):
+        """
+        write the metrics to a file atomically, so readers never see a partial file
+        """
+        temppath = path + ".tmp"
+        with open(temppath, "w") as f:
+            f.write(self.render())
+        os.replace(temppath, path)
+
+    def starttextfile(self, path, interval=defaultinterval):
+        """
+        rewrite the textfile every interval seconds from a background thread
+
+        output: function to call to stop; the file is written one last time
+        """
+        stopped = threading.Event()
+
+        def loop():
+            while not stopped.wait(interval):
+                self.writetextfile(path)
+            self.writetextfile(path)
+
+        thread = threading.Thread(target=loop, name="marktips-metrics-file", daemon=True)
+        thread.start()
+
+        def stop():
+            stopped.set()
+            thread.join()
+        return stop
+
+
+def sortkey(labelkey):
+    # sort histogram buckets numerically, with +Inf last
+    result = []
+    for key, value in labelkey:
+        if key == "le":
+            value = float("inf") if value == "+Inf" else value
+        else:
+            value = str(value)
+        result.append((key, value))
+    return result
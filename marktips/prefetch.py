@@ -0,0 +1,141 @@
+"""
+
+prefetch.py
+
+fetch the skeletons of many bodies at once, for batches of small bodies
+where the per-call overhead of fetching each skeleton on its own dominates
+
+the batch (parent) process reads the skeletons of a group of bodies from
+the skeleton keyvalue instance in one multi-key call, and hands each one
+to the worker that runs the body, which passes it to the tip detector in
+place of its own call for the skeleton; bodies whose skeletons weren't
+found in the group call fetch them the usual way
+
+a skeleton only counts as a hit once the body's run reports that tip
+detection used it
+
+the group size adapts to the skeletons' size, so each call brings back
+about a target number of bytes
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import time
+
+# local
+from .marktips import getkeyvalues
+
+
+# ------------------------------ constants ------------------------------
+# aim for this many bytes of skeletons per call
+defaulttargetbytes = 8 * 2**20
+
+# bodies per call, to start with and at most
+initialgroup = 16
+maxgroup = 1000
+
+
+# ------------------------------ code ------------------------------
+def skeletonkey(bodyid):
+    """
+    output: key of a body's skeleton in the skeleton keyvalue instance
+    """
+    return "{}_swc".format(bodyid)
+
+
+class SkeletonPrefetcher:
+    """
+    reads skeletons in groups ahead of the bodies being run
+    """
+    def __init__(self, serverport, uuid, instance, username, targetbytes=defaulttargetbytes, metrics=None):
+        """
+        input: server; UUID; skeleton keyvalue instance; username; bytes to aim for
+            per call; optional Metrics to record cache hits and misses in
+        """
+        self.serverport = serverport
+        self.uuid = uuid
+        self.instance = instance
+        self.username = username
+        self.targetbytes = targetbytes
+        self.metrics = metrics
+
+        self.groupsize = initialgroup
+        self.skeletons = {}
+
+        self.ncalls = 0
+        self.nrequested = 0
+        self.nfound = 0
+        self.nbytes = 0
+        self.time = 0.0
+        self.nhits = 0
+        self.nmisses = 0
+
+    def wrap(self, bodyids):
+        """
+        input: iterator of body IDs
+        output: iterator of the same body IDs; each group's skeletons are
+            fetched before its first body is given out
+        """
+        bodyids = iter(bodyids)
+        while True:
+            group = [bodyid for _, bodyid in zip(range(self.groupsize), bodyids)]
+            if not group:
+                return
+            self.fetch(group)
+            yield from group
+
+    def fetch(self, group):
+        t1 = time.time()
+        values = getkeyvalues(self.serverport, self.uuid, self.instance,
+            [skeletonkey(bodyid) for bodyid in group], self.username)
+        self.time += time.time() - t1
+        self.ncalls += 1
+        self.nrequested += len(group)
+        nbytes = 0
+        for bodyid in group:
+            skeleton = values.get(skeletonkey(bodyid))
+            if skeleton is not None:
+                self.skeletons[bodyid] = skeleton
+                nbytes += len(skeleton)
+                self.nfound += 1
+        self.nbytes += nbytes
+
+        # size the next group from the mean skeleton size so far
+        if self.nfound:
+            meanbytes = self.nbytes / self.nfound
+            self.groupsize = int(min(maxgroup, max(1, self.targetbytes // meanbytes)))
+
+    def take(self, bodyid):
+        """
+        output: the body's prefetched skeleton (now dropped from here), or None,
+            which counts as a miss; a skeleton given out is counted by used()
+        """
+        skeleton = self.skeletons.pop(bodyid, None)
+        if skeleton is None:
+            self.used(False)
+        return skeleton
+
+    def used(self, hit):
+        """
+        count a hit (a prefetched skeleton used by tip detection) or a miss
+        """
+        if hit:
+            self.nhits += 1
+        else:
+            self.nmisses += 1
+        if self.metrics is not None:
+            self.metrics.cache("skeleton prefetch", hit)
+
+    def summary(self):
+        return {
+            "calls": self.ncalls,
+            "requested": self.nrequested,
+            "found": self.nfound,
+            "bytes": self.nbytes,
+            "time": self.time,
+            "hits": self.nhits,
+            "misses": self.nmisses,
+            "group size": self.groupsize,
+        }
+
@@ -0,0 +1,153 @@
+"""
+
+profiling.py
+
+optional profiling of marktips runs; either a cProfile dump (readable with
+pstats, snakeviz, etc.), including threads started while profiling, or a
+sampling profile of all threads in collapsed stack format (readable with
+flamegraph.pl, speedscope, etc.)
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import collections
+from contextlib import contextmanager
+import cProfile
+import os
+import pstats
+import sys
+import threading
+
+
+# ------------------------------ constants ------------------------------
+profileformats = ["pstats", "collapsed"]
+
+# seconds between samples for the sampling profiler
+sampleinterval = 0.005
+
+
+# ------------------------------ code ------------------------------
+@contextmanager
+def profiled(path, kind="pstats"):
+    """
+    profile the enclosed block and write the profile to a file; the profile
+    is written even if the block exits (eg, via sys.exit()); if path is None,
+    this does nothing
+
+    input: output path or None; "pstats" or "collapsed"
+    """
+    if path is None:
+        yield
+        return
+
+    if kind == "pstats":
+        # before Python 3.12, cProfile only sees the thread that enables it, so
+        #   each thread started in the block (eg, a pool of workers) gets its
+        #   own, merged in at the end; from 3.12, it sees all threads, and only
+        #   one profiler can be active at a time
+        profilers = [cProfile.Profile()]
+        lock = threading.Lock()
+        perthread = sys.version_info < (3, 12)
+
+        def profilethread(frame, event, arg):
+            profiler = cProfile.Profile()
+            with lock:
+                profilers.append(profiler)
+            profiler.enable()
+
+        if perthread:
+            threading.setprofile(profilethread)
+        profilers[0].enable()
+        try:
+            yield
+        finally:
+            profilers[0].disable()
+            if perthread:
+                threading.setprofile(None)
+            with lock:
+                for profiler in profilers:
+                    profiler.create_stats()
+                # pstats won't load a profile with no calls in it
+                stats = pstats.Stats(*[profiler for profiler in profilers if profiler.stats])
+            stats.dump_stats(path)
+    elif kind == "collapsed":
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.write(path)
+    else:
+        raise ValueError("unknown profile format = {}".format(kind))
+
+
+class StackSampler:
+    """
+    periodically samples the stacks of all threads (except its own) and
+    counts identical stacks
+    """
+    def __init__(self, interval=sampleinterval):
+        self.interval = interval
+        self.counts = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="marktips-profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        ownid = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for threadid, frame in sys._current_frames().items():
+                if threadid == ownid:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{} ({}:{})".format(code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(threadid, str(threadid)))
+                self.counts[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        """
+        write samples in collapsed stack format: "frame;frame;frame count" per line
+        """
+        with open(path, "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write("{} {}\n".format(stack, count))
+
+
+def mergeprofiles(partpaths, path, kind="pstats"):
+    """
+    combine profiles of the same format (eg, from several worker processes)
+    into one file; the parts are removed
+
+    input: list of paths to the parts; output path; "pstats" or "collapsed"
+    """
+    partpaths = [partpath for partpath in partpaths if os.path.exists(partpath)]
+    if not partpaths:
+        return
+    if kind == "pstats":
+        stats = pstats.Stats(*partpaths)
+        stats.dump_stats(path)
+    else:
+        counts = collections.Counter()
+        for partpath in partpaths:
+            with open(partpath) as f:
+                for line in f:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    counts[stack] += int(count)
+        with open(path, "w") as f:
+            for stack, count in counts.most_common():
+                f.write("{} {}\n".format(stack, count))
+    for partpath in partpaths:
+        os.remove(partpath)
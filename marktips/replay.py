@@ -0,0 +1,197 @@
+"""
+
+replay.py
+
+record the DVID traffic of a marktips run to a local archive, and serve it
+back later without a DVID server, for repeatable offline benchmarks of real
+bodies
+
+both are requests transport adapters, mounted on the sessions that make
+DVID calls: ours, and each one dvidtools makes for its own calls (see
+marktips.setadapter()), so a replayed run needs no server at all
+
+responses are recorded as received, after any content encoding (eg, gzip)
+has been undone
+
+the archive is a zip file with an index of the calls (method, path, query,
+status, content type, elapsed time) and each distinct response body stored
+once, compressed
+
+on replay, calls are matched on method, path, and query (ignoring the user
+and app parameters, and the server); repeated identical calls get the
+recorded responses in order, and the last one again once those run out;
+a call whose path ends in a key that changed between runs (eg, the run ID)
+falls back to a recorded call that differs only in that last part
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import hashlib
+from io import BytesIO
+import json
+import threading
+import time
+import urllib.parse
+import zipfile
+
+# third party
+import requests
+from urllib3.response import HTTPResponse
+
+
+# ------------------------------ constants ------------------------------
+archiveversion = 1
+
+# query parameters that identify the caller rather than the call
+ignoredparameters = ["u", "app"]
+
+
+# ------------------------------ code ------------------------------
+def callkey(method, url, wildcard=False):
+    """
+    input: HTTP method; URL; flag to replace the last part of the path with "*"
+    output: hashable key identifying the call
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path
+    if wildcard:
+        path = path.rsplit("/", 1)[0] + "/*"
+    query = sorted((name, value) for name, value in urllib.parse.parse_qsl(parts.query)
+        if name not in ignoredparameters)
+    return method, path, urllib.parse.urlencode(query)
+
+
+def makeraw(content, status, headers):
+    """
+    output: urllib3 response that reads the given content, for a requests
+        response that may be streamed
+    """
+    return HTTPResponse(body=BytesIO(content), headers=headers, status=status,
+        preload_content=False, decode_content=False)
+
+
+class TrafficRecorder(requests.adapters.HTTPAdapter):
+    """
+    passes calls through to the server and records them; responses are read
+    in full as they arrive, so streamed calls are not streamed while recording
+    """
+    def __init__(self, path, **kwargs):
+        """
+        input: path to write the archive to, on close()
+        """
+        super().__init__(**kwargs)
+        self.path = path
+        self.lock = threading.Lock()
+        self.calls = []
+
+        # sha1 hex: body
+        self.bodies = {}
+
+        # information about the run, stored with the archive
+        self.meta = {}
+
+    def send(self, request, **kwargs):
+        t1 = time.time()
+        response = super().send(request, **kwargs)
+        content = response.content
+        elapsed = time.time() - t1
+
+        digest = hashlib.sha1(content).hexdigest()
+        method, path, query = callkey(request.method, request.url)
+        with self.lock:
+            self.bodies[digest] = content
+            self.calls.append({
+                "method": method,
+                "path": path,
+                "query": query,
+                "status": response.status_code,
+                "content type": response.headers.get("Content-Type", ""),
+                "elapsed": elapsed,
+                "body": digest,
+            })
+
+        # the content has been read (and decoded), so give streaming readers a
+        #   fresh copy, with headers to match
+        for name in ["Content-Encoding", "Content-Length"]:
+            response.headers.pop(name, None)
+        response.headers["Content-Length"] = str(len(content))
+        response.raw = makeraw(content, response.status_code, response.headers)
+        return response
+
+    def close(self):
+        super().close()
+        if self.path is None:
+            return
+        with self.lock:
+            index = {"version": archiveversion, "meta": self.meta, "calls": self.calls}
+            with zipfile.ZipFile(self.path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr("index.json", json.dumps(index))
+                for digest, content in self.bodies.items():
+                    archive.writestr("bodies/" + digest, content)
+        self.path = None
+
+
+class TrafficReplayer(requests.adapters.HTTPAdapter):
+    """
+    serves calls from a recorded archive; never contacts a server
+    """
+    def __init__(self, path, latencyscale=1.0, **kwargs):
+        """
+        input: path to the archive; factor applied to the recorded latencies
+            (0 for none)
+        """
+        super().__init__(**kwargs)
+        self.latencyscale = latencyscale
+        self.lock = threading.Lock()
+        with zipfile.ZipFile(path) as archive:
+            index = json.loads(archive.read("index.json"))
+            self.bodies = {name[len("bodies/"):]: archive.read(name)
+                for name in archive.namelist() if name.startswith("bodies/")}
+        self.meta = index["meta"]
+
+        # key: list of recorded calls, in order; calls are also filed under
+        #   their wildcard key, for when the last part of the path changes
+        self.recorded = {}
+        for call in index["calls"]:
+            key = call["method"], call["path"], call["query"]
+            self.recorded.setdefault(key, []).append(call)
+            wildcardkey = callkey(call["method"], call["path"] + "?" + call["query"], wildcard=True)
+            self.recorded.setdefault(wildcardkey, []).append(call)
+        self.positions = {}
+        self.nmissed = 0
+
+    def rewind(self):
+        """
+        start again from the first recorded response for each call
+        """
+        with self.lock:
+            self.positions = {}
+            self.nmissed = 0
+
+    def nextcall(self, request):
+        """
+        output: recorded call dict for the request, or None
+        """
+        for key in [callkey(request.method, request.url), callkey(request.method, request.url, wildcard=True)]:
+            if key in self.recorded:
+                calls = self.recorded[key]
+                with self.lock:
+                    position = self.positions.get(key, 0)
+                    self.positions[key] = position + 1
+                return calls[min(position, len(calls) - 1)]
+        return None
+
+    def send(self, request, **kwargs):
+        call = self.nextcall(request)
+        if call is None:
+            with self.lock:
+                self.nmissed += 1
+            status, content, headers = 404, b"call not in recording", {"Content-Type": "text/plain"}
+        else:
+            if self.latencyscale:
+                time.sleep(call["elapsed"] * self.latencyscale)
+            status, content = call["status"], self.bodies[call["body"]]
+            headers = {"Content-Type": call["content type"]}
+        headers["Content-Length"] = str(len(content))
+        return self.build_response(request, makeraw(content, status, headers))
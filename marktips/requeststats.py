@@ -0,0 +1,181 @@
+"""
+
+requeststats.py
+
+records counts, status codes, latency histograms, sizes and slow calls for
+DVID requests, grouped by the kind of endpoint called
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import bisect
+import collections
+import threading
+import urllib.parse
+
+
+# ------------------------------ constants ------------------------------
+# upper bounds (seconds) of the latency histogram buckets; the last bucket
+#   catches everything slower
+latencybuckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# calls slower than this (seconds) are listed individually
+defaultslowcall = 5.0
+
+# keep at most this many slow calls, slowest first
+maxslowcalls = 20
+
+# endpoints we know; anything else is "other"
+endpointclasses = ["label", "labels", "ptquery", "info", "elements", "skeleton", "keyvalue"]
+
+
+# ------------------------------ code ------------------------------
+def endpointclass(url):
+    """
+    input: URL of a DVID call
+    output: name of the kind of endpoint called
+    """
+    # /api/node/<uuid>/<instance>/<endpoint>/...
+    parts = urllib.parse.urlsplit(url).path.strip("/").split("/")
+    if len(parts) < 5 or parts[:2] != ["api", "node"]:
+        return "other"
+    instance, endpoint = parts[3], parts[4]
+    if instance.endswith("_skeletons") or (endpoint == "key" and parts[-1].endswith("_swc")):
+        return "skeleton"
+    if endpoint in ["key", "keyvalues"]:
+        return "keyvalue"
+    if endpoint in endpointclasses:
+        return endpoint
+    return "other"
+
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.statuses = collections.Counter()
+        self.time = 0.0
+        self.maxtime = 0.0
+        self.bytessent = 0
+        self.bytesreceived = 0
+        self.histogram = [0] * (len(latencybuckets) + 1)
+
+    def add(self, status, elapsed, sent, received):
+        self.count += 1
+        self.statuses[str(status)] += 1
+        self.time += elapsed
+        self.maxtime = max(self.maxtime, elapsed)
+        self.bytessent += sent
+        self.bytesreceived += received
+        self.histogram[bisect.bisect_left(latencybuckets, elapsed)] += 1
+
+    def merge(self, summary):
+        """
+        add in the counts from a summary dict (eg, from another process)
+        """
+        self.count += summary["count"]
+        self.statuses.update(summary["statuses"])
+        self.time += summary["time"]
+        self.maxtime = max(self.maxtime, summary["max time"])
+        self.bytessent += summary["bytes sent"]
+        self.bytesreceived += summary["bytes received"]
+        self.histogram = [a + b for a, b in zip(self.histogram, summary["histogram"])]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "statuses": dict(self.statuses),
+            "time": self.time,
+            "mean time": self.time / self.count if self.count else 0.0,
+            "max time": self.maxtime,
+            "bytes sent": self.bytessent,
+            "bytes received": self.bytesreceived,
+            "histogram": self.histogram,
+        }
+
+
+class RequestStats:
+    """
+    thread-safe collection of per-endpoint request statistics
+    """
+    def __init__(self, slowcall=defaultslowcall):
+        self.slowcall = slowcall
+        self.lock = threading.Lock()
+        self.inflight = 0
+
+        # optionally, a multiprocessing.Value shared by several processes,
+        #   so their calls in flight can be watched together
+        self.sharedinflight = None
+
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = collections.defaultdict(EndpointStats)
+            self.slowcalls = []
+
+    def begin(self):
+        """
+        note the start of a call; must be paired with end()
+        """
+        self.addinflight(1)
+
+    def end(self):
+        """
+        note the end of a call, successful or not
+        """
+        self.addinflight(-1)
+
+    def addinflight(self, n):
+        with self.lock:
+            self.inflight += n
+        if self.sharedinflight is not None:
+            with self.sharedinflight.get_lock():
+                self.sharedinflight.value += n
+
+    def record(self, method, url, status, elapsed, sent=0, received=0):
+        """
+        record one completed DVID call
+
+        input: HTTP method; URL; status code; seconds taken; bytes sent; bytes received
+        """
+        kind = endpointclass(url)
+        with self.lock:
+            self.endpoints[kind].add(status, elapsed, sent, received)
+            if elapsed >= self.slowcall:
+                self.slowcalls.append({
+                    "method": method,
+                    # drop the user and app query parameters
+                    "url": url.split("?")[0],
+                    "status": status,
+                    "time": elapsed,
+                })
+                self.slowcalls.sort(key=lambda call: call["time"], reverse=True)
+                del self.slowcalls[maxslowcalls:]
+
+    def merge(self, summary):
+        """
+        add in the statistics from a summary dict (eg, from another process)
+        """
+        with self.lock:
+            for kind, endpointsummary in summary["endpoints"].items():
+                self.endpoints[kind].merge(endpointsummary)
+            self.slowcalls.extend(summary["slow calls"])
+            self.slowcalls.sort(key=lambda call: call["time"], reverse=True)
+            del self.slowcalls[maxslowcalls:]
+
+    def summary(self):
+        """
+        output: json-able dict of the statistics so far
+        """
+        with self.lock:
+            return {
+                "latency buckets": latencybuckets,
+                "endpoints": {kind: stats.summary() for kind, stats in sorted(self.endpoints.items())},
+                "slow calls": list(self.slowcalls),
+            }
+
+
+# all DVID calls in a process are recorded here
+requeststats = RequestStats()
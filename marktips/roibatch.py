@@ -0,0 +1,169 @@
+"""
+
+roibatch.py
+
+combine the RoI point queries of many bodies into a few large ones
+
+in a batch, each body asks DVID which of its tips are in each RoI with its
+own ptquery call; with many small bodies, that's thousands of small calls;
+here, a batcher in a server process (a multiprocessing manager) collects the
+queries that the workers make at about the same time, sends one ptquery
+per RoI for all of them (split at a maximum number of points), and hands
+each worker back its share of the answer
+
+the first query for a RoI waits a short time for others to join it, so
+a body on its own is slowed by at most that wait
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+from multiprocessing.managers import BaseManager
+import threading
+import time
+
+# third party
+import requests
+
+# local
+from .limiter import dvidlimits
+from .marktips import postdvid, requestbytes, MarktipsError
+
+
+# ------------------------------ constants ------------------------------
+# most points in one ptquery call
+defaultmaxpoints = 100000
+
+# seconds the first query for a RoI waits for others
+defaultwait = 0.05
+
+
+# ------------------------------ code ------------------------------
+class PointQueryBatcher:
+    """
+    combines concurrent ptquery calls; query() may be called from many threads
+    """
+    def __init__(self, maxpoints=defaultmaxpoints, wait=defaultwait):
+        self.maxpoints = maxpoints
+        self.wait = wait
+        self.condition = threading.Condition()
+
+        # (server, UUID, RoI, username): list of queries waiting to be sent
+        self.waiting = {}
+
+        self.nqueries = 0
+        self.ncalls = 0
+        self.npoints = 0
+        self.time = 0.0
+
+    def query(self, serverport, uuid, roi, points, username):
+        """
+        input: server; UUID; RoI; list of [x, y, z] points; username
+        output: (list of flags, True where the point is in the RoI; bytes sent
+            and received for these points, a share of the combined calls)
+        """
+        if not points:
+            return [], 0
+        query = {"points": points, "done": threading.Event(), "inside": None, "bytes": 0, "error": None}
+        key = serverport, uuid, roi, username
+        with self.condition:
+            self.nqueries += 1
+            queries = self.waiting.setdefault(key, [])
+            queries.append(query)
+            first = len(queries) == 1
+            if not first and sum(len(q["points"]) for q in queries) >= self.maxpoints:
+                # full; no need for the first to keep waiting
+                self.condition.notify_all()
+
+        if first:
+            # wait for others to join, then send them all
+            deadline = time.time() + self.wait
+            with self.condition:
+                while True:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or sum(len(q["points"]) for q in queries) >= self.maxpoints:
+                        break
+                    self.condition.wait(remaining)
+                queries = self.waiting.pop(key)
+            self.send(key, queries)
+
+        query["done"].wait()
+        if query["error"] is not None:
+            raise MarktipsError(query["error"])
+        return query["inside"], query["bytes"]
+
+    def send(self, key, queries):
+        """
+        send the combined points of the queries, in calls of at most maxpoints,
+        and hand out the results
+        """
+        serverport, uuid, roi, username = key
+        call = serverport + "/api/node/" + uuid + "/" + roi + "/ptquery"
+        points = [point for query in queries for point in query["points"]]
+        inside = []
+        nbytes = 0
+        ncalls = 0
+        error = None
+        t1 = time.time()
+        try:
+            for start in range(0, len(points), self.maxpoints):
+                r = postdvid(call, username, data=points[start:start + self.maxpoints])
+                ncalls += 1
+                if r.status_code != requests.codes.ok:
+                    error = "RoI {} point query failed with status {}: {}".format(roi, r.status_code, r.text)
+                    break
+                inside.extend(r.json())
+                nbytes += requestbytes(r)
+        except Exception as e:
+            error = "RoI {} point query failed: {!r}".format(roi, e)
+        with self.condition:
+            self.ncalls += ncalls
+            self.npoints += len(points)
+            self.time += time.time() - t1
+
+        start = 0
+        for query in queries:
+            n = len(query["points"])
+            if error is None:
+                query["inside"] = inside[start:start + n]
+                query["bytes"] = nbytes * n // len(points)
+            else:
+                query["error"] = error
+            start += n
+            query["done"].set()
+
+    def summary(self):
+        with self.condition:
+            return {
+                "queries": self.nqueries,
+                "calls": self.ncalls,
+                "points": self.npoints,
+                "time": self.time,
+            }
+
+
+class RoIBatchManager(BaseManager):
+    pass
+
+RoIBatchManager.register("PointQueryBatcher", PointQueryBatcher)
+
+
+def initmanager(limits):
+    """
+    set up the manager's server process
+
+    input: DVIDLimits for the combined calls to go through
+    """
+    dvidlimits.share(limits)
+
+
+def startbatcher(limits, maxpoints=defaultmaxpoints, wait=defaultwait):
+    """
+    input: DVIDLimits for the calls; most points per call; seconds to wait
+        for queries to combine
+    output: (started RoIBatchManager, which should be shut down when done;
+        proxy for its PointQueryBatcher, which can be passed to worker processes)
+    """
+    manager = RoIBatchManager()
+    manager.start(initmanager, (limits,))
+    return manager, manager.PointQueryBatcher(maxpoints, wait)
@@ -0,0 +1,102 @@
+"""
+
+runindex.py
+
+a SQLite index of marktips runs; marktips.py records each run here, and
+history queries can be answered from it without downloading and scanning
+a body's to do items from DVID
+
+the database file may be local or on a shared file system
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import json
+import os
+import sqlite3
+
+
+# ------------------------------ constants ------------------------------
+# seconds to wait for a lock when others are writing to a shared index
+locktimeout = 30.0
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (
+    runkey TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    time TEXT NOT NULL,
+    serverport TEXT,
+    uuid TEXT,
+    todoinstance TEXT,
+    roi TEXT,
+    excludedroi TEXT,
+    runid TEXT,
+    count INTEGER,
+    parameters TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_body ON runs (body, time);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (time);
+CREATE INDEX IF NOT EXISTS runs_uuid ON runs (uuid);
+CREATE INDEX IF NOT EXISTS runs_roi ON runs (roi);
+"""
+
+
+# ------------------------------ code ------------------------------
+class RunIndex:
+    def __init__(self, path, readonly=False):
+        """
+        input: path to the database; flag to open an existing one read-only
+            (otherwise it's created if needed)
+        """
+        self.path = path
+        if readonly:
+            if not os.path.exists(path):
+                raise FileNotFoundError("no such file")
+            self.connection = sqlite3.connect("file:{}?mode=ro".format(path), timeout=locktimeout, uri=True)
+        else:
+            self.connection = sqlite3.connect(path, timeout=locktimeout)
+            with self.connection:
+                self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    def addrun(self, serverport, uuid, todoinstance, params, count):
+        """
+        records one run; recording the same run again replaces it
+
+        input: server; UUID; to do instance; run parameters dict (needs at
+            least "time" and "body ID"); number of to do items placed
+        """
+        # runs from before run IDs existed are identified by time and body
+        runkey = params.get("run ID") or "{}|{}".format(params["time"], params["body ID"])
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (runkey, str(params["body ID"]), params["time"], serverport, uuid, todoinstance,
+                    params.get("RoI", ""), params.get("excluded RoI", ""), params.get("run ID", ""),
+                    count, json.dumps(params)))
+
+    def gethistory(self, bodyid, serverport=None, uuid=None, todoinstance=None):
+        """
+        input: body ID; optional server, UUID and to do instance to restrict
+            to runs made there, as a history from DVID would be
+        output: list of history dicts, as from MarktipsHistoryFinder.gethistory(), oldest first
+        """
+        # (indexes written by earlier versions may hold runs that placed nothing,
+        #   which DVID has no record of)
+        query = "SELECT time, body, roi, excludedroi, runid, count FROM runs WHERE body = ? AND count > 0"
+        values = [str(bodyid)]
+        for column, value in [("serverport", serverport), ("uuid", uuid), ("todoinstance", todoinstance)]:
+            if value is not None:
+                query += " AND {} = ?".format(column)
+                values.append(value)
+        query += " ORDER BY time"
+        history = []
+        for row in self.connection.execute(query, values):
+            temp = {}
+            temp["time"], temp["body ID"], temp["RoI"], temp["excluded RoI"], temp["run ID"], temp["count"] = row
+            history.append(temp)
+        return history
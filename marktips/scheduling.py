@@ -0,0 +1,157 @@
+"""
+
+scheduling.py
+
+the order in which a batch runs its bodies
+
+run time per body varies by orders of magnitude with body size; if a big
+body starts late, one worker is still grinding on it long after the rest
+have run out of work, so it pays to start the biggest bodies first
+
+each policy is a function (body IDs, getsizes) -> body IDs in the order
+to run them, where getsizes() returns a dict of body ID: size in voxels
+(fetched from DVID on first call, in bulk); add a policy by adding it to
+schedulingpolicies
+
+bodies can also be sorted into size classes, each run in its own pool of
+workers, so a few giant bodies can't crowd out the small ones
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import argparse
+import random
+
+# third party
+import requests
+
+# local
+from .marktips import getdvid, MarktipsError
+
+
+# ------------------------------ constants ------------------------------
+# body IDs per /sizes call
+sizesbatch = 1000
+
+
+# ------------------------------ code ------------------------------
+def getbodysizes(serverport, uuid, segmentation, bodyids, username):
+    """
+    retrieves body sizes in bulk from a labelmap instance
+
+    input: server; UUID; segmentation instance; list of body IDs; username
+    output: dict {body ID: size in voxels}; bodies that don't exist have size 0
+    """
+    call = serverport + "/api/node/" + uuid + "/" + segmentation + "/sizes"
+    sizes = {}
+    for start in range(0, len(bodyids), sizesbatch):
+        chunk = bodyids[start:start + sizesbatch]
+        try:
+            data = [int(bodyid) for bodyid in chunk]
+        except ValueError as e:
+            raise MarktipsError("body IDs must be integers: {}".format(e))
+        r = getdvid(call, username, data=data)
+        if r.status_code != requests.codes.ok:
+            raise MarktipsError("couldn't retrieve body sizes from {}: {}".format(segmentation, r.text))
+        sizes.update(zip(chunk, r.json()))
+    return sizes
+
+
+def inputorder(bodyids, getsizes):
+    """
+    run the bodies in the order given
+    """
+    return list(bodyids)
+
+
+def largestfirst(bodyids, getsizes):
+    """
+    run the biggest bodies first, so the long jobs start early (longest
+    processing time first)
+    """
+    sizes = getsizes()
+    return sorted(bodyids, key=lambda bodyid: sizes.get(bodyid, 0), reverse=True)
+
+
+def randomorder(bodyids, getsizes):
+    """
+    run the bodies in random order, eg, to spread neighbouring bodies
+    (which may be similar in size) over the run
+    """
+    bodyids = list(bodyids)
+    random.shuffle(bodyids)
+    return bodyids
+
+
+schedulingpolicies = {
+    "input": inputorder,
+    "largest": largestfirst,
+    "random": randomorder,
+}
+
+
+def schedule(policy, bodyids, serverport, uuid, segmentation, username):
+    """
+    order bodies by a scheduling policy
+
+    input: policy name; list of body IDs; server; UUID; segmentation instance
+        to get sizes from; username
+    output: (list of body IDs in the order to run them, dict of sizes or
+        None if the policy didn't need them)
+    """
+    fetched = {}
+
+    def getsizes():
+        if "sizes" not in fetched:
+            fetched["sizes"] = getbodysizes(serverport, uuid, segmentation, bodyids, username)
+        return fetched["sizes"]
+
+    ordered = schedulingpolicies[policy](bodyids, getsizes)
+    return ordered, fetched.get("sizes")
+
+
+def parsesizeclass(text):
+    """
+    input: size class as "name:max size:workers[:memory budget]", with the
+        max size in voxels ("-" for no maximum) and the memory budget per
+        body in MB
+    output: size class dict
+    """
+    parts = text.split(":")
+    if len(parts) not in [3, 4] or not parts[0]:
+        raise argparse.ArgumentTypeError("size class must be name:max size:workers[:memory budget], " +
+            "eg, small:1e8:32:2000")
+    try:
+        maxsize = None if parts[1] == "-" else int(float(parts[1]))
+        workers = int(parts[2])
+        budget = float(parts[3]) if len(parts) == 4 else None
+    except ValueError:
+        raise argparse.ArgumentTypeError("size class {}: max size, workers and memory budget must be numbers".format(text))
+    if workers < 1:
+        raise argparse.ArgumentTypeError("size class {}: needs at least one worker".format(text))
+    return {"name": parts[0], "max size": maxsize, "workers": workers, "memory budget": budget}
+
+
+def classify(bodyids, sizes, sizeclasses):
+    """
+    sort bodies into size classes: each body goes in the smallest class
+    whose max size it doesn't exceed; bodies bigger than every class's
+    max size go in the biggest class
+
+    input: list of body IDs; dict of body ID: size; list of size class dicts
+    output: list of (size class, list of its body IDs in input order), from
+        the smallest class to the biggest
+    """
+    ordered = sorted(sizeclasses, key=lambda sizeclass: (sizeclass["max size"] is None, sizeclass["max size"] or 0))
+    classes = [(sizeclass, []) for sizeclass in ordered]
+    for bodyid in bodyids:
+        size = sizes.get(bodyid, 0)
+        for sizeclass, members in classes:
+            if sizeclass["max size"] is None or size <= sizeclass["max size"]:
+                members.append(bodyid)
+                break
+        else:
+            classes[-1][1].append(bodyid)
+    return classes
@@ -0,0 +1,156 @@
+"""
+
+tipsoutput.py
+
+columnar output of found tips, for tip censuses over many bodies where the
+json list of locations is too slow to write and read
+
+tips are buffered as bodies finish and written in chunks to a directory, one
+file per chunk, named so that several processes can write to the same
+directory at once; the files are Parquet (scan the directory with pandas,
+pyarrow.dataset, DuckDB, etc.) or NPY structured arrays (np.load() each
+with mmap_mode="r")
+
+columns: body ID, x, y, z, in RoI, in excluded RoI; without a RoI, every
+tip counts as in it, and without an excluded RoI, none count as in that
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import os
+import secrets
+
+# third party
+try:
+    import numpy as np
+    hasNumpy = True
+except ImportError:
+    hasNumpy = False
+
+try:
+    import pandas as pd
+    hasPandas = True
+except ImportError:
+    hasPandas = False
+
+# pandas needs one of these to write Parquet
+try:
+    import pyarrow.parquet
+    hasPyarrow = True
+except ImportError:
+    hasPyarrow = False
+
+try:
+    import fastparquet
+    hasFastparquet = True
+except ImportError:
+    hasFastparquet = False
+
+hasParquet = hasPyarrow or hasFastparquet
+
+
+# ------------------------------ constants ------------------------------
+tipformats = ["parquet", "npy"]
+
+# tips per file; only each writer's last file has fewer
+defaultchunksize = 1000000
+
+tipcolumns = ["body ID", "x", "y", "z", "in RoI", "in excluded RoI"]
+tiptypes = ["<u8", "<i4", "<i4", "<i4", "?", "?"]
+
+
+# ------------------------------ code ------------------------------
+class TipWriter:
+    def __init__(self, directory, kind="parquet", chunksize=defaultchunksize):
+        """
+        input: directory to write into (created if needed); "parquet" or "npy";
+            number of tips per file
+        """
+        if not hasNumpy:
+            raise ValueError("writing tips requires the numpy library")
+        if kind == "parquet" and not (hasPandas and hasParquet):
+            raise ValueError("writing Parquet requires the pandas library, and pyarrow or fastparquet")
+        if kind not in tipformats:
+            raise ValueError("unknown tips output format = {}".format(kind))
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.kind = kind
+        self.chunksize = chunksize
+        self.dtype = np.dtype(list(zip(tipcolumns, tiptypes)))
+
+        # unique per writer, so writers in different processes don't collide
+        self.prefix = "tips-" + secrets.token_hex(4)
+        self.nchunks = 0
+        self.buffered = []
+        self.nbuffered = 0
+        self.paths = []
+
+    def add(self, bodyid, locations, inroi=None, inexcludedroi=None):
+        """
+        buffer one body's tips, writing a chunk if enough are buffered
+
+        input: body ID; list of [x, y, z]; optional lists of RoI and excluded
+            RoI flags, one per location
+        """
+        tips = np.zeros(len(locations), dtype=self.dtype)
+        if len(locations):
+            points = np.asarray(locations, dtype=np.int64)
+            tips["x"], tips["y"], tips["z"] = points[:, 0], points[:, 1], points[:, 2]
+        tips["body ID"] = int(bodyid)
+        tips["in RoI"] = True if inroi is None else inroi
+        tips["in excluded RoI"] = False if inexcludedroi is None else inexcludedroi
+        self.buffered.append(tips)
+        self.nbuffered += len(tips)
+        if self.nbuffered >= self.chunksize:
+            self.flush()
+
+    def flush(self, final=False):
+        """
+        write out the buffered tips in chunks of chunksize; the remainder
+        stays buffered, unless this is the final flush
+        """
+        if not self.nbuffered:
+            return
+        tips = np.concatenate(self.buffered)
+        nwrite = len(tips) if final else len(tips) - len(tips) % self.chunksize
+        for start in range(0, nwrite, self.chunksize):
+            self.writechunk(tips[start:min(start + self.chunksize, nwrite)])
+        self.buffered = [tips[nwrite:]]
+        self.nbuffered = len(tips) - nwrite
+
+    def writechunk(self, tips):
+        path = os.path.join(self.directory, "{}-{:05d}.{}".format(self.prefix, self.nchunks, self.kind))
+        self.nchunks += 1
+        # write under a temporary name, so readers never see a partial chunk
+        temppath = path + ".tmp"
+        if self.kind == "parquet":
+            pd.DataFrame(tips).to_parquet(temppath, index=False)
+        else:
+            with open(temppath, "wb") as f:
+                np.save(f, tips)
+        os.replace(temppath, path)
+        self.paths.append(path)
+
+    def close(self):
+        self.flush(final=True)
+
+
+def tipfiles(directory):
+    """
+    output: sorted list of paths of the finished chunk files in a tips output directory
+    """
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith("tips-") and name.endswith(tuple("." + kind for kind in tipformats)))
+
+
+def countrows(path):
+    """
+    output: number of tips in a chunk file
+    """
+    if path.endswith(".npy"):
+        return len(np.load(path, mmap_mode="r"))
+    if hasPyarrow:
+        # from the footer, without reading the data
+        return pyarrow.parquet.read_metadata(path).num_rows
+    return len(pd.read_parquet(path))
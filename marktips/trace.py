@@ -0,0 +1,82 @@
+"""
+
+trace.py
+
+writes Chrome trace-event json (viewable in chrome://tracing, Perfetto, or
+speedscope) with one span per body and child spans for the stages of each
+body's run
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import json
+
+
+# ------------------------------ code ------------------------------
+def bodyevents(bodyid, start, duration, spans, pid, tid, worker=None, status=True):
+    """
+    input: body ID; body start time and duration (s); list of stage span dicts
+        {"name", "start", "duration"} (times in s); process and thread IDs;
+        optional worker number; whether the body succeeded
+    output: list of trace events
+    """
+    args = {"body ID": bodyid, "status": status, "pid": pid}
+    if worker is not None:
+        args["worker"] = worker
+    events = [{
+        "name": "body {}".format(bodyid),
+        "cat": "body",
+        "ph": "X",
+        "ts": start * 1e6,
+        "dur": duration * 1e6,
+        "pid": pid,
+        "tid": tid,
+        "args": args,
+    }]
+    for span in spans:
+        events.append({
+            "name": span["name"],
+            "cat": "stage",
+            "ph": "X",
+            "ts": span["start"] * 1e6,
+            "dur": span["duration"] * 1e6,
+            "pid": pid,
+            "tid": tid,
+            "args": {"body ID": bodyid},
+        })
+    return events
+
+
+class TraceWriter:
+    """
+    streams trace events to a file as they come in, so a long batch doesn't
+    hold them all in memory; the file is a json array of events
+    """
+    def __init__(self, path):
+        self.file = open(path, "w")
+        self.file.write("[\n")
+        self.first = True
+        self.named = set()
+
+    def nameprocess(self, pid, name):
+        """
+        label a process in the viewer, once per process
+        """
+        if pid in self.named:
+            return
+        self.named.add(pid)
+        self.add([{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}}])
+
+    def add(self, events):
+        for event in events:
+            if not self.first:
+                self.file.write(",\n")
+            self.file.write(json.dumps(event))
+            self.first = False
+        self.file.flush()
+
+    def close(self):
+        self.file.write("\n]\n")
+        self.file.close()
@@ -0,0 +1,220 @@
+"""
+
+workqueue.py
+
+a queue of bodies to run, in a SQLite file that workers on several machines
+share; a worker leases a body, renews the lease while it runs, and records
+the result; a lease that isn't renewed (eg, the worker died) expires, and
+the body goes to the next worker that asks
+
+the file must be on a file system with working POSIX locks for SQLite
+(most local and cluster file systems; some NFS setups are not)
+
+
+"""
+
+# ------------------------------ imports ------------------------------
+# std lib
+import json
+import sqlite3
+import threading
+import time
+
+
+# ------------------------------ constants ------------------------------
+# seconds to wait for a lock when others are writing to the queue
+locktimeout = 60.0
+
+defaultlease = 300.0
+
+# a body whose lease expires this many times is marked failed instead of being
+#   handed out again; it probably kills whatever runs it
+defaultmaxattempts = 3
+
+# body states
+pending = "pending"
+leased = "leased"
+done = "done"
+failed = "failed"
+
+schema = """
+CREATE TABLE IF NOT EXISTS bodies (
+    body TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated REAL,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS bodies_state ON bodies (state, position);
+CREATE INDEX IF NOT EXISTS bodies_worker ON bodies (worker, state);
+"""
+
+
+# ------------------------------ code ------------------------------
+class WorkQueue:
+    def __init__(self, path, maxattempts=defaultmaxattempts):
+        self.path = path
+        self.maxattempts = maxattempts
+        # transactions are managed explicitly, so claims can take the write lock up front
+        self.connection = sqlite3.connect(path, timeout=locktimeout, isolation_level=None,
+            check_same_thread=False)
+        self.connection.executescript(schema)
+
+        # the connection is shared with the thread that renews leases
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.connection.close()
+
+    def transaction(self):
+        """
+        output: context manager for a write transaction, which takes the
+            lock at the start so two workers can't claim the same body
+        """
+        return Transaction(self.connection, self.lock)
+
+    def addbodies(self, bodyids):
+        """
+        add bodies to the end of the queue; bodies already in it are left alone
+
+        output: number of bodies added
+        """
+        with self.transaction():
+            start = self.connection.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM bodies").fetchone()[0]
+            before = self.connection.total_changes
+            self.connection.executemany("INSERT OR IGNORE INTO bodies (body, position, state, updated) VALUES (?, ?, ?, ?)",
+                [(str(bodyid), start + i, pending, time.time()) for i, bodyid in enumerate(bodyids)])
+            return self.connection.total_changes - before
+
+    def claim(self, worker, lease=defaultlease):
+        """
+        lease the next body: the first pending one, or one whose lease has expired
+
+        input: worker name; lease length (s)
+        output: body ID, or None if there's nothing to claim right now
+        """
+        now = time.time()
+        with self.transaction():
+            self.expireleases(now)
+            row = self.connection.execute("SELECT body FROM bodies WHERE state = ? ORDER BY position LIMIT 1",
+                (pending,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE bodies SET state = ?, worker = ?, expires = ?, " +
+                "attempts = attempts + 1, updated = ? WHERE body = ?", (leased, worker, now + lease, now, row[0]))
+            return row[0]
+
+    def expireleases(self, now):
+        """
+        return bodies with expired leases to the queue, or fail them if
+        they've been tried too often; call within a transaction
+        """
+        rows = self.connection.execute("SELECT body FROM bodies WHERE state = ? AND expires < ? AND attempts >= ?",
+            (leased, now, self.maxattempts)).fetchall()
+        for (bodyid,) in rows:
+            result = {"body ID": bodyid, "status": False, "message": "lease expired too many times"}
+            self.connection.execute("UPDATE bodies SET state = ?, updated = ?, result = ? WHERE body = ?",
+                (failed, now, json.dumps(result), bodyid))
+        self.connection.execute("UPDATE bodies SET state = ?, worker = NULL, updated = ? " +
+            "WHERE state = ? AND expires < ?", (pending, now, leased, now))
+
+    def renew(self, worker, lease=defaultlease):
+        """
+        extend all of a worker's leases
+
+        output: number of leases renewed
+        """
+        now = time.time()
+        with self.transaction():
+            cursor = self.connection.execute("UPDATE bodies SET expires = ?, updated = ? WHERE worker = ? AND state = ?",
+                (now + lease, now, worker, leased))
+            return cursor.rowcount
+
+    def finish(self, bodyid, worker, result):
+        """
+        record a body's result; ignored if the worker's lease was lost (the
+        body has gone to another worker, whose result will count)
+
+        input: body ID; worker name; result dict (with "status")
+        output: True if the result was recorded
+        """
+        with self.transaction():
+            cursor = self.connection.execute("UPDATE bodies SET state = ?, expires = NULL, updated = ?, result = ? " +
+                "WHERE body = ? AND worker = ? AND state = ?",
+                (done if result["status"] else failed, time.time(), json.dumps(result), str(bodyid), worker, leased))
+            return cursor.rowcount == 1
+
+    def counts(self):
+        """
+        output: dict of state: number of bodies
+        """
+        counts = {state: 0 for state in [pending, leased, done, failed]}
+        with self.lock:
+            for state, count in self.connection.execute("SELECT state, COUNT(*) FROM bodies GROUP BY state"):
+                counts[state] = count
+        return counts
+
+    def leasedelsewhere(self, worker):
+        """
+        output: number of bodies leased to workers other than the given one
+        """
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM bodies WHERE state = ? AND worker != ?",
+                (leased, worker)).fetchone()[0]
+
+    def results(self, state=None):
+        """
+        input: optional state to restrict to (done or failed)
+        output: iterator of result dicts of finished bodies, in queue order
+        """
+        query = "SELECT result FROM bodies WHERE result IS NOT NULL"
+        values = []
+        if state is not None:
+            query += " AND state = ?"
+            values.append(state)
+        query += " ORDER BY position"
+        with self.lock:
+            rows = self.connection.execute(query, values).fetchall()
+        for (result,) in rows:
+            yield json.loads(result)
+
+    def reset(self, states):
+        """
+        put bodies in the given states (eg, failed) back in the queue
+
+        output: number of bodies reset
+        """
+        with self.transaction():
+            marks = ",".join("?" * len(states))
+            cursor = self.connection.execute("UPDATE bodies SET state = ?, worker = NULL, expires = NULL, " +
+                "attempts = 0, updated = ?, result = NULL WHERE state IN ({})".format(marks),
+                [pending, time.time()] + list(states))
+            return cursor.rowcount
+
+
+class Transaction:
+    def __init__(self, connection, lock):
+        self.connection = connection
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.connection.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self.lock.release()
+            raise
+        return self.connection
+
+    def __exit__(self, exctype, excvalue, traceback):
+        try:
+            if exctype is None:
+                self.connection.execute("COMMIT")
+            else:
+                self.connection.execute("ROLLBACK")
+        finally:
+            self.lock.release()
+        return False
@@ -20,6 +20,12 @@ setup(
         'console_scripts': [
             'marktips=marktips.marktips:main',
             'marktipshistory=marktips.marktipshistory:main',
+            'marktipsbatch=marktips.marktipsbatch:main',
+            'marktipsindex=marktips.marktipsindex:main',
+            'marktipscensus=marktips.marktipscensus:main',
+            'marktipsqueue=marktips.marktipsqueue:main',
+            'marktipsmerge=marktips.marktipsmerge:main',
+            'marktipswatch=marktips.marktipswatch:main',
         ]
     },
     install_requires=requirements,
@@ -0,0 +1,33 @@
+from marktips.journal import Journal, findonly, place
+
+
+def finish(path, mode, results):
+    journal = Journal(path, mode)
+    journal.open()
+    for result in results:
+        journal.add(result)
+    journal.close()
+
+
+def test_find_only_results_dont_count_for_placing(tmp_path):
+    path = str(tmp_path / "journal")
+    finish(path, findonly, [{"body ID": 1, "status": True}, {"body ID": 2, "status": False}])
+
+    assert list(Journal(path, findonly).read()) == ["1"]
+    assert Journal(path, place).read() == {}
+
+    finish(path, place, [{"body ID": 2, "status": True}])
+    assert list(Journal(path, place).read()) == ["2"]
+    assert sorted(Journal(path, findonly).read()) == ["1", "2"]
+
+
+def test_partial_line_is_ignored(tmp_path):
+    path = tmp_path / "journal"
+    finish(str(path), place, [{"body ID": 1, "status": True}])
+    with open(path, "a") as f:
+        f.write('{"mode": "place", "result": {"body')
+    assert list(Journal(str(path), place).read()) == ["1"]
+
+    # and the next run starts on a fresh line
+    finish(str(path), place, [{"body ID": 2, "status": True}])
+    assert sorted(Journal(str(path), place).read()) == ["1", "2"]
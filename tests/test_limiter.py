@@ -0,0 +1,24 @@
+import argparse
+
+import pytest
+
+from marktips.limiter import AdaptiveLimit, RateCap, parsemaximum, parserate
+from marktips.marktips import addrunarguments
+
+
+@pytest.mark.parametrize("arguments", [["--max-reads", "0"], ["--max-writes", "-2"], ["--max-reads", "1.5"],
+    ["--max-rate", "0"], ["--max-rate", "-1"], ["--max-rate", "nan"]])
+def test_limits_below_one_call_are_rejected(arguments):
+    parser = argparse.ArgumentParser()
+    addrunarguments(parser)
+    with pytest.raises(SystemExit):
+        parser.parse_args(arguments)
+
+
+def test_limit_arguments():
+    assert parsemaximum("1") == 1
+    assert parserate("0.5") == 0.5
+    with pytest.raises(ValueError):
+        AdaptiveLimit(0)
+    with pytest.raises(ValueError):
+        RateCap(0)
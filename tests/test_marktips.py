@@ -0,0 +1,181 @@
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+pytest.importorskip("pandas")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import fakedvid
+
+import marktips.marktips as marktips
+from marktips.marktips import MarktipsError, TipDetector
+
+
+@pytest.fixture
+def fake():
+    fake = fakedvid.FakeDVID(latency=0.005)
+    fake.addbody(1, 500)
+    serverport = fake.start()
+    yield fake, serverport
+    fake.stop()
+
+
+def test_skeleton_stage_is_measured(fake):
+    fake, serverport = fake
+    detector = TipDetector(serverport, "test", "1", "segmentation_todo", "test")
+    skeleton = detector.fetchskeleton()
+
+    entry = detector.timer.get("skeleton")
+    assert len(skeleton) == 500
+    assert entry["points"] == 500
+    assert entry["bytes"] >= len(fake.skeletons[1])
+    assert entry["time"] > 0
+
+
+def test_missing_skeleton(fake):
+    fake, serverport = fake
+    detector = TipDetector(serverport, "test", "2", "segmentation_todo", "test")
+    with pytest.raises(MarktipsError, match="does not appear to have a skeleton"):
+        detector.fetchskeleton()
+
+
+def test_detection_uses_fetched_skeleton(fake):
+    pytest.importorskip("dvidtools")
+    fake, serverport = fake
+    detector = TipDetector(serverport, "test", "1", "segmentation_todo", "test")
+    detector.findtips(False)
+
+    assert detector.skeletonused
+    assert detector.timer.get("skeleton")["time"] > 0
+    assert detector.nlocations > 0
+    # only our fetch; dvidtools didn't fetch the skeleton again
+    assert fake.requestcounts["key"] == 1
+
+
+def test_detection_uses_prefetched_skeleton(fake):
+    pytest.importorskip("dvidtools")
+    fake, serverport = fake
+    detector = TipDetector(serverport, "test", "1", "segmentation_todo", "test", skeleton=fake.skeletons[1])
+    detector.findtips(False)
+
+    assert detector.skeletonprefetched and detector.skeletonused
+    assert detector.timer.get("skeleton")["points"] == 500
+    assert "key" not in fake.requestcounts
+
+
+def makedvidtools(serverport, barrier=None):
+    """
+    stand-in for dvidtools: fetch.get_skeletons() and fetch.dvid_session() as
+    tip detection calls them, and a detect_tips() returning the leaf nodes
+    """
+    import pandas as pd
+
+    fetch = types.ModuleType("fetch")
+    local = threading.local()
+
+    def dvid_session():
+        if not hasattr(local, "session"):
+            local.session = marktips.requests.Session()
+        return local.session
+
+    def get_skeletons(x, **kwargs):
+        r = fetch.dvid_session().get(serverport + "/api/node/test/segmentation_skeletons/key/{}_swc".format(x))
+        return [marktips.parseswc(r.content)]
+
+    def detect_tips(x):
+        skeleton = fetch.get_skeletons(x)[0]
+        if barrier is not None:
+            barrier.wait(timeout=10)
+        leaves = skeleton[~skeleton.node_id.isin(skeleton.parent_id)]
+        fetch.dvid_session().post(serverport + "/api/node/test/segmentation/labels",
+            json=leaves[["x", "y", "z"]].values.tolist())
+        return leaves
+
+    fetch.dvid_session = dvid_session
+    fetch.get_skeletons = get_skeletons
+    dvidtools = types.ModuleType("dvidtools")
+    dvidtools.fetch = fetch
+    dvidtools.set_param = lambda *args: None
+    dvidtools.detect_tips = detect_tips
+    return dvidtools
+
+
+def test_detectors_in_threads_use_their_own_skeletons(fake, monkeypatch):
+    fake, serverport = fake
+    fake.addbody(2, 300)
+    # both detections are running at once when they get past the barrier
+    monkeypatch.setattr(marktips, "dt", makedvidtools(serverport, threading.Barrier(2)), raising=False)
+    monkeypatch.setattr(marktips, "hasDVIDtools", True)
+
+    detectors = [TipDetector(serverport, "test", bodyid, "segmentation_todo", "test") for bodyid in ["1", "2"]]
+    threads = [threading.Thread(target=detector.findtips, args=(False,)) for detector in detectors]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for detector in detectors:
+        assert detector.skeletonused
+        assert detector.nlocations == len(fake.tips(detector.bodyid))
+        assert detector.timer.get("detection DVID")["bytes"] > 0
+    # only our two fetches; neither detection fetched its skeleton again
+    assert fake.requestcounts["key"] == 2
+
+
+def test_unsupported_dvidtools(monkeypatch):
+    dvidtools = types.ModuleType("dvidtools")
+    dvidtools.dvid_session = lambda: None
+    monkeypatch.setattr(marktips, "dt", dvidtools, raising=False)
+    monkeypatch.setattr(marktips, "hasDVIDtools", True)
+    with pytest.raises(MarktipsError, match="get_skeletons"):
+        marktips.wrapdvidtools()
+
+
+def test_segmentation_sets_skeleton_instance(monkeypatch):
+    dvidtools = types.ModuleType("dvidtools")
+    dvidtools.config = types.SimpleNamespace(segmentation="segmentation")
+    monkeypatch.setattr(marktips, "dt", dvidtools, raising=False)
+    monkeypatch.setattr(marktips, "hasDVIDtools", True)
+    monkeypatch.setattr(marktips, "segmentationinstance", marktips.segmentationinstance)
+
+    fake = fakedvid.FakeDVID(segmentation="seg2")
+    fake.addbody(1, 100)
+    serverport = fake.start()
+    try:
+        marktips.setsegmentation("seg2")
+        assert dvidtools.config.segmentation == "seg2"
+        assert marktips.skeletoninstance() == "seg2_skeletons"
+        detector = TipDetector(serverport, "test", "1", "segmentation_todo", "test")
+        assert len(detector.fetchskeleton()) == 100
+    finally:
+        fake.stop()
+
+
+def test_run_index_lists_runs_that_placed_todos(fake, monkeypatch, tmp_path):
+    fake, serverport = fake
+    monkeypatch.setattr(marktips, "dt", makedvidtools(serverport), raising=False)
+    monkeypatch.setattr(marktips, "hasDVIDtools", True)
+    path = str(tmp_path / "runs.db")
+
+    def run(save_parameters):
+        detector = TipDetector(serverport, "test", "1", "segmentation_todo", "test")
+        detector.run(False, False, save_parameters, path)
+        return detector
+
+    # parameters not saved: DVID's history won't show the run
+    assert run(False).ntodosplaced > 0
+    index = marktips.RunIndex(path)
+    assert index.gethistory("1") == []
+    index.close()
+    fake.clearbody(1)
+
+    placed = run(True).ntodosplaced
+    # the tips all have to do items now, so this one places none
+    assert run(True).ntodosplaced == 0
+    index = marktips.RunIndex(path)
+    history = index.gethistory("1", serverport, "test", "segmentation_todo")
+    index.close()
+    assert [item["count"] for item in history] == [placed]
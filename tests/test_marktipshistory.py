@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import fakedvid
+
+from marktips.marktipshistory import findhistories
+
+
+def test_failed_bodies_become_error_rows():
+    fake = fakedvid.FakeDVID()
+    fake.fail("segmentation_todo/label/2", 200, b'[{"Pos": [1, 2')
+    fake.fail("segmentation_todo/label/3", 500, b"internal error")
+    serverport = fake.start()
+    try:
+        rows = findhistories(serverport, "test", ["1", "2", "3"], "segmentation_todo", workers=2)
+    finally:
+        fake.stop()
+
+    assert [row["body ID"] for row in rows] == ["1", "2", "3"]
+    assert rows[0]["error"] == "" and rows[0]["count"] == 0
+    assert rows[1]["error"]
+    assert rows[2]["error"] == "existing to do retrieval failed!"
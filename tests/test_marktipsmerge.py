@@ -0,0 +1,63 @@
+import json
+import subprocess
+import sys
+
+from marktips.marktipsbatch import shardof
+from marktips.marktipsmerge import ResultMerger
+from marktips.requeststats import RequestStats
+
+
+def writeshard(path, bodyids, shard=None):
+    with open(path, "w") as f:
+        for bodyid in bodyids:
+            f.write(json.dumps({"body ID": bodyid, "status": False, "dvid": RequestStats().summary()}) + "\n")
+        if shard is not None:
+            f.write(json.dumps({"nbodies": len(bodyids), "ttotal": 1.0, "shard": shard}) + "\n")
+
+
+def shardbodies(count):
+    bodies = {i: [] for i in range(count)}
+    for bodyid in range(1, 100):
+        bodies[shardof(str(bodyid), count)].append(str(bodyid))
+    return bodies
+
+
+def test_missing_and_unfinished_shards(tmp_path):
+    bodies = shardbodies(3)
+    # shard 1 stopped before its summary; shard 2 left nothing
+    writeshard(tmp_path / "0.jsonl", bodies[0], "0/3")
+    writeshard(tmp_path / "1.jsonl", bodies[1][:5])
+    merger = ResultMerger()
+    for name in ["0.jsonl", "1.jsonl"]:
+        merger.addfile(str(tmp_path / name))
+
+    summary = merger.getsummary()
+    assert summary["missing shards"] == ["1/3", "2/3"]
+    assert summary["unfinished shards"] == ["1/3"]
+
+
+def test_expected_shards_without_summaries(tmp_path):
+    bodies = shardbodies(2)
+    writeshard(tmp_path / "0.jsonl", bodies[0])
+    merger = ResultMerger()
+    merger.addfile(str(tmp_path / "0.jsonl"))
+
+    assert "missing shards" not in merger.getsummary()
+    assert merger.getsummary()["warnings"]
+    summary = merger.getsummary(expectedshards=2)
+    assert summary["missing shards"] == ["0/2", "1/2"]
+    assert summary["unfinished shards"] == ["0/2"]
+
+
+def test_summary_written_to_output(tmp_path):
+    bodies = shardbodies(2)
+    writeshard(tmp_path / "0.jsonl", bodies[0], "0/2")
+    writeshard(tmp_path / "1.jsonl", bodies[1], "1/2")
+    output = tmp_path / "merged.jsonl"
+    run = subprocess.run([sys.executable, "-m", "marktips.marktipsmerge", str(tmp_path / "0.jsonl"),
+        str(tmp_path / "1.jsonl"), "--output", str(output), "--expected-shards", "2"], capture_output=True, text=True)
+
+    printed = json.loads(run.stdout)
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert printed["missing shards"] == []
+    assert len(lines) == 100 and lines[-1] == printed
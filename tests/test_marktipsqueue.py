@@ -0,0 +1,53 @@
+import argparse
+import io
+
+from marktips.marktips import addrunarguments
+from marktips.marktipsbatch import addbatcharguments
+from marktips.marktipsqueue import QueueRunner
+from marktips.workqueue import WorkQueue
+
+
+def makeoptions():
+    parser = argparse.ArgumentParser()
+    addrunarguments(parser)
+    addbatcharguments(parser)
+    return vars(parser.parse_args([]))
+
+
+def deferredresult(bodyid):
+    return {"body ID": bodyid, "status": False, "deferred": True}
+
+
+def test_deferred_body_doesnt_keep_worker_waiting(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    queue.addbodies(["1"])
+    runner = QueueRunner(queue, makeoptions(), 1, poll=60.0, worker="a")
+
+    assert runner.nextbodies(None, 2) == ["1"]
+    runner.addresult(deferredresult("1"), io.StringIO())
+
+    # the body is still leased to this worker, for the retry at the end,
+    #   but that mustn't count as work that may come back
+    assert runner.deferred == ["1"]
+    assert queue.counts()["leased"] == 1
+    assert not runner.morecoming()
+
+    # the retry's result is recorded against the lease the worker kept
+    runner.retrying = True
+    runner.addresult({"body ID": "1", "status": False, "dvid": {"endpoints": {}, "slow calls": []}},
+        io.StringIO())
+    assert queue.counts()["failed"] == 1
+    assert runner.nlost == 0
+    queue.close()
+
+
+def test_other_workers_leases_keep_worker_waiting(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    queue.addbodies(["1", "2"])
+    runner = QueueRunner(queue, makeoptions(), 1, poll=0.0, worker="a")
+
+    assert queue.claim("b") == "1"
+    assert runner.nextbodies(None, 2) == ["2"]
+    runner.addresult(deferredresult("2"), io.StringIO())
+    assert runner.morecoming()
+    queue.close()
@@ -0,0 +1,108 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import fakedvid
+import pytest
+
+from marktips.marktips import addrunarguments
+from marktips.marktipsbatch import addbatcharguments
+from marktips.marktipswatch import Debouncer, MutationLog, WatchRunner
+from marktips.prefetch import SkeletonPrefetcher
+
+
+@pytest.fixture
+def fake():
+    fake = fakedvid.FakeDVID()
+    serverport = fake.start()
+    yield fake, serverport
+    fake.stop()
+
+
+def watchoptions(serverport):
+    parser = argparse.ArgumentParser()
+    addrunarguments(parser)
+    addbatcharguments(parser)
+    return dict(vars(parser.parse_args([])), serverport=serverport, uuid="test", todoinstance="segmentation_todo")
+
+
+def test_mutation_log_asks_only_for_new_mutations(fake):
+    fake, serverport = fake
+    fake.addmutation({"Action": "merge", "Target": 1, "Labels": [5]})
+    log = MutationLog(serverport, "test", "segmentation", "test")
+
+    assert log.poll() is None
+    assert log.poll() == []
+    mutationid = fake.addmutation({"Action": "split", "Target": 2, "NewLabel": 3})
+    mutations = log.poll()
+
+    assert [mutation["MutationID"] for mutation in mutations] == [mutationid]
+    assert fake.queries["mutations"]["start"] == [str(mutationid)]
+    assert log.poll() == []
+    assert fake.queries["mutations"]["start"] == [str(mutationid + 1)]
+
+
+def test_debouncer():
+    debouncer = Debouncer(quiet=10, maxdelay=30)
+    debouncer.add("1", 5, 0)
+    debouncer.add("1", 4, 8)
+    assert debouncer.ready(15) == []
+    assert debouncer.ready(18) == [("1", 5)]
+
+    # edits that keep coming are run after the max delay
+    for now in range(0, 40, 5):
+        debouncer.add("2", now, now)
+        ready = debouncer.ready(now)
+        if ready:
+            break
+    assert ready == [("2", 30)] and now == 30
+
+
+def test_watch_runner_waits_for_regenerated_skeletons(fake):
+    fake, serverport = fake
+    fake.addbody(1, 50)
+    fake.addbody(2, 50)
+    options = watchoptions(serverport)
+    source = MutationLog(serverport, "test", "segmentation", "test")
+    runner = WatchRunner(source, options, 1, poll=1, quiet=10, maxdelay=100, skeletontimeout=50,
+        untilidle=True)
+    runner.prefetcher = SkeletonPrefetcher(serverport, "test", "segmentation_skeletons", "test")
+
+    runner.check(100)
+    assert not runner.idle
+    runner.check(101)
+    assert runner.idle
+
+    mutation1 = fake.addmutation({"Action": "merge", "Target": 1, "Labels": [7]})
+    mutation2 = fake.addmutation({"Action": "merge", "Target": 2, "Labels": [8]})
+    fake.addbody(2, 60, mutationid=mutation2)
+    runner.check(102)
+    assert runner.nmutations == 2 and not runner.idle
+    assert set(runner.debouncer.bodies) == {"1", "2"}
+
+    # once settled, body 2's skeleton is up to date, body 1's isn't yet
+    runner.check(112)
+    assert list(runner.torun) == ["2"]
+    assert list(runner.skeletonwait) == ["1"]
+
+    fake.addbody(1, 60, mutationid=mutation1)
+    runner.check(113)
+    assert list(runner.torun) == ["2", "1"]
+    assert not runner.skeletonwait and not runner.timedout
+
+
+def test_watch_runner_gives_up_on_stale_skeletons(fake):
+    fake, serverport = fake
+    fake.addbody(1, 50)
+    options = watchoptions(serverport)
+    source = MutationLog(serverport, "test", "segmentation", "test", since=0)
+    runner = WatchRunner(source, options, 1, poll=1, quiet=10, maxdelay=100, skeletontimeout=50)
+    runner.prefetcher = SkeletonPrefetcher(serverport, "test", "segmentation_skeletons", "test")
+
+    fake.addmutation({"Action": "merge", "Target": 1, "Labels": [7]})
+    runner.check(100)
+    runner.check(110)
+    assert list(runner.skeletonwait) == ["1"]
+    runner.check(160)
+    assert runner.timedout == ["1"] and not runner.torun
@@ -0,0 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
+import pstats
+
+from marktips.profiling import profiled
+
+
+def busyworker(n):
+    return sum(i * i for i in range(n))
+
+
+def test_pstats_includes_worker_threads(tmp_path):
+    path = str(tmp_path / "run.prof")
+    with profiled(path, "pstats"):
+        with ThreadPoolExecutor(2) as executor:
+            list(executor.map(busyworker, [10000] * 4))
+
+    calls = {function[2]: entry[1] for function, entry in pstats.Stats(path).stats.items()}
+    assert calls.get("busyworker") == 4
@@ -0,0 +1,62 @@
+import gzip
+import http.server
+import json
+import threading
+
+import pytest
+import requests
+
+from marktips.replay import TrafficRecorder, TrafficReplayer
+
+
+content = json.dumps([{"Pos": [i, i, i]} for i in range(1000)]).encode()
+
+
+@pytest.fixture
+def server():
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            data = gzip.compress(content)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def makesession(adapter):
+    session = requests.Session()
+    session.mount("http://", adapter)
+    return session
+
+
+def test_gzip_round_trip(server, tmp_path):
+    path = str(tmp_path / "run.zip")
+    call = server + "/api/node/abc/segmentation_todo/label/1?u=someone&app=test"
+
+    recorder = TrafficRecorder(path)
+    session = makesession(recorder)
+    assert session.get(call).content == content
+    r = session.get(call, stream=True)
+    r.raw.decode_content = True
+    assert r.raw.read() == content
+    assert "Content-Encoding" not in r.headers
+    recorder.close()
+
+    replayer = TrafficReplayer(path, latencyscale=0)
+    session = makesession(replayer)
+    for stream in [False, True]:
+        r = session.get(call, stream=stream)
+        assert r.status_code == 200
+        assert r.json() == json.loads(content)
+    assert replayer.nmissed == 0